@@ -11,7 +11,6 @@ import numpy as np
 from pathlib import Path
 import subprocess
 import re
-import sounddevice as sd
 import wave
 import time
 import threading
@@ -19,11 +18,25 @@ import threading
 # Agregar rutas del proyecto
 sys.path.append(os.path.join(os.path.dirname(__file__), 'speakerlab'))
 
+from speakerlab.utils.lazy_import import lazy_import
+
+# PortAudio solo se carga al grabar por primera vez
+sd = lazy_import('sounddevice')
+
 from speakerlab.process.processor import FBank
-from speakerlab.utils.builder import dynamic_import
+from speakerlab.utils.enrollment import EnrollmentManager, checkpoint_stamp, scan_speakers
+from speakerlab.utils.flat_checkpoint import flat_path, is_fresh
+from speakerlab.utils.extractor import build_embedding_model
+from speakerlab.utils import timing
+from speakerlab.utils.metrics import MetricsRegistry
+from speakerlab.utils.memory import MemoryTracker, object_bytes
+from speakerlab.process.cascade import CascadeIdentifier, calibrate_band, loo_centroid_scores
+from speakerlab.process.score_norm import GalleryScoreNorm
+from speakerlab.utils.model_selection import measure_latency
+from speakerlab.utils.score_metrics import compute_eer
 
 class AudioComparator:
-    def __init__(self):
+    def __init__(self, metrics=None):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.feature_extractor = FBank(80, sample_rate=16000, mean_nor=True)
         
@@ -44,7 +57,11 @@ class AudioComparator:
                     "pretrained/speech_campplus_sv_zh-cn_16k-common/campplus_cn_common.bin",
                     "pretrained/speech_campplus_sv_zh-cn_16k-common/pytorch_model.bin",
                 ],
-                "thresholds": [0.75, 0.65, 0.50, 0.35]
+                "thresholds": [0.75, 0.65, 0.50, 0.35],
+                # Con normalizar_scores: desviaciones sobre la cohorte (S-norm)
+                "norm_thresholds": [4.0, 3.0, 2.0, 1.0],
+                # Orden de precisión (1 = el más preciso) si no hay EER medido con data/
+                "accuracy_rank": 2
             },
             "2": {
                 "name": "ERes2Net Base",
@@ -61,7 +78,9 @@ class AudioComparator:
                 "model_paths": [
                     "pretrained/speech_eres2net_base_sv_zh-cn_3dspeaker_16k/eres2net_base_model.ckpt",
                 ],
-                "thresholds": [0.70, 0.60, 0.45, 0.30]
+                "thresholds": [0.70, 0.60, 0.45, 0.30],
+                "norm_thresholds": [4.0, 3.0, 2.0, 1.0],
+                "accuracy_rank": 1
             },
             "3": {
                 "name": "Script Original (infer_sv.py)",
@@ -69,6 +88,33 @@ class AudioComparator:
                 "use_original": True
             }
         }
+        
+        # Cada carpeta data/<hablante>/ es un hablante registrado
+        self.data_dir = 'data'
+        # Nombre mostrado (y usado en los permisos) para cada carpeta
+        self.speaker_names = {
+            "daniel_2": "Daniel",
+            "hablante_1": "Hablante_1"
+        }
+        
+        # Modelos cargados y galerías de hablantes, por opción de modelo
+        self.loaded_models = {}
+        self.enrollments = {}
+        self.cascades = {}
+        self.score_norms = {}
+        # Opcional (VOICECOMPARE_SCORE_NORM=1): identificar con scores normalizados
+        # (S-norm) y norm_thresholds
+        self.normalizar_scores = os.environ.get('VOICECOMPARE_SCORE_NORM') == '1'
+        # Protege las cachés anteriores: el precalentamiento las llena en otro hilo
+        self.cache_lock = threading.RLock()
+        # Aciertos/fallos de la caché de modelos y tiempos de carga
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        # RSS al final de cada etapa (audio, fbank, forward) para ver qué crece
+        self.memory = MemoryTracker()
+        # Bytes retenidos por cada caché: se recalculan en segundo plano (ver memory_report)
+        self.held_bytes = {}
+        self.held_time = None
+        self.held_thread = None
 
     def print_header(self):
         """Imprimir header del menú"""
@@ -253,29 +299,91 @@ class AudioComparator:
         print("=" * 50)
         input("Presiona Enter para continuar...")
 
+    @timing.timed('load_audio')
     def load_audio(self, wav_file, target_fs=16000):
         """Cargar y procesar archivo de audio"""
-        wav, fs = torchaudio.load(wav_file)
+        with timing.span('read'):
+            wav, fs = torchaudio.load(wav_file)
         
         if fs != target_fs:
             print(f'[INFO]: Resampling {os.path.basename(wav_file)} from {fs} to {target_fs} Hz')
-            wav = torchaudio.functional.resample(wav, fs, target_fs)
+            with timing.span('resample'):
+                wav = torchaudio.functional.resample(wav, fs, target_fs)
         
         if wav.shape[0] > 1:
             wav = wav[0, :].unsqueeze(0)
         
+        self.memory.sample('load_audio')
         return wav
 
-    def extract_embedding(self, wav_file, model):
-        """Extraer embedding de un archivo de audio"""
+    def extract_features(self, wav_file):
+        """Calcular las fbank de un archivo (compartidas por todos los modelos)"""
         wav = self.load_audio(wav_file)
-        feat = self.feature_extractor(wav).unsqueeze(0).to(self.device)
-        
-        with torch.no_grad():
+        with timing.span('fbank'):
+            feat = self.feature_extractor(wav).unsqueeze(0).to(self.device)
+        self.memory.sample('fbank')
+        return feat
+
+    def embed_features(self, feat, model):
+        """Extraer embedding a partir de fbank ya calculadas"""
+        with timing.span('forward', frames=feat.shape[1]), torch.no_grad():
             embedding = model(feat).detach().squeeze(0).cpu().numpy()
+        self.memory.sample('forward')
         
         return embedding
 
+    def warm_up(self, model_choice, durations=(2, 3, 5)):
+        """Cargar un modelo y pasarle audio sintético de duraciones típicas
+        
+        La primera inferencia de cada longitud reserva memoria e inicializa los
+        kernels; así ese coste no recae en la primera identificación real.
+        
+        Returns:
+            float: segundos empleados
+        """
+        start = time.perf_counter()
+        model, _ = self.load_model(model_choice)
+        for duration in durations:
+            wav = 0.01 * torch.randn(1, int(duration * 16000))
+            feat = self.feature_extractor(wav).unsqueeze(0).to(self.device)
+            self.embed_features(feat, model)
+        return time.perf_counter() - start
+
+    def benchmark_model(self, model_choice, duration=3, repeat=20):
+        """Latencia de fbank + forward de un modelo con audio sintético de `duration` segundos
+        
+        Returns:
+            dict: {p50_ms, p95_ms, mean_ms}
+        """
+        model, _ = self.load_model(model_choice)
+        wav = 0.01 * torch.randn(1, int(duration * 16000))
+        
+        def run():
+            feat = self.feature_extractor(wav).unsqueeze(0).to(self.device)
+            self.embed_features(feat, model)
+        return measure_latency(run, repeat=repeat)
+
+    def gallery_eer(self, model_choice):
+        """EER de un modelo con los archivos de data/ (cada archivo contra los centroides, sin él)
+        
+        Returns:
+            float: EER, o None si no hay al menos dos hablantes con varios archivos
+        """
+        _, embeddings, labels = self.get_enrollment(model_choice).embeddings()
+        if len(set(labels)) < 2:
+            return None
+        target, nontarget = loo_centroid_scores(embeddings, labels)
+        if len(target) == 0 or len(nontarget) == 0:
+            return None
+        scores = np.concatenate([target, nontarget])
+        labels = np.concatenate([np.ones(len(target)), np.zeros(len(nontarget))])
+        return float(compute_eer(scores, labels))
+
+    @timing.timed('extract_embedding')
+    def extract_embedding(self, wav_file, model):
+        """Extraer embedding de un archivo de audio"""
+        return self.embed_features(self.extract_features(wav_file), model)
+
     def cosine_similarity(self, emb1, emb2):
         """Calcular similitud coseno entre dos embeddings"""
         emb1_norm = emb1 / np.linalg.norm(emb1)
@@ -331,48 +439,238 @@ class AudioComparator:
             print(f"❌ Error ejecutando script original: {e}")
             return None
 
-    def compare_with_model(self, model_choice, audio1, audio2):
-        """Comparar usando modelo cargado directamente"""
-        model_config = self.models_config[model_choice]
+    def load_model(self, model_choice):
+        """Cargar un modelo una sola vez y reutilizarlo en las siguientes llamadas
         
+        Returns:
+            tuple: (modelo en modo eval, True si se cargaron pesos preentrenados)
+        """
+        with self.cache_lock:
+            if model_choice not in self.loaded_models:
+                self.metrics.inc('model_cache', result='miss')
+                with self.metrics.timer('model_load_seconds'):
+                    self.loaded_models[model_choice] = self._load_model(model_choice)
+            else:
+                self.metrics.inc('model_cache', result='hit')
+            return self.loaded_models[model_choice]
+
+    def _load_model(self, model_choice):
+        """Construir el modelo y cargar sus pesos (sin caché)"""
+        model_config = self.models_config[model_choice]
         print(f"🤖 Cargando modelo {model_config['name']}...")
         
+        # Los pesos salen del checkpoint: el modelo se construye sin inicializar
+        # (dispositivo meta) y adopta directamente los tensores del checkpoint
+        model = None
+        use_pretrained = False
+        for model_path in model_config['model_paths']:
+            if os.path.exists(model_path) or os.path.exists(flat_path(model_path)):
+                try:
+                    source = flat_path(model_path) if is_fresh(flat_path(model_path), model_path) else model_path
+                    print(f"📦 Cargando pesos desde {os.path.basename(source)}...")
+                    model = build_embedding_model(model_config['config'], model_path, self.device, strict=False)
+                    use_pretrained = True
+                    print("✅ Modelo preentrenado cargado exitosamente")
+                    break
+                    
+                except Exception as e:
+                    print(f"⚠️  Error cargando {model_path}: {e}")
+                    continue
+        
+        if not use_pretrained:
+            print("⚠️  Usando modelo sin entrenar (resultados no confiables)")
+            model = build_embedding_model(model_config['config'], None, self.device)
+        
+        return model, use_pretrained
+
+    def get_enrollment(self, model_choice, watch=True):
+        """Obtener la galería de hablantes de data/ para un modelo
+        
+        Los embeddings se guardan junto al modelo (carpeta enrollment), así que
+        solo se procesan los archivos nuevos o modificados. La caché lleva la
+        huella del checkpoint: si los pesos cambian se vuelve a procesar todo. Sin
+        checkpoint local la galería (pesos aleatorios) solo vive en memoria. Con
+        watch=True la galería se recarga sola cuando cambian las carpetas de data/.
+        """
+        with self.cache_lock:
+            if model_choice in self.enrollments:
+                return self.enrollments[model_choice]
+            
+            model_config = self.models_config[model_choice]
+            cache_dir = os.path.join(os.path.dirname(model_config['model_paths'][0]), 'enrollment')
+            source = self.checkpoint_source(model_choice)
+            if source is None:
+                print("⚠️  Sin pesos preentrenados: la galería no se guardará en disco")
+        
+            def embed(wav_file):
+                # El modelo solo se carga si hay archivos nuevos que procesar
+                model, use_pretrained = self.load_model(model_choice)
+                if not use_pretrained and source is not None:
+                    # No guardar con la huella del checkpoint embeddings de pesos aleatorios
+                    raise RuntimeError(f"no se pudieron cargar los pesos de {source}")
+                return self.extract_embedding(wav_file, model)
+        
+            enrollment = EnrollmentManager(
+                self.data_dir, cache_dir, embed,
+                model_stamp=None if source is None else checkpoint_stamp(source), persist=source is not None)
+            stats = enrollment.sync()
+            if stats['embedded'] or stats['removed']:
+                print(f"📁 Galería actualizada: {stats['embedded']} archivos nuevos, {stats['removed']} eliminados")
+        
+            if watch:
+                enrollment.start_watching(
+                    on_change=lambda st: print(f"\n📁 Galería recargada: {st['embedded']} nuevos, {st['removed']} eliminados"))
+        
+            self.enrollments[model_choice] = enrollment
+            return enrollment
+
+    def get_score_norm(self, model_choice, top_k=None):
+        """Obtener la S-norm de la galería de un modelo
+        
+        La cohorte son los archivos registrados de los demás hablantes. Las
+        estadísticas de los centroides se calculan una vez por galería y se
+        recalculan solo cuando la galería cambia (archivos nuevos, adaptación).
+        
+        Returns:
+            GalleryScoreNorm, o None si algún hablante no tiene cohorte suficiente
+        """
+        enrollment = self.get_enrollment(model_choice)
+        gallery = enrollment.gallery
+        with self.cache_lock:
+            cached = self.score_norms.get(model_choice)
+            if cached is not None and cached[0] is gallery:
+                return cached[1]
+            _, embeddings, labels = enrollment.embeddings()
+            try:
+                norm = GalleryScoreNorm(gallery, embeddings, labels, top_k=top_k)
+            except ValueError as e:
+                print(f"⚠️  Sin normalización de scores: {e}")
+                norm = None
+            self.score_norms[model_choice] = (gallery, norm)
+            return norm
+
+    def memory_report(self, held_max_age=30.0):
+        """Memoria del proceso y bytes retenidos por cada modelo, galería y cascada en caché
+        
+        No espera a cache_lock (el precalentamiento lo retiene mientras sincroniza
+        las galerías) ni recorre los tensores en el hilo que lo pide: los bytes
+        retenidos se recalculan en un hilo aparte como mucho cada held_max_age
+        segundos y se devuelve el último resultado.
+        
+        Returns:
+            dict: el informe de MemoryTracker más 'held' {nombre: bytes}
+        """
+        stale = self.held_time is None or time.monotonic() - self.held_time >= held_max_age
+        if stale and (self.held_thread is None or not self.held_thread.is_alive()):
+            self.held_thread = threading.Thread(target=self._update_held_bytes, daemon=True)
+            self.held_thread.start()
+        report = self.memory.report()
+        report['held'] = dict(self.held_bytes)
+        return report
+
+    def _update_held_bytes(self):
+        """Recorrer las cachés y guardar los bytes que retiene cada una"""
+        # Sin cache_lock: las cachés solo reciben entradas nuevas, nunca se
+        # modifican las existentes, y copiar un dict es atómico
+        models = dict(self.loaded_models)
+        enrollments = dict(self.enrollments)
+        cascades = dict(self.cascades)
+        
+        held = {}
         try:
-            # Crear modelo
-            model_class = dynamic_import(model_config['config']['obj'])
-            model = model_class(**model_config['config']['args'])
-            
-            # Intentar cargar pesos preentrenados
-            use_pretrained = False
-            for model_path in model_config['model_paths']:
-                if os.path.exists(model_path):
-                    try:
-                        print(f"📦 Cargando pesos desde {os.path.basename(model_path)}...")
-                        checkpoint = torch.load(model_path, map_location='cpu', weights_only=True)
-                        
-                        if isinstance(checkpoint, dict):
-                            if 'model' in checkpoint:
-                                model.load_state_dict(checkpoint['model'], strict=False)
-                            elif 'state_dict' in checkpoint:
-                                model.load_state_dict(checkpoint['state_dict'], strict=False)
-                            else:
-                                model.load_state_dict(checkpoint, strict=False)
-                        else:
-                            model.load_state_dict(checkpoint, strict=False)
-                        
-                        use_pretrained = True
-                        print("✅ Modelo preentrenado cargado exitosamente")
-                        break
-                        
-                    except Exception as e:
-                        print(f"⚠️  Error cargando {model_path}: {e}")
-                        continue
+            for choice, (model, _) in models.items():
+                held[f"modelo {self.models_config[choice]['name']}"] = object_bytes(model)
+            for choice, enrollment in enrollments.items():
+                held[f"galería {self.models_config[choice]['name']}"] = object_bytes(enrollment)
+            for key, cascade in cascades.items():
+                held[f"cascada {'->'.join(key)}"] = object_bytes(cascade)
+            self.held_bytes = held
+        finally:
+            self.held_time = time.monotonic()
+
+    def checkpoint_source(self, model_choice):
+        """Archivo de pesos que cargará load_model (el checkpoint o su versión plana), o None"""
+        for model_path in self.models_config[model_choice]['model_paths']:
+            if os.path.exists(model_path):
+                return model_path
+            if os.path.exists(flat_path(model_path)):
+                return str(flat_path(model_path))
+        return None
+
+    def model_available(self, model_choice):
+        """True si hay pesos locales para el modelo"""
+        model_config = self.models_config[model_choice]
+        return any(os.path.exists(path) for path in model_config.get('model_paths', []))
+
+    def get_cascade(self, fast_choice="1", slow_choice="2", max_miss=0.01, max_fa=0.01, min_pairs=100):
+        """Identificador en cascada: modelo rápido primero, el lento solo en casos dudosos
+        
+        La banda de incertidumbre del modelo rápido se calibra con los embeddings
+        ya guardados de data/ (scores contra centroides dejando fuera cada archivo)
+        para que como mucho max_miss de los aciertos y max_fa de los impostores
+        se decidan en la primera etapa. Con menos de min_pairs pares de aciertos o
+        de impostores esos cuantiles no son fiables: la primera etapa no decide
+        nada y todo pasa al modelo lento, que decide con su threshold medio.
+        """
+        key = (fast_choice, slow_choice)
+        with self.cache_lock:
+            if key in self.cascades:
+                return self.cascades[key]
             
-            if not use_pretrained:
-                print("⚠️  Usando modelo sin entrenar (resultados no confiables)")
+            stages = []
+            for choice in (fast_choice, slow_choice):
+                model_config = self.models_config[choice]
+                thresholds = model_config.get("thresholds", [0.70, 0.60, 0.45, 0.30])
+                enrollment = self.get_enrollment(choice)
             
-            model.to(self.device)
-            model.eval()
+                pairs = None
+                if choice == slow_choice:
+                    band = (thresholds[2], thresholds[2])
+                else:
+                    _, embeddings, labels = enrollment.embeddings()
+                    target, nontarget = loo_centroid_scores(embeddings, labels) if labels else ([], [])
+                    pairs = (len(target), len(nontarget))
+                    if min(pairs) >= min_pairs:
+                        band = calibrate_band(target, nontarget, max_miss, max_fa)
+                        print(f"📐 Banda de {model_config['name']} calibrada con {pairs[0]} aciertos "
+                              f"y {pairs[1]} impostores: [{band[0]:.3f}, {band[1]:.3f}]")
+                    else:
+                        # Sin datos suficientes: la primera etapa pasa todos los casos al modelo lento
+                        band = (-np.inf, np.inf)
+                        print(f"⚠️  Banda de {model_config['name']} sin calibrar ({pairs[0]} aciertos y "
+                              f"{pairs[1]} impostores, mínimo {min_pairs}): decide siempre el modelo lento")
+            
+                def identify(feat, choice=choice, enrollment=enrollment):
+                    model, _ = self.load_model(choice)
+                    embedding = self.embed_features(feat, model)
+                    return enrollment.gallery.identify(embedding), embedding
+            
+                stage = {'name': model_config['name'], 'identify': identify, 'band': band, 'choice': choice}
+                if pairs is not None:
+                    stage['pairs'] = pairs
+                stages.append(stage)
+        
+            self.cascades[key] = CascadeIdentifier(stages)
+            return self.cascades[key]
+
+    def speaker_name(self, speaker):
+        """Nombre mostrado para la carpeta de un hablante"""
+        return self.speaker_names.get(speaker, speaker)
+
+    def get_reference_speakers(self):
+        """Archivos de referencia por hablante: {nombre: [archivos]}"""
+        return {
+            self.speaker_name(spk): sorted(os.path.join(self.data_dir, spk, f) for f in files)
+            for spk, files in scan_speakers(self.data_dir).items()
+        }
+
+    @timing.timed('compare_with_model', as_request=True)
+    def compare_with_model(self, model_choice, audio1, audio2):
+        """Comparar usando modelo cargado directamente"""
+        model_config = self.models_config[model_choice]
+        
+        try:
+            model, use_pretrained = self.load_model(model_choice)
             
             # Extraer embeddings
             print("🔄 Procesando audios...")
@@ -380,7 +678,9 @@ class AudioComparator:
             embedding2 = self.extract_embedding(audio2, model)
             
             # Calcular similitud
-            similarity = self.cosine_similarity(embedding1, embedding2)
+            with timing.span('scoring'):
+                similarity = self.cosine_similarity(embedding1, embedding2)
+            timing.annotate(model=model_config['name'], score=float(similarity))
             
             print(f"\n📊 RESULTADOS:")
             print(f"🎯 Similitud coseno: {similarity:.4f}")
@@ -440,31 +740,7 @@ class AudioComparator:
         
         # Cargar modelo
         try:
-            model_class = dynamic_import(model_config['config']['obj'])
-            model = model_class(**model_config['config']['args'])
-            
-            # Cargar pesos preentrenados
-            use_pretrained = False
-            for model_path in model_config['model_paths']:
-                if os.path.exists(model_path):
-                    try:
-                        checkpoint = torch.load(model_path, map_location='cpu', weights_only=True)
-                        if isinstance(checkpoint, dict):
-                            if 'model' in checkpoint:
-                                model.load_state_dict(checkpoint['model'], strict=False)
-                            elif 'state_dict' in checkpoint:
-                                model.load_state_dict(checkpoint['state_dict'], strict=False)
-                            else:
-                                model.load_state_dict(checkpoint, strict=False)
-                        else:
-                            model.load_state_dict(checkpoint, strict=False)
-                        use_pretrained = True
-                        break
-                    except Exception as e:
-                        continue
-            
-            model.to(self.device)
-            model.eval()
+            model, use_pretrained = self.load_model(model_choice)
             
             # Extraer embeddings de todos los archivos
             print("🔄 Extrayendo embeddings...")
@@ -570,6 +846,7 @@ class AudioComparator:
             import traceback
             traceback.print_exc()
 
+    @timing.timed('record_audio')
     def record_audio(self, duration=5, sample_rate=16000, auto_start=False):
         """Grabar audio desde el micrófono
         
@@ -622,11 +899,12 @@ class AudioComparator:
             countdown_thread.start()
             
             # Grabar audio
-            recording = sd.rec(int(duration * sample_rate), 
-                             samplerate=sample_rate, 
-                             channels=1, 
-                             dtype=np.float32)
-            sd.wait()  # Esperar a que termine la grabación
+            with timing.span('record', seconds=duration):
+                recording = sd.rec(int(duration * sample_rate), 
+                                 samplerate=sample_rate, 
+                                 channels=1, 
+                                 dtype=np.float32)
+                sd.wait()  # Esperar a que termine la grabación
             
             countdown_thread.join()
             
@@ -640,7 +918,8 @@ class AudioComparator:
             
             # Convertir a tensor de PyTorch para compatibilidad
             recording_tensor = torch.from_numpy(recording.T)  # Transponer para tener shape [channels, samples]
-            torchaudio.save(temp_filename, recording_tensor, sample_rate)
+            with timing.span('write'):
+                torchaudio.save(temp_filename, recording_tensor, sample_rate)
             
             print(f"💾 Audio grabado y guardado temporalmente en: {temp_filename}")
             
@@ -655,32 +934,13 @@ class AudioComparator:
         print("\n🎤 IDENTIFICACIÓN DE LOCUTOR EN VIVO")
         print("=" * 60)
         
-        # Referencias conocidas (puedes modificar estos archivos según tus necesidades)
-        reference_files = {
-            "Daniel": [
-                "data/daniel_2/record_out (11).wav",
-                "data/daniel_2/audio_01.wav",
-                "data/daniel_2/record_out.wav"
-            ],
-            "Hablante_1": [
-                "data/hablante_1/hablante_1_02.wav",
-                "data/hablante_1/hablante_1_01.wav", 
-                "data/hablante_1/hablante_1_03.wav"
-            ]
-        }
-        
-        # Verificar qué archivos de referencia existen
-        available_references = {}
-        for person, files in reference_files.items():
-            available_files = [f for f in files if os.path.exists(f)]
-            if available_files:
-                available_references[person] = available_files
+        # Cada carpeta de data/ es una persona conocida
+        available_references = self.get_reference_speakers()
         
         if not available_references:
             print("❌ No se encontraron archivos de referencia")
-            print("   Asegúrate de tener archivos en las carpetas:")
-            for person, files in reference_files.items():
-                print(f"   📁 {person}: {files[0][:20]}...")
+            print(f"   Crea una carpeta por persona en {self.data_dir}/ con sus audios:")
+            print(f"   📁 {self.data_dir}/<nombre>/audio_01.wav")
             return
         
         print("👥 PERSONAS CONOCIDAS EN EL SISTEMA:")
@@ -725,6 +985,11 @@ class AudioComparator:
             print("❌ Selección inválida")
             return
         
+        # Preparar la galería antes de grabar (solo procesa archivos nuevos)
+        enrollment = None
+        if not self.models_config[model_choice].get('use_original'):
+            enrollment = self.get_enrollment(model_choice)
+        
         # Grabar audio
         recorded_file = self.record_audio(duration)
         if not recorded_file:
@@ -735,37 +1000,48 @@ class AudioComparator:
         
         # Comparar con cada persona
         results = {}
+        normalized = False
         
-        for person, reference_files in available_references.items():
-            print(f"\n👤 Comparando con {person}...")
-            person_scores = []
-            
-            for ref_file in reference_files[:3]:  # Usar máximo 3 archivos por persona
-                try:
-                    print(f"   📄 Comparando con {os.path.basename(ref_file)}...")
-                    
-                    if self.models_config[model_choice].get('use_original'):
+        if enrollment is not None:
+            # Un embedding de la grabación contra el centroide de cada persona
+            try:
+                model, _ = self.load_model(model_choice)
+                embedding = self.extract_embedding(recorded_file, model)
+                gallery = enrollment.gallery
+                ranking = gallery.identify(embedding)
+                if self.normalizar_scores:
+                    norm = self.get_score_norm(model_choice)
+                    if norm is not None:
+                        gallery = norm.gallery
+                        ranking = norm.identify(embedding)
+                        normalized = True
+                counts = dict(zip(gallery.speakers, gallery.counts))
+                for speaker, score in ranking:
+                    results[self.speaker_name(speaker)] = {'avg_score': score, 'num_files': counts[speaker]}
+            except Exception as e:
+                print(f"❌ Error: {e}")
+        else:
+            for person, reference_files in available_references.items():
+                print(f"\n👤 Comparando con {person}...")
+                person_scores = []
+                
+                for ref_file in reference_files[:3]:  # Usar máximo 3 archivos por persona
+                    try:
+                        print(f"   📄 Comparando con {os.path.basename(ref_file)}...")
                         score = self.compare_with_original_script(model_choice, recorded_file, ref_file)
-                    else:
-                        score = self.compare_with_model(model_choice, recorded_file, ref_file)
-                    
-                    if score is not None:
-                        person_scores.append(score)
-                        print(f"     🎯 Similitud: {score:.4f}")
-                    
-                except Exception as e:
-                    print(f"     ❌ Error: {e}")
-                    continue
-            
-            if person_scores:
-                avg_score = sum(person_scores) / len(person_scores)
-                max_score = max(person_scores)
-                results[person] = {
-                    'avg_score': avg_score,
-                    'max_score': max_score,
-                    'scores': person_scores
-                }
-                print(f"   📊 Promedio: {avg_score:.4f}, Máximo: {max_score:.4f}")
+                        
+                        if score is not None:
+                            person_scores.append(score)
+                            print(f"     🎯 Similitud: {score:.4f}")
+                        
+                    except Exception as e:
+                        print(f"     ❌ Error: {e}")
+                        continue
+                
+                if person_scores:
+                    avg_score = sum(person_scores) / len(person_scores)
+                    results[person] = {'avg_score': avg_score, 'num_files': len(person_scores)}
+                    print(f"   📊 Promedio: {avg_score:.4f}")
         
         # Mostrar resultados finales
         print(f"\n🏆 RESULTADOS DE IDENTIFICACIÓN:")
@@ -781,15 +1057,17 @@ class AudioComparator:
         best_match = sorted_results[0]
         best_person = best_match[0]
         best_avg_score = best_match[1]['avg_score']
-        best_max_score = best_match[1]['max_score']
         
         print(f"🥇 MEJOR COINCIDENCIA: {best_person}")
         print(f"   📊 Score promedio: {best_avg_score:.4f}")
-        print(f"   🎯 Score máximo: {best_max_score:.4f}")
         
         # Interpretar resultado
         model_config = self.models_config[model_choice]
-        thresholds = model_config.get("thresholds", [0.70, 0.60, 0.45, 0.30])
+        if normalized:
+            print("   📐 Score normalizado (S-norm con la cohorte de la galería)")
+            thresholds = model_config.get("norm_thresholds", [4.0, 3.0, 2.0, 1.0])
+        else:
+            thresholds = model_config.get("thresholds", [0.70, 0.60, 0.45, 0.30])
         
         if best_avg_score > thresholds[0]:
             confidence = "🟢 MUY ALTA CONFIANZA - Es muy probable que sea esta persona"
@@ -809,9 +1087,7 @@ class AudioComparator:
         print("-" * 60)
         for person, data in sorted_results:
             print(f"👤 {person}:")
-            print(f"   📊 Promedio: {data['avg_score']:.4f}")
-            print(f"   🎯 Máximo: {data['max_score']:.4f}")
-            print(f"   📈 Scores individuales: {[f'{s:.3f}' for s in data['scores']]}")
+            print(f"   📊 Promedio: {data['avg_score']:.4f} ({data['num_files']} archivos)")
         
         # Limpiar archivo temporal
         try:
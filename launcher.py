@@ -2,10 +2,20 @@
 """
 Launcher para el Sistema de Control por Voz
 Permite elegir entre interfaz de línea de comandos o interfaz gráfica
+
+Uso:
+    python launcher.py                       # menú de selección
+    python launcher.py --metrics-port 9464   # además, métricas Prometheus en /metrics
+    python launcher.py --latency-budget 250  # modelo más preciso con p95 <= 250 ms en esta máquina
+    python launcher.py --score-norm          # identificar con scores normalizados (S-norm)
+    python launcher.py --cascade             # CAM++ primero, el modelo elegido solo en casos dudosos
 """
 
 import sys
 import os
+import argparse
+
+from speakerlab.utils.lazy_import import module_available
 
 def show_launcher_menu():
     """Mostrar menú de selección de interfaz"""
@@ -71,12 +81,12 @@ def check_dependencies():
         'torchaudio': 'Procesamiento de audio'
     }
     
+    # Solo se busca el paquete, sin importarlo: importar torch tarda segundos
     missing = []
     for dep, desc in dependencies.items():
-        try:
-            __import__(dep)
+        if module_available(dep):
             print(f"✅ {desc}")
-        except ImportError:
+        else:
             print(f"❌ {desc} (faltante: {dep})")
             missing.append(dep)
     
@@ -88,8 +98,35 @@ def check_dependencies():
     print("✅ Todas las dependencias están disponibles")
     return True
 
+def parse_args():
+    """Opciones de línea de comandos del launcher"""
+    parser = argparse.ArgumentParser(description='Sistema de Control por Voz')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Exponer métricas en formato Prometheus en http://127.0.0.1:PUERTO/metrics')
+    parser.add_argument('--latency-budget', type=float, default=None,
+                        help='Latencia p95 máxima (ms) del modelo de identificación; se calibra al iniciar')
+    parser.add_argument('--recalibrate', action='store_true',
+                        help='Repetir la calibración del modelo aunque haya una guardada para esta máquina')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Identificación en cascada: CAM++ decide los casos claros y el modelo elegido los dudosos')
+    parser.add_argument('--score-norm', action='store_true',
+                        help='Normalizar los scores de identificación con la cohorte de la galería (S-norm)')
+    return parser.parse_args()
+
 def main():
     """Función principal del launcher"""
+    args = parse_args()
+    if args.metrics_port is not None:
+        # El VoiceController (GUI o CLI) arranca el endpoint al crearse
+        os.environ['VOICECOMPARE_METRICS_PORT'] = str(args.metrics_port)
+    if args.latency_budget is not None:
+        os.environ['VOICECOMPARE_LATENCY_BUDGET_MS'] = str(args.latency_budget)
+    if args.recalibrate:
+        os.environ['VOICECOMPARE_RECALIBRATE'] = '1'
+    if args.cascade:
+        os.environ['VOICECOMPARE_CASCADE'] = '1'
+    if args.score_norm:
+        os.environ['VOICECOMPARE_SCORE_NORM'] = '1'
     try:
         print("🎤 Iniciando Sistema de Control por Voz...")
         
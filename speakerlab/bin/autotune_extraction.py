@@ -0,0 +1,81 @@
+
+"""
+This script tunes the extraction settings of a model on this machine: batch size,
+torch intra-op threads, inter-op threads and worker processes, with short trials on
+synthetic audio and random weights (see speakerlab/utils/autotune.py). The fastest
+setting within the memory cap is cached in <local_model_dir>/<model>/autotune/ for
+this machine, and infer_sv.py uses it from then on.
+Usage:
+    1. tune CAM++ for 3 s utterances with the default memory cap (3/4 of the RAM).
+        `python speakerlab/bin/autotune_extraction.py --model_id iic/speech_campplus_sv_zh-cn_16k-common`
+    2. tune for 10 s utterances within 2 GB, and save every trial.
+        `python speakerlab/bin/autotune_extraction.py --model_id $model_id --duration 10 --memory_cap_mb 2048 --output trials.json`
+"""
+
+import os
+import sys
+import json
+import argparse
+
+try:
+    from speakerlab.utils.autotune import Autotuner, default_memory_cap, load_tuned, save_tuned
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.autotune import Autotuner, default_memory_cap, load_tuned, save_tuned
+
+from speakerlab.utils.extractor import local_model_path
+from speakerlab.utils.hardware import available_cpus
+
+parser = argparse.ArgumentParser(description='Tune batch size, threads and workers of the embedding extraction.')
+parser.add_argument('--model_id', required=True, type=str, help='Model id of infer_sv.supports')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--duration', default=3.0, type=float, help='Seconds of the synthetic utterances')
+parser.add_argument('--memory_cap_mb', default=None, type=float, help='Peak RSS cap of all workers, default 3/4 of the RAM')
+parser.add_argument('--trial_seconds', default=2.0, type=float, help='Timed seconds per trial')
+parser.add_argument('--cpus', default=None, type=int, help='CPUs to use, default is all available to this process')
+parser.add_argument('--force', action='store_true', help='Tune again even if this machine has a cached result')
+parser.add_argument('--output', default=None, type=str, help='Save all the trials to this json file')
+
+
+def describe(setting):
+    return (f"{setting['workers']} worker(s) x {setting['num_threads']} thread(s), "
+            f"{setting['interop_threads']} inter-op, batch {setting['batch_size']}: "
+            f"{setting['utts_per_sec']:.2f} utts/s, RSS {setting['peak_rss_mb'] or 0:.0f} MB")
+
+
+def main():
+    args = parser.parse_args()
+    from speakerlab.bin.infer_sv import supports
+    if args.model_id.startswith('damo/'):
+        args.model_id = args.model_id.replace('damo/', 'iic/', 1)
+    assert args.model_id in supports, "Model id not currently supported."
+    model_dir, _ = local_model_path(args.model_id, args.local_model_dir)
+    memory_cap = args.memory_cap_mb * 2**20 if args.memory_cap_mb is not None else default_memory_cap()
+    settings = {'duration': args.duration, 'memory_cap': memory_cap, 'cpus': args.cpus or available_cpus()}
+
+    tuned = load_tuned(model_dir)
+    if tuned is not None and tuned['settings'] == settings and not args.force:
+        print(f'[INFO]: {args.model_id} is already tuned on this machine (use --force to tune again).')
+    else:
+        print(f"[INFO]: Tuning {args.model_id} on {settings['cpus']} CPUs, {args.duration:g}s utterances, "
+              f"memory cap {'none' if memory_cap is None else '%.0f MB' % (memory_cap / 2**20)}.")
+        try:
+            tuned = Autotuner(supports[args.model_id]['model'], args.duration, memory_cap,
+                              args.trial_seconds, settings['cpus']).run()
+        except RuntimeError as e:
+            print(f'[ERROR]: {e} Raise --memory_cap_mb.')
+            return
+        path = save_tuned(model_dir, tuned, **settings)
+        print(f'[INFO]: {len(tuned["trials"])} trials, result saved to {path}.')
+
+    print(f"[INFO]: Best: {describe(tuned['best'])}")
+    if tuned['single_process'] is not None:
+        print(f"[INFO]: Best in one process: {describe(tuned['single_process'])}")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(tuned['trials'], f, indent=2)
+        print(f'[INFO]: Trials are saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
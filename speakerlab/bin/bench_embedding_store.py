@@ -0,0 +1,109 @@
+
+"""
+This script benchmarks the compressed embedding store (float16 / int8) against the
+float32 path on a synthetic gallery. It reports memory, scoring throughput, score
+error and top-k agreement for every embedding size.
+Usage:
+    `python speakerlab/bin/bench_embedding_store.py --dims 192 512 --gallery_size 100000`
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+
+try:
+    from speakerlab.utils.embedding_store import EmbeddingStore
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.embedding_store import EmbeddingStore
+
+parser = argparse.ArgumentParser(description='Benchmark quantised embedding stores.')
+parser.add_argument('--dims', nargs='+', default=[192, 512], type=int, help='Embedding sizes')
+parser.add_argument('--gallery_size', default=100000, type=int, help='Number of stored embeddings')
+parser.add_argument('--num_queries', default=64, type=int, help='Number of queries')
+parser.add_argument('--num_spks', default=1000, type=int, help='Number of synthetic speakers')
+parser.add_argument('--top_k', default=10, type=int, help='Top-k for search agreement')
+parser.add_argument('--block_size', default=2048, type=int, help='Rows decompressed per block')
+parser.add_argument('--repeat', default=3, type=int, help='Timing repetitions')
+parser.add_argument('--output', default=None, type=str, help='Optional json file for the results')
+
+
+def synthetic_gallery(num, dim, num_spks, seed=0):
+    # clustered embeddings so that the score distribution looks like real trials
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_spks, dim)).astype(np.float32)
+    labels = rng.integers(0, num_spks, num)
+    emb = centers[labels] + 0.8 * rng.standard_normal((num, dim)).astype(np.float32)
+    return emb, labels, centers
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        st = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - st)
+    return out, best
+
+
+def main():
+    args = parser.parse_args()
+    results = []
+    for dim in args.dims:
+        emb, _, centers = synthetic_gallery(args.gallery_size, dim, args.num_spks)
+        rng = np.random.default_rng(1)
+        query = centers[rng.integers(0, args.num_spks, args.num_queries)] + \
+            0.8 * rng.standard_normal((args.num_queries, dim)).astype(np.float32)
+        keys = [str(i) for i in range(args.gallery_size)]
+
+        ref_store = EmbeddingStore('float32')
+        ref_store.add_batch(keys, emb)
+        ref_scores, ref_time = timed(
+            lambda: ref_store.score(query, block_size=args.block_size), args.repeat)
+        ref_top = ref_store.search(query, top_k=args.top_k)
+
+        for dtype in ('float32', 'float16', 'int8'):
+            store = EmbeddingStore(dtype, keep_full=True)
+            store.add_batch(keys, emb)
+            scores, t = timed(lambda: store.score(query, block_size=args.block_size), args.repeat)
+            err = np.abs(scores - ref_scores)
+            top_plain = store.search(query, top_k=args.top_k, rerank=False)
+            top_rerank, t_search = timed(
+                lambda: store.search(query, top_k=args.top_k, block_size=args.block_size), args.repeat)
+
+            def recall(top):
+                hits = [len(set(a[0]) & set(b[0])) for a, b in zip(top, ref_top)]
+                return float(np.mean(hits)) / args.top_k
+
+            res = {
+                'dim': dim,
+                'dtype': dtype,
+                'gallery_size': args.gallery_size,
+                'bytes': store.nbytes,
+                'memory_reduction': ref_store.nbytes / store.nbytes,
+                'scores_per_sec': args.num_queries * args.gallery_size / t,
+                'speedup': ref_time / t,
+                'search_ms_per_query': 1000 * t_search / args.num_queries,
+                'max_abs_err': float(err.max()),
+                'mean_abs_err': float(err.mean()),
+                'topk_recall': recall(top_plain),
+                'topk_recall_rerank': recall(top_rerank),
+            }
+            results.append(res)
+            print(f"[INFO]: dim={dim} {dtype:>7}: {res['bytes']/2**20:8.1f} MiB "
+                  f"(x{res['memory_reduction']:.1f} smaller), {res['scores_per_sec']/1e6:8.1f} M scores/s "
+                  f"(x{res['speedup']:.2f}), max err {res['max_abs_err']:.2e}, "
+                  f"mean err {res['mean_abs_err']:.2e}, top-{args.top_k} recall "
+                  f"{res['topk_recall']:.3f} / {res['topk_recall_rerank']:.3f} (re-ranked)")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'[INFO]: Results are saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+
+"""
+This script benchmarks the speaker embedding architectures of infer_sv.py with random
+weights, so nothing has to be downloaded. Every model runs in a fresh process over a
+sweep of utterance durations, batch sizes and torch thread counts, and the script
+reports p50/p95 latency, throughput, real-time factor and peak RSS. Results can be
+saved as json or csv and compared with a previous run.
+Usage:
+    1. benchmark every model config with the default sweep.
+        `python speakerlab/bin/bench_models.py --output bench.json`
+    2. benchmark two configs on long utterances, 1 and 4 threads.
+        `python speakerlab/bin/bench_models.py --models CAMPPLUS_COMMON ERes2Net_COMMON --durations 10 30 60 --num_threads 1 4`
+    3. compare two saved runs (or the current run against a saved one).
+        `python speakerlab/bin/bench_models.py --compare old.json new.json`
+    4. also profile every setting per layer: Chrome traces and module tables in a dir.
+        `python speakerlab/bin/bench_models.py --models CAMPPLUS_COMMON ERes2NetV2_COMMON --durations 3 10 --profile profiles`
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import torch
+
+try:
+    from speakerlab.utils.memory import PeakRSS
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.memory import PeakRSS
+
+from speakerlab.utils.extractor import build_embedding_model
+
+parser = argparse.ArgumentParser(description='Benchmark speaker embedding models.')
+parser.add_argument('--models', nargs='+', default=None, type=str, help='Model configs of infer_sv.py, default is all')
+parser.add_argument('--durations', nargs='+', default=[1, 3, 10, 30, 60], type=float, help='Utterance durations in seconds')
+parser.add_argument('--batch_sizes', nargs='+', default=[1], type=int, help='Batch sizes')
+parser.add_argument('--num_threads', nargs='+', default=None, type=int, help='Torch thread counts, default is torch.get_num_threads()')
+parser.add_argument('--repeat', default=10, type=int, help='Timed runs per setting')
+parser.add_argument('--warmup', default=2, type=int, help='Untimed runs per setting')
+parser.add_argument('--output', default=None, type=str, help='Save the results to this .json or .csv file')
+parser.add_argument('--profile', default=None, type=str,
+                    help='Also profile each setting and save Chrome traces and module tables to this dir')
+parser.add_argument('--compare', nargs='+', default=None, type=str,
+                    help='Baseline results file, and optionally a second file to compare instead of running')
+
+FRAMES_PER_SECOND = 100  # fbank with a 10 ms shift
+FEAT_DIM = 80
+
+
+def model_configs():
+    # the model config dicts of infer_sv.py by name, e.g. CAMPPLUS_COMMON
+    from speakerlab.bin import infer_sv
+    return {name: conf for name, conf in vars(infer_sv).items()
+            if isinstance(conf, dict) and 'obj' in conf and 'args' in conf}
+
+
+def bench_model(name, conf, durations, batch_sizes, num_threads, repeat, warmup, profile_dir=None):
+    """
+    Runs the sweep of one model, returns one result dict per setting. Meant to
+    run in its own process so that the peak RSS belongs to this model only.
+    """
+    build_start = time.perf_counter()
+    with PeakRSS() as build_mem:
+        model = build_embedding_model(conf)
+    build_time = time.perf_counter() - build_start
+    num_params = sum(p.numel() for p in model.parameters())
+
+    results = []
+    for threads in num_threads:
+        torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            for duration in durations:
+                feat = torch.randn(batch_size, int(duration * FRAMES_PER_SECOND), FEAT_DIM)
+                latency = []
+                with PeakRSS() as mem, torch.no_grad():
+                    for i in range(warmup + repeat):
+                        st = time.perf_counter()
+                        model(feat)
+                        if i >= warmup:
+                            latency.append(time.perf_counter() - st)
+                latency = np.array(latency)
+                res = {
+                    'model': name,
+                    'obj': conf['obj'],
+                    'params': num_params,
+                    'duration': duration,
+                    'batch_size': batch_size,
+                    'num_threads': threads,
+                    'p50_ms': 1000 * float(np.percentile(latency, 50)),
+                    'p95_ms': 1000 * float(np.percentile(latency, 95)),
+                    'mean_ms': 1000 * float(latency.mean()),
+                    'utts_per_sec': batch_size / float(latency.mean()),
+                    'rtf': float(latency.mean()) / (duration * batch_size),
+                    'peak_rss_mb': None if mem.peak is None else mem.peak / 2**20,
+                    # growth over the RSS with the model built: activations and workspace
+                    'peak_rss_delta_mb': None if mem.peak is None else (mem.peak - mem.start) / 2**20,
+                    'build_s': build_time,
+                    'build_peak_rss_mb': None if build_mem.peak is None else build_mem.peak / 2**20,
+                }
+                results.append(res)
+                print(f"[INFO]: {name:28s} {duration:5.1f}s x{batch_size:<3d} {threads:2d} threads: "
+                      f"p50 {res['p50_ms']:8.1f} ms, p95 {res['p95_ms']:8.1f} ms, "
+                      f"{res['utts_per_sec']:7.2f} utts/s, RTF {res['rtf']:.4f}, "
+                      f"peak RSS {res['peak_rss_mb'] or 0:.0f} MB", flush=True)
+                if profile_dir is not None:
+                    profile_setting(model, feat, res, profile_dir)
+    return results
+
+
+def profile_setting(model, feat, res, profile_dir):
+    # after the timed runs, so the profiler does not change the latency numbers
+    from speakerlab.utils.profiling import profile_forward, group_by_type, format_table, save_table
+    os.makedirs(profile_dir, exist_ok=True)
+    prefix = os.path.join(profile_dir, f"{res['model']}_{res['duration']:g}s_bs{res['batch_size']}_t{res['num_threads']}")
+    table = profile_forward(model, feat, warmup=0, trace_path=prefix + '.trace.json')
+    metadata = {k: res[k] for k in ('model', 'obj', 'duration', 'batch_size', 'num_threads')}
+    save_table(table, prefix + '.modules.json', **metadata)
+    save_table(group_by_type(table), prefix + '.types.json', **metadata)
+    print(format_table(group_by_type(table), top=8), flush=True)
+
+
+def save_results(results, path):
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            for k, v in row.items():
+                if k not in ('model', 'obj'):
+                    row[k] = float(v) if v not in ('', 'None') else None
+        return rows
+    with open(path) as f:
+        return json.load(f)
+
+
+def result_key(res):
+    return (res['model'], float(res['duration']), int(res['batch_size']), int(res['num_threads']))
+
+
+def compare_results(baseline, current):
+    """
+    Prints the settings found in both runs with the p50 latency and peak RSS of
+    each and their ratio (current / baseline, below 1 is better).
+    """
+    base = {result_key(r): r for r in baseline}
+    matched = [(base[result_key(r)], r) for r in current if result_key(r) in base]
+    if not matched:
+        print('[INFO]: No common settings between the two runs.')
+        return
+    print(f"{'model':28s} {'dur':>5s} {'bs':>3s} {'thr':>3s} | {'p50 base':>9s} {'p50 new':>9s} {'ratio':>6s} | "
+          f"{'RSS base':>8s} {'RSS new':>8s}")
+    for old, new in matched:
+        ratio = new['p50_ms'] / old['p50_ms'] if old['p50_ms'] else float('nan')
+        print(f"{new['model']:28s} {float(new['duration']):5.1f} {int(new['batch_size']):3d} "
+              f"{int(new['num_threads']):3d} | {old['p50_ms']:9.1f} {new['p50_ms']:9.1f} {ratio:6.2f} | "
+              f"{old['peak_rss_mb'] or 0:8.0f} {new['peak_rss_mb'] or 0:8.0f}")
+    ratios = [new['p50_ms'] / old['p50_ms'] for old, new in matched if old['p50_ms']]
+    print(f'[INFO]: {len(matched)} common settings, geometric mean p50 ratio '
+          f'{float(np.exp(np.mean(np.log(ratios)))):.3f}.')
+
+
+def main():
+    args = parser.parse_args()
+    if args.compare is not None and len(args.compare) == 2:
+        compare_results(load_results(args.compare[0]), load_results(args.compare[1]))
+        return
+
+    configs = model_configs()
+    names = args.models if args.models is not None else list(configs)
+    num_threads = args.num_threads or [torch.get_num_threads()]
+
+    results = []
+    # a fresh process per model: independent peak RSS and allocator state
+    ctx = multiprocessing.get_context('spawn')
+    for name in names:
+        if name not in configs:
+            print(f'[WARNING]: Unknown model config {name}, choose from {", ".join(configs)}.')
+            continue
+        with ctx.Pool(1) as pool:
+            try:
+                results += pool.apply(bench_model, (name, configs[name], args.durations, args.batch_sizes,
+                                                    num_threads, args.repeat, args.warmup, args.profile))
+            except Exception as e:
+                # e.g. an architecture whose module is not part of this tree
+                print(f'[WARNING]: {name} skipped: {e}')
+
+    if args.output is not None and results:
+        save_results(results, args.output)
+        print(f'[INFO]: Results are saved to {args.output}.')
+    if args.compare is not None:
+        compare_results(load_results(args.compare[0]), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+
+"""
+This script benchmarks the preprocessing stages that run before the embedding model:
+wav decoding (torchaudio.load and the alternatives that are installed), resampling to
+16 kHz, FBank, WavReader with and without speed perturbation, and the addnoise /
+addreverb / NoiseReverbCorrupter augmentations. The audio is synthetic and written to
+a temporary directory, so nothing has to be downloaded. Every stage is reported in
+audio-seconds processed per second. With --baseline the run is compared with a saved
+one and the script exits with an error when a stage got slower than --tolerance.
+Usage:
+    1. benchmark every stage on 3 s and 10 s utterances.
+        `python speakerlab/bin/bench_preprocessing.py --durations 3 10 --output prep.json`
+    2. check a change for regressions against a saved run.
+        `python speakerlab/bin/bench_preprocessing.py --durations 3 10 --baseline prep.json --tolerance 0.2`
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import random
+import argparse
+import tempfile
+import numpy as np
+import torch
+import torchaudio
+
+try:
+    from speakerlab.process.processor import FBank, WavReader
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.process.processor import FBank, WavReader
+
+from speakerlab.process.augmentation import addnoise, addreverb, NoiseReverbCorrupter
+
+STAGES = ['decode', 'resample', 'fbank', 'wav_reader', 'augmentation']
+
+parser = argparse.ArgumentParser(description='Benchmark the preprocessing stages.')
+parser.add_argument('--durations', nargs='+', default=[3, 10, 30], type=float, help='Utterance durations in seconds')
+parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='Stages to run')
+parser.add_argument('--repeat', default=10, type=int, help='Timed runs per case')
+parser.add_argument('--num_threads', default=None, type=int, help='Torch threads, default is torch.get_num_threads()')
+parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic audio and of the random choices')
+parser.add_argument('--output', default=None, type=str, help='Save the results to this json file')
+parser.add_argument('--baseline', default=None, type=str, help='Saved results to compare with')
+parser.add_argument('--tolerance', default=0.2, type=float, help='Allowed relative slowdown against the baseline')
+
+
+def synthetic_speech(duration, sample_rate, rng):
+    # harmonic tone with a syllable-rate envelope and a little noise, in [-1, 1]
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    wav = envelope * voiced + 0.05 * rng.standard_normal(len(t))
+    return (0.9 * wav / np.abs(wav).max()).astype(np.float32)
+
+
+def synthetic_rir(sample_rate, rng, rt60=0.4):
+    # exponentially decaying noise, 60 dB down after rt60 seconds
+    t = np.arange(int(rt60 * sample_rate)) / sample_rate
+    return (rng.standard_normal(len(t)) * np.exp(-6.9 * t / rt60)).astype(np.float32)
+
+
+def write_wav(path, wav, sample_rate):
+    # 16-bit PCM with the standard library, so no audio backend is needed to write
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(wav, -1, 1) * 32767).astype('<i2').tobytes())
+
+
+def read_wave(path):
+    with wave.open(path, 'rb') as f:
+        data = f.readframes(f.getnframes())
+    return torch.from_numpy(np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768)
+
+
+def decoders():
+    # name -> fn(path) for every decoder that is installed
+    fns = {'torchaudio.load': lambda path: torchaudio.load(path)[0], 'wave': read_wave}
+    try:
+        import soundfile
+        fns['soundfile.read'] = lambda path: torch.from_numpy(soundfile.read(path, dtype='float32')[0])
+    except ImportError:
+        pass
+    try:
+        from scipy.io import wavfile
+        fns['scipy.io.wavfile'] = lambda path: torch.from_numpy(wavfile.read(path)[1].astype(np.float32) / 32768)
+    except ImportError:
+        pass
+    return fns
+
+
+def timed(fn, repeat):
+    # median seconds per call after one untimed call
+    fn()
+    times = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - st)
+    return float(np.median(times))
+
+
+def build_cases(stages, duration, tmp_dir, rng):
+    """
+    Returns [(stage, case, fn)]; every fn processes `duration` seconds of audio.
+    """
+    wav16k = synthetic_speech(duration, 16000, rng)
+    wav_path = os.path.join(tmp_dir, f'speech_{duration:g}s_16000.wav')
+    write_wav(wav_path, wav16k, 16000)
+    wav = torch.from_numpy(wav16k)
+    cases = []
+
+    if 'decode' in stages:
+        for name, fn in decoders().items():
+            cases.append(('decode', name, lambda fn=fn: fn(wav_path)))
+
+    if 'resample' in stages:
+        for orig_fs in (8000, 44100, 48000):
+            src = torch.from_numpy(synthetic_speech(duration, orig_fs, rng)).unsqueeze(0)
+            cases.append(('resample', f'functional {orig_fs}->16000',
+                          lambda src=src, orig_fs=orig_fs: torchaudio.functional.resample(src, orig_fs, 16000)))
+            # the transform builds its filter kernel once instead of on every call
+            resampler = torchaudio.transforms.Resample(orig_fs, 16000)
+            cases.append(('resample', f'transform {orig_fs}->16000', lambda src=src, r=resampler: r(src)))
+
+    if 'fbank' in stages:
+        fbank = FBank(80, sample_rate=16000, mean_nor=True)
+        cases.append(('fbank', 'FBank(80, mean_nor)', lambda: fbank(wav)))
+
+    if 'wav_reader' in stages:
+        for speed in (False, True):
+            reader = WavReader(sample_rate=16000, duration=duration, speed_pertub=speed)
+            cases.append(('wav_reader', f'speed_pertub={speed}', lambda reader=reader: reader(wav_path)))
+
+    if 'augmentation' in stages:
+        noise = torch.from_numpy(rng.standard_normal(len(wav16k)).astype(np.float32))
+        rir = torch.from_numpy(synthetic_rir(16000, rng))
+        cases.append(('augmentation', 'addnoise', lambda: addnoise(wav, noise)))
+        cases.append(('augmentation', 'addreverb', lambda: addreverb(wav, rir)))
+        noise_path = os.path.join(tmp_dir, 'noise.wav')
+        rir_path = os.path.join(tmp_dir, 'rir.wav')
+        write_wav(noise_path, noise.numpy() / noise.abs().max().item(), 16000)
+        write_wav(rir_path, rir.numpy() / rir.abs().max().item(), 16000)
+        for scp, path in (('noise.scp', noise_path), ('rir.scp', rir_path)):
+            with open(os.path.join(tmp_dir, scp), 'w') as f:
+                f.write(f'{scp.split(".")[0]} {path}\n')
+        corrupter = NoiseReverbCorrupter(noise_prob=1.0, reverb_prob=1.0,
+                                         noise_file=os.path.join(tmp_dir, 'noise.scp'),
+                                         reverb_file=os.path.join(tmp_dir, 'rir.scp'))
+        cases.append(('augmentation', 'NoiseReverbCorrupter(noise+reverb)', lambda: corrupter(wav)))
+    return cases
+
+
+def compare(baseline, results, tolerance):
+    """
+    Prints every case found in both runs, returns the ones that got slower than
+    (1 + tolerance) times the baseline.
+    """
+    key = lambda r: (r['stage'], r['case'], float(r['duration']))
+    base = {key(r): r for r in baseline if r.get('audio_sec_per_sec')}
+    regressions = []
+    for r in results:
+        old = base.get(key(r))
+        if old is None or not r.get('audio_sec_per_sec'):
+            continue
+        ratio = old['audio_sec_per_sec'] / r['audio_sec_per_sec']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  <-- REGRESSION'
+            regressions.append(r)
+        print(f"    {r['stage']:12s} {r['case']:36s} {r['duration']:5.1f}s: "
+              f"{old['audio_sec_per_sec']:10.1f} -> {r['audio_sec_per_sec']:10.1f} audio-s/s (x{1 / ratio:.2f}){flag}")
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    rng = np.random.default_rng(args.seed)
+    random.seed(args.seed)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for duration in args.durations:
+            for stage, case, fn in build_cases(args.stages, duration, tmp_dir, rng):
+                res = {'stage': stage, 'case': case, 'duration': duration}
+                try:
+                    sec = timed(fn, args.repeat)
+                    res.update({'ms_per_call': 1000 * sec, 'audio_sec_per_sec': duration / sec})
+                    print(f"[INFO]: {stage:12s} {case:36s} {duration:5.1f}s: {1000 * sec:9.2f} ms, "
+                          f"{res['audio_sec_per_sec']:10.1f} audio-s/s")
+                except Exception as e:
+                    # e.g. no torchaudio backend, or sox effects not built in
+                    res['error'] = f'{type(e).__name__}: {e}'.splitlines()[0]
+                    print(f"[WARNING]: {stage:12s} {case:36s} {duration:5.1f}s: {res['error']}")
+                results.append(res)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'[INFO]: Results are saved to {args.output}.')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f'[INFO]: Comparison with {args.baseline}:')
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f'[ERROR]: {len(regressions)} cases are more than {args.tolerance:.0%} slower than the baseline.')
+            sys.exit(1)
+        print('[INFO]: No regressions.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+
+"""
+This script measures the cost of AS-norm / S-norm with cached enrollment statistics
+for growing cohort sizes: the per-query cost (one GEMM against the cohort plus an
+argpartition) and the batched normalisation of a whole score matrix.
+Usage:
+    `python speakerlab/bin/bench_score_norm.py --cohort_sizes 10000 50000 100000 --dims 192 512`
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+try:
+    from speakerlab.process.score_norm import ScoreNormalizer
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.process.score_norm import ScoreNormalizer
+
+from speakerlab.utils.embedding_store import l2_normalize
+
+parser = argparse.ArgumentParser(description='Benchmark score normalisation.')
+parser.add_argument('--cohort_sizes', nargs='+', default=[10000, 50000, 100000], type=int, help='Cohort sizes')
+parser.add_argument('--dims', nargs='+', default=[192, 512], type=int, help='Embedding sizes')
+parser.add_argument('--num_enroll', default=100, type=int, help='Number of enrolled speakers')
+parser.add_argument('--num_queries', default=50, type=int, help='Number of single queries to time')
+parser.add_argument('--matrix_tests', default=2000, type=int, help='Test embeddings in the batched matrix')
+parser.add_argument('--top_k', default=300, type=int, help='Top-k for AS-norm')
+
+
+def main():
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    for dim in args.dims:
+        for size in args.cohort_sizes:
+            cohort = rng.standard_normal((size, dim)).astype(np.float32)
+            enroll = l2_normalize(rng.standard_normal((args.num_enroll, dim)))
+            tests = l2_normalize(rng.standard_normal((args.matrix_tests, dim)))
+            enroll_keys = [str(i) for i in range(args.num_enroll)]
+            for mode in ('asnorm', 'snorm'):
+                norm = ScoreNormalizer(cohort, args.top_k, mode)
+                st = time.perf_counter()
+                norm.enroll(enroll_keys, enroll)
+                t_enroll = time.perf_counter() - st
+
+                st = time.perf_counter()
+                for q in tests[:args.num_queries]:
+                    norm.normalize(enroll @ q, enroll_keys, q)
+                t_query = (time.perf_counter() - st) / args.num_queries
+
+                st = time.perf_counter()
+                norm.normalize_matrix(enroll @ tests.T, enroll_keys, tests)
+                t_matrix = (time.perf_counter() - st) / args.matrix_tests
+
+                print(f'[INFO]: dim={dim} cohort={size:>6} {mode}: enroll {1000*t_enroll/args.num_enroll:.3f} ms/spk, '
+                      f'single query {1000*t_query:.3f} ms, batched {1000*t_matrix:.3f} ms/test')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+
+"""
+This script computes EER, minDCF, average precision and the DET curve of a score
+file as written by score_trials.py (`enroll_id test_id score label` per line).
+Usage:
+    1. metrics at the default priors (0.01 and 0.001).
+        `python speakerlab/bin/compute_score_metrics.py --scores scores.txt`
+    2. with 95% bootstrap confidence intervals and a DET plot.
+        `python speakerlab/bin/compute_score_metrics.py --scores scores.txt --bootstrap 200 --nj 8 --det_plot det.png`
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+try:
+    from speakerlab.utils.score_metrics import compute_metrics, bootstrap_metrics
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.score_metrics import compute_metrics, bootstrap_metrics
+
+parser = argparse.ArgumentParser(description='Compute speaker verification metrics.')
+parser.add_argument('--scores', required=True, type=str, help='Score file: enroll_id test_id score label')
+parser.add_argument('--p_target', nargs='+', default=[0.01, 0.001], type=float, help='Target priors for minDCF')
+parser.add_argument('--c_miss', default=1, type=float, help='Cost of a miss')
+parser.add_argument('--c_fa', default=1, type=float, help='Cost of a false alarm')
+parser.add_argument('--bootstrap', default=0, type=int, help='Number of bootstrap replicates, 0 to disable')
+parser.add_argument('--nj', default=1, type=int, help='Processes for the bootstrap')
+parser.add_argument('--det_plot', default=None, type=str, help='Save the DET curve to this image')
+parser.add_argument('--output', default=None, type=str, help='Optional json file for the results')
+
+TARGET_LABELS = ('1', 'target', 'tgt', 'true')
+
+
+def plot_det(fnr, fpr, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from scipy.stats import norm
+
+    eps = 1e-6
+    ticks = [0.001, 0.01, 0.05, 0.2, 0.5, 0.8]
+    fig, ax = plt.subplots(figsize=(5, 5))
+    ax.plot(norm.ppf(np.clip(fpr, eps, 1 - eps)), norm.ppf(np.clip(fnr, eps, 1 - eps)))
+    ax.set_xticks(norm.ppf(ticks))
+    ax.set_xticklabels([f'{t*100:g}' for t in ticks])
+    ax.set_yticks(norm.ppf(ticks))
+    ax.set_yticklabels([f'{t*100:g}' for t in ticks])
+    ax.set_xlabel('False alarm rate (%)')
+    ax.set_ylabel('Miss rate (%)')
+    ax.grid(True)
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main():
+    args = parser.parse_args()
+    data = pd.read_csv(args.scores, sep=r'\s+', header=None, dtype={2: np.float64, 3: str})
+    if data.shape[1] < 4:
+        raise ValueError(f'[ERROR]: {args.scores} should have four columns.')
+    scores = data[2].to_numpy()
+    labels = data[3].str.lower().isin(TARGET_LABELS).to_numpy()
+
+    st = time.perf_counter()
+    res = compute_metrics(scores, labels, args.p_target, args.c_miss, args.c_fa,
+                          det=args.det_plot is not None)
+    print(f"[INFO]: {res['num_trials']} trials ({res['num_targets']} targets) in {time.perf_counter() - st:.2f}s.")
+    print(f"[INFO]: EER = {res['eer']*100:.3f}% (threshold {res['eer_threshold']:.4f})")
+    for p, v in res['min_dcf'].items():
+        print(f"[INFO]: minDCF(p_target={p}) = {v['value']:.4f} (threshold {v['threshold']:.4f})")
+    print(f"[INFO]: AP = {res['ap']:.4f}")
+
+    if args.bootstrap > 0:
+        ci = bootstrap_metrics(scores, labels, args.p_target, args.bootstrap, nj=args.nj,
+                               c_miss=args.c_miss, c_fa=args.c_fa)
+        res['ci95'] = ci
+        print(f"[INFO]: EER 95% CI = [{ci['eer'][0]*100:.3f}%, {ci['eer'][1]*100:.3f}%]")
+        for p, (low, high) in ci['min_dcf'].items():
+            print(f"[INFO]: minDCF(p_target={p}) 95% CI = [{low:.4f}, {high:.4f}]")
+
+    if args.det_plot is not None:
+        fnr, fpr, _ = res.pop('det')
+        plot_det(fnr, fpr, args.det_plot)
+        print(f'[INFO]: DET curve is saved to {args.det_plot}.')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=2)
+        print(f'[INFO]: Results are saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
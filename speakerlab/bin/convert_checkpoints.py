@@ -0,0 +1,61 @@
+
+"""
+This script converts the pickled checkpoints of the local models (.ckpt/.bin/.pt) to
+the flat format of speakerlab/utils/flat_checkpoint.py, written next to them as
+<name>.flat. The loaders memory-map a converted checkpoint instead of unpickling and
+copying it, so model loading is faster and all the processes that load a model share
+one copy of its weights. Checkpoints already converted and unchanged are skipped.
+Usage:
+    1. convert every model found in the local model dir.
+        `python speakerlab/bin/convert_checkpoints.py --local_model_dir pretrained`
+    2. convert some checkpoint files.
+        `python speakerlab/bin/convert_checkpoints.py --ckpts $ckpt1 $ckpt2`
+"""
+
+import os
+import sys
+import time
+import argparse
+
+try:
+    from speakerlab.utils.flat_checkpoint import convert_checkpoint, flat_path, is_fresh
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.flat_checkpoint import convert_checkpoint, flat_path, is_fresh
+
+from speakerlab.utils.extractor import local_model_path
+
+parser = argparse.ArgumentParser(description='Convert checkpoints to memory-mappable flat files.')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--ckpts', nargs='+', default=None, type=str, help='Checkpoints to convert, default is every local model')
+parser.add_argument('--force', action='store_true', help='Convert again even if the flat file is up to date')
+
+
+def find_checkpoints(local_model_dir):
+    from speakerlab.bin.infer_sv import supports
+    ckpts = []
+    for model_id in supports:
+        _, pretrained_model = local_model_path(model_id, local_model_dir)
+        if pretrained_model.is_file() and pretrained_model not in ckpts:
+            ckpts.append(pretrained_model)
+    return ckpts
+
+
+def main():
+    args = parser.parse_args()
+    ckpts = args.ckpts if args.ckpts is not None else find_checkpoints(args.local_model_dir)
+    if not ckpts:
+        print(f'[INFO]: No checkpoints found in {args.local_model_dir}.')
+        return
+    for ckpt in ckpts:
+        if not args.force and is_fresh(flat_path(ckpt), ckpt):
+            print(f'[INFO]: {flat_path(ckpt)} is up to date.')
+            continue
+        st = time.perf_counter()
+        path = convert_checkpoint(ckpt)
+        print(f'[INFO]: {ckpt} -> {path} ({os.path.getsize(path) / 2**20:.1f} MB) '
+              f'in {time.perf_counter() - st:.2f}s.')
+
+
+if __name__ == '__main__':
+    main()
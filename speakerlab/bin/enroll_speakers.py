@@ -0,0 +1,90 @@
+
+"""
+This script enrolls every data/<speaker>/ folder with a local model. Only files that
+are new or changed since the last run are embedded; the manifest, embeddings and
+per-speaker centroids are kept in <model dir>/enrollment, which is where the voice
+control apps load the gallery from, stamped with the checkpoint they were embedded with.
+Usage:
+    1. enroll (or update) once.
+        `python speakerlab/bin/enroll_speakers.py --model_id $model_id --data_dir data`
+    2. keep watching the folders and update the gallery when they change.
+        `python speakerlab/bin/enroll_speakers.py --model_id $model_id --data_dir data --watch`
+"""
+
+import os
+import sys
+import time
+import argparse
+
+try:
+    from speakerlab.utils.enrollment import EnrollmentManager, checkpoint_stamp
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.enrollment import EnrollmentManager, checkpoint_stamp
+
+parser = argparse.ArgumentParser(description='Incrementally enroll speaker folders.')
+parser.add_argument('--model_id', default='iic/speech_eres2net_base_sv_zh-cn_3dspeaker_16k', type=str, help='Model id in modelscope')
+parser.add_argument('--data_dir', default='data', type=str, help='Directory with one sub-directory per speaker')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--cache_dir', default=None, type=str, help='Enrollment dir, default is <model dir>/enrollment')
+parser.add_argument('--watch', action='store_true', help='Keep polling data_dir for changes')
+parser.add_argument('--interval', default=2.0, type=float, help='Polling interval in seconds with --watch')
+
+
+class LazyExtractor(object):
+    # the model is only built when a file actually has to be embedded
+    def __init__(self, model_id, local_model_dir):
+        self.model_id = model_id
+        self.local_model_dir = local_model_dir
+        self.extractor = None
+
+    def __call__(self, wav_file):
+        if self.extractor is None:
+            from speakerlab.utils.extractor import EmbeddingExtractor
+            print(f'[INFO]: Loading {self.model_id}...')
+            self.extractor = EmbeddingExtractor.from_model_id(self.model_id, self.local_model_dir)
+        return self.extractor(wav_file)
+
+
+def report(stats, gallery, elapsed=None):
+    took = '' if elapsed is None else f' in {elapsed:.2f}s'
+    print(f"[INFO]: Embedded {stats['embedded']}, removed {stats['removed']}, re-stamped "
+          f"{stats['restamped']}, failed {stats['failed']} files{took}. "
+          f"Gallery: {dict(zip(gallery.speakers, gallery.counts))}")
+
+
+def main():
+    args = parser.parse_args()
+    cache_dir = args.cache_dir
+    if cache_dir is None:
+        cache_dir = os.path.join(args.local_model_dir, args.model_id.split('/')[1], 'enrollment')
+
+    from speakerlab.utils.extractor import local_model_path
+    from speakerlab.utils.flat_checkpoint import flat_path
+    _, pretrained_model = local_model_path(args.model_id, args.local_model_dir)
+    # the same stamp as the apps: the checkpoint, or its flat copy when only that one is there
+    source = pretrained_model if pretrained_model.exists() else flat_path(pretrained_model)
+    if not source.exists():
+        raise FileNotFoundError(
+            f'{pretrained_model} not found, run infer_sv.py --model_id {args.model_id} first.')
+
+    st = time.perf_counter()
+    manager = EnrollmentManager(args.data_dir, cache_dir, LazyExtractor(args.model_id, args.local_model_dir),
+                                model_stamp=checkpoint_stamp(source))
+    print(f'[INFO]: Loaded {len(manager.gallery)} enrolled speakers from {cache_dir} in {time.perf_counter() - st:.3f}s.')
+    st = time.perf_counter()
+    stats = manager.sync()
+    report(stats, manager.gallery, time.perf_counter() - st)
+
+    if args.watch:
+        print(f'[INFO]: Watching {args.data_dir}, press Ctrl+C to stop.')
+        manager.start_watching(args.interval, lambda stats: report(stats, manager.gallery))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            manager.stop_watching()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+
+"""
+This script compares the models of infer_sv.supports on a labelled directory tree
+(data/<speaker>/*.wav): every model with local weights embeds every file once, all
+pairs of files are scored (same folder = target trial) to get EER and minDCF, and
+the p50/p95 latency and peak memory of the model are measured on a synthetic
+utterance. The results form a Pareto table (accuracy vs. latency vs. memory) and an
+optional plot. Embeddings and measurements are cached per model in --cache_dir, so
+a re-run only embeds new or changed files and only measures new models.
+Usage:
+    1. evaluate every model found in pretrained/ on data/.
+        `python speakerlab/bin/eval_models.py --data_dir data --output pareto.json --plot pareto.png`
+    2. add one model to a previous evaluation (the others come from the cache).
+        `python speakerlab/bin/eval_models.py --data_dir data --model_ids iic/speech_campplus_sv_zh-cn_16k-common`
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import torch
+
+try:
+    from speakerlab.utils.score_metrics import compute_metrics
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.score_metrics import compute_metrics
+
+from speakerlab.utils.embedding_store import EmbeddingStore, l2_normalize
+from speakerlab.utils.extractor import build_embedding_model, local_model_path, get_speaker_files, EmbeddingExtractor
+from speakerlab.utils.flat_checkpoint import flat_path
+from speakerlab.utils.memory import PeakRSS
+
+parser = argparse.ArgumentParser(description='Accuracy / latency / memory comparison of the supported models.')
+parser.add_argument('--data_dir', default='data', type=str, help='Directory of <speaker>/*.wav')
+parser.add_argument('--model_ids', nargs='+', default=None, type=str, help='Models of infer_sv.supports, default is all')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--cache_dir', default='exp/eval_models', type=str, help='Cache of embeddings and measurements')
+parser.add_argument('--random_weights', action='store_true',
+                    help='Also evaluate models without local weights, randomly initialised (pipeline check only)')
+parser.add_argument('--duration', default=3.0, type=float, help='Utterance seconds for the latency measurement')
+parser.add_argument('--repeat', default=10, type=int, help='Timed runs for the latency measurement')
+parser.add_argument('--remeasure', action='store_true', help='Measure latency and memory again even if cached')
+parser.add_argument('--p_target', default=0.01, type=float, help='Target prior of the minDCF')
+parser.add_argument('--output', default=None, type=str, help='Save the table to this .json or .csv file')
+parser.add_argument('--plot', default=None, type=str, help='Save the latency / EER plot to this image')
+
+FRAMES_PER_SECOND = 100
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def model_cache_dir(cache_dir, model_id, pretrained):
+    return os.path.join(cache_dir, model_id.split('/')[1] + ('' if pretrained else '_random'))
+
+
+def read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(obj, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+def checkpoint_stamp(checkpoint):
+    # a re-downloaded or converted checkpoint invalidates the embeddings
+    if checkpoint is None:
+        return None
+    return file_stamp(checkpoint if os.path.exists(checkpoint) else flat_path(checkpoint))
+
+
+def pending_work(model_dir, files, checkpoint, duration, remeasure=False):
+    """
+    What the cache of one model is missing: the keys of the files that are new
+    or changed since they were embedded (all of them if the checkpoint
+    changed), and whether latency and memory have to be measured.
+    Returns (keys, measure, cached model.json).
+    """
+    meta = read_json(os.path.join(model_dir, 'model.json'), {})
+    stamp = checkpoint_stamp(checkpoint)
+    cached = read_json(os.path.join(model_dir, 'files.json'), {}) if meta.get('checkpoint') == stamp else {}
+    todo = [key for key, path in files.items() if cached.get(key) != file_stamp(path)]
+    measured = meta.get('measure', {})
+    measure = remeasure or measured.get('duration') != duration \
+        or measured.get('num_threads') != torch.get_num_threads()
+    return todo, measure, meta
+
+
+def update_model(conf, files, checkpoint, model_dir, duration, repeat, remeasure):
+    """
+    Brings the cache of one model up to date (see pending_work). Runs in its own
+    process, so that the peak RSS belongs to this model only.
+    Returns (number of embedded files, measurement dict).
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    store_dir = os.path.join(model_dir, 'store_float32')
+    todo, measure, meta = pending_work(model_dir, files, checkpoint, duration, remeasure)
+    store = EmbeddingStore.load(store_dir) if len(todo) < len(files) and os.path.isdir(store_dir) else None
+    todo += [key for key in files if key not in todo and (store is None or key not in store)]
+
+    if checkpoint is None:
+        # the same random weights in every run, so cached and new embeddings match
+        torch.manual_seed(0)
+    st = time.perf_counter()
+    with PeakRSS() as build_mem:
+        model = build_embedding_model(conf['model'], checkpoint)
+    build_time = time.perf_counter() - st
+
+    keys, embeddings = [], []
+    if store is not None:
+        # unchanged files come from the cache
+        keep = [k for k in files if k not in todo]
+        if keep:
+            keys += keep
+            embeddings.append(store.get_batch(keep))
+    if todo:
+        extractor = EmbeddingExtractor(model)
+        new = np.stack([extractor(files[key]) for key in todo])
+        keys += todo
+        embeddings.append(l2_normalize(new))
+    new_store = EmbeddingStore('float32')
+    new_store.add_batch(keys, np.concatenate(embeddings, axis=0))
+    new_store.save(store_dir)
+    write_json({key: file_stamp(files[key]) for key in keys}, os.path.join(model_dir, 'files.json'))
+
+    if measure:
+        feat = torch.randn(1, int(duration * FRAMES_PER_SECOND), 80)
+        latency = []
+        with PeakRSS() as mem, torch.no_grad():
+            for i in range(repeat + 2):
+                t = time.perf_counter()
+                model(feat)
+                if i >= 2:
+                    latency.append(time.perf_counter() - t)
+        meta['measure'] = {
+            'duration': duration,
+            'num_threads': torch.get_num_threads(),
+            'p50_ms': 1000 * float(np.percentile(latency, 50)),
+            'p95_ms': 1000 * float(np.percentile(latency, 95)),
+            'build_s': build_time,
+            'params': sum(p.numel() for p in model.parameters()),
+            # RSS of the process with the model built and run, and the part due to the model
+            'peak_rss_mb': None if mem.peak is None else mem.peak / 2**20,
+            'model_rss_mb': None if mem.peak is None else (mem.peak - build_mem.start) / 2**20,
+        }
+    meta['checkpoint'] = checkpoint_stamp(checkpoint)
+    write_json(meta, os.path.join(model_dir, 'model.json'))
+    return len(todo), meta['measure']
+
+
+def score_model(model_dir, keys, labels, p_target):
+    # all pairs of files, same speaker folder = target trial
+    store = EmbeddingStore.load(os.path.join(model_dir, 'store_float32'))
+    emb = store.get_batch(keys)
+    scores = emb @ emb.T
+    labels = np.asarray(labels)
+    iu = np.triu_indices(len(keys), k=1)
+    res = compute_metrics(scores[iu], (labels[:, None] == labels[None, :])[iu], p_targets=(p_target,))
+    return res
+
+
+def pareto_front(rows, objectives=('eer', 'p50_ms', 'model_rss_mb')):
+    # a row is on the front when no other row is at least as good on every objective and better on one
+    def value(row, k):
+        return row[k] if row[k] is not None else float('inf')
+    for row in rows:
+        row['pareto'] = not any(
+            all(value(o, k) <= value(row, k) for k in objectives) and any(value(o, k) < value(row, k) for k in objectives)
+            for o in rows if o is not row)
+    return rows
+
+
+def plot_pareto(rows, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(7, 5))
+    sizes = [20 + (r['model_rss_mb'] or 0) for r in rows]
+    ax.scatter([r['p50_ms'] for r in rows], [100 * r['eer'] for r in rows], s=sizes,
+               c=['tab:red' if r['pareto'] else 'tab:gray' for r in rows], alpha=0.7)
+    for r in rows:
+        ax.annotate(r['model'], (r['p50_ms'], 100 * r['eer']), fontsize=7, xytext=(4, 4), textcoords='offset points')
+    front = sorted((r for r in rows if r['pareto']), key=lambda r: r['p50_ms'])
+    ax.plot([r['p50_ms'] for r in front], [100 * r['eer'] for r in front], 'r--', linewidth=1)
+    ax.set_xlabel('p50 latency (ms)')
+    ax.set_ylabel('EER (%)')
+    ax.set_title('Accuracy vs. latency (marker size: model memory)')
+    ax.grid(True, alpha=0.3)
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main():
+    args = parser.parse_args()
+    from speakerlab.bin.infer_sv import supports
+    model_ids = args.model_ids or list(supports)
+
+    speaker_files = get_speaker_files(args.data_dir)
+    files = {os.path.relpath(f, args.data_dir): f for spk in speaker_files.values() for f in spk}
+    keys = sorted(files)
+    labels = [key.split(os.sep, 1)[0] for key in keys]
+    if len(speaker_files) < 2:
+        raise ValueError(f'[ERROR]: At least two speaker folders are needed in {args.data_dir}.')
+    print(f'[INFO]: {len(keys)} files of {len(speaker_files)} speakers, {len(keys) * (len(keys) - 1) // 2} trials.')
+
+    rows = []
+    ctx = multiprocessing.get_context('spawn')
+    for model_id in model_ids:
+        if model_id not in supports:
+            print(f'[WARNING]: {model_id} is not in infer_sv.supports, skipped.')
+            continue
+        conf = supports[model_id]
+        _, checkpoint = local_model_path(model_id, args.local_model_dir)
+        if checkpoint.exists() or flat_path(checkpoint).exists():
+            pretrained = True
+        elif args.random_weights:
+            checkpoint, pretrained = None, False
+        else:
+            continue
+        model_dir = model_cache_dir(args.cache_dir, model_id, pretrained)
+        todo, measure, meta = pending_work(model_dir, files, checkpoint, args.duration, args.remeasure)
+        if not todo and not measure:
+            # everything is cached, the model is not even loaded
+            embedded, measure = 0, meta['measure']
+        else:
+            with ctx.Pool(1) as pool:
+                try:
+                    embedded, measure = pool.apply(update_model, (conf, files, checkpoint, model_dir,
+                                                                  args.duration, args.repeat, args.remeasure))
+                except Exception as e:
+                    # e.g. an architecture whose module is not part of this tree
+                    print(f'[WARNING]: {model_id} skipped: {e}')
+                    continue
+        res = score_model(model_dir, keys, labels, args.p_target)
+        row = {
+            'model': model_id.split('/')[1],
+            'model_id': model_id,
+            'pretrained': pretrained,
+            'eer': res['eer'],
+            'min_dcf': res['min_dcf'][args.p_target]['value'],
+            'p50_ms': measure['p50_ms'],
+            'p95_ms': measure['p95_ms'],
+            'model_rss_mb': measure['model_rss_mb'],
+            'peak_rss_mb': measure['peak_rss_mb'],
+            'params': measure['params'],
+        }
+        rows.append(row)
+        print(f"[INFO]: {row['model']}: {embedded} files embedded, EER {100 * row['eer']:.2f}%, "
+              f"minDCF {row['min_dcf']:.4f}, p50 {row['p50_ms']:.1f} ms.", flush=True)
+
+    if not rows:
+        print(f'[WARNING]: No model with local weights in {args.local_model_dir}; '
+              f'download them with infer_sv.py or use --random_weights.')
+        return
+
+    pareto_front(rows)
+    rows.sort(key=lambda r: (not r['pareto'], r['eer']))
+    print(f"{'model':48s} {'EER %':>7s} {'minDCF':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'model MB':>8s} pareto")
+    for r in rows:
+        print(f"{r['model'][:48]:48s} {100 * r['eer']:7.2f} {r['min_dcf']:7.4f} {r['p50_ms']:8.1f} "
+              f"{r['p95_ms']:8.1f} {r['model_rss_mb'] or 0:8.0f} {'*' if r['pareto'] else ''}"
+              f"{'' if r['pretrained'] else ' (random weights)'}")
+
+    if args.output is not None:
+        if args.output.endswith('.csv'):
+            with open(args.output, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(rows, f, indent=2)
+        print(f'[INFO]: Table saved to {args.output}.')
+    if args.plot is not None:
+        try:
+            plot_pareto(rows, args.plot)
+            print(f'[INFO]: Plot saved to {args.plot}.')
+        except ImportError:
+            print('[WARNING]: matplotlib is not installed, no plot.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+
+"""
+This script extracts the embeddings of a set of wavs with several local models in one
+pass: every wav is decoded and featurised once, and the shared fbank is fed to all the
+models (optionally in parallel threads with a share of the intra-op threads each).
+One embedding store per model, keyed by the wav paths as given, is written to
+<model dir>/embeddings/store_multi_<dtype>, replacing the one of the previous run once
+the new one is complete.
+Download the models first with infer_sv.py.
+Usage:
+    1. extract a wav list with two models.
+        `python speakerlab/bin/extract_multi_model.py --model_ids $model_id1 $model_id2 --wavs $wav_list`
+    2. run the models in parallel threads, 8 intra-op threads in total.
+        `python speakerlab/bin/extract_multi_model.py --model_ids $model_id1 $model_id2 --wavs $wav_list --parallel --num_threads 8`
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import torch
+
+try:
+    from speakerlab.utils.extractor import MultiModelExtractor, local_model_path
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.extractor import MultiModelExtractor, local_model_path
+
+from speakerlab.utils.embedding_store import EmbeddingStore, SUPPORTED_DTYPES
+
+parser = argparse.ArgumentParser(description='Extract speaker embeddings with several models at once.')
+parser.add_argument('--model_ids', nargs='+', required=True, type=str, help='Model ids in modelscope')
+parser.add_argument('--wavs', nargs='+', required=True, type=str, help='Wav files or one wav list')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--store_dtype', default='float32', choices=SUPPORTED_DTYPES, help='Dtype of the embedding stores')
+parser.add_argument('--parallel', action='store_true', help='Run the models in parallel threads')
+parser.add_argument('--num_threads', default=None, type=int, help='Total intra-op threads, default is torch.get_num_threads()')
+
+
+def read_wavs(wavs):
+    if len(wavs) == 1 and not wavs[0].endswith('.wav'):
+        with open(wavs[0]) as f:
+            return [line.strip() for line in f if line.strip()]
+    return wavs
+
+
+def main():
+    args = parser.parse_args()
+    # a wav listed twice is extracted once
+    wav_files = list(dict.fromkeys(read_wavs(args.wavs)))
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    extractor = MultiModelExtractor.from_model_ids(
+        args.model_ids, args.local_model_dir, device,
+        parallel=args.parallel, num_threads=args.num_threads)
+
+    print(f'[INFO]: Extracting {len(wav_files)} wavs with {len(args.model_ids)} models...')
+    st = time.perf_counter()
+    embeddings = extractor.extract(wav_files)
+    elapsed = time.perf_counter() - st
+    extractor.close()
+
+    # the paths, not the base names: the same file name under two speaker folders must not collide
+    keys = wav_files
+    for model_id, emb in embeddings.items():
+        save_dir, _ = local_model_path(model_id, args.local_model_dir)
+        # its own name: infer_sv.py and extract_sharded.py write stores keyed differently
+        store_dir = str(save_dir / 'embeddings' / ('store_multi_%s' % args.store_dtype))
+        store = EmbeddingStore(args.store_dtype, keep_full=args.store_dtype != 'float32', key_scheme='path')
+        store.add_batch(keys, emb)
+        # the old store is replaced only once the new one is complete
+        tmp_dir = store_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        store.save(tmp_dir)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.replace(tmp_dir, store_dir)
+        print(f'[INFO]: {model_id}: {emb.shape[0]} x {emb.shape[1]} embeddings saved to {store_dir}, '
+              f'model time {extractor.timing[model_id]:.1f}s.')
+
+    feat_time = extractor.timing['features']
+    print(f'[INFO]: Decoding and fbank took {feat_time:.1f}s once instead of '
+          f'{feat_time * len(args.model_ids):.1f}s with one run per model. Total {elapsed:.1f}s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+
+"""
+This script extracts the embeddings of a long wav list with one model in several worker
+processes. The list is sharded by file size (a proxy of duration) across the workers;
+every worker is pinned to its own set of CPUs with as many torch threads, loads the
+model once and writes its embeddings in parts as it goes. The parts are merged into
+one embedding store (<model dir>/embeddings/store_sharded_<dtype> by default) keyed by
+the wav paths; an existing store keyed otherwise is never merged into. A re-run skips the wavs already in the store or in the parts of an interrupted
+run, so a crashed job resumes where it stopped. The throughput of every worker is
+reported to show imbalance.
+Without --workers / --threads the setting tuned by autotune_extraction.py for this
+machine is used (workers, threads, inter-op threads and batch size), else one worker
+per 4 CPUs and batch 1. Download the model first with infer_sv.py.
+Usage:
+    1. extract a wav list with the tuned (or default) number of workers.
+        `python speakerlab/bin/extract_sharded.py --model_id $model_id --wavs $wav_list`
+    2. 4 workers of 2 threads, into an int8 store.
+        `python speakerlab/bin/extract_sharded.py --model_id $model_id --wavs $wav_list --workers 4 --threads 2 --store_dtype int8`
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import multiprocessing
+from queue import Empty
+import numpy as np
+import torch
+
+try:
+    from speakerlab.utils.extractor import build_embedding_model, load_wav, local_model_path
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.extractor import build_embedding_model, load_wav, local_model_path
+
+from speakerlab.process.processor import FBank
+from speakerlab.utils.embedding_store import EmbeddingStore, SUPPORTED_DTYPES
+from speakerlab.utils.flat_checkpoint import flat_path
+from speakerlab.utils.autotune import load_tuned, apply_setting
+from speakerlab.utils.hardware import available_cpus, cpu_sets, pin_process
+
+parser = argparse.ArgumentParser(description='Extract speaker embeddings in several pinned worker processes.')
+parser.add_argument('--model_id', required=True, type=str, help='Model id in modelscope')
+parser.add_argument('--wavs', nargs='+', required=True, type=str, help='Wav files or one wav list')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--workers', default=None, type=int, help='Worker processes, default is the tuned setting')
+parser.add_argument('--threads', default=None, type=int, help='Torch threads per worker, default is the tuned setting')
+parser.add_argument('--store_dir', default=None, type=str, help='Output store, default <model dir>/embeddings/store_sharded_<dtype>')
+parser.add_argument('--store_dtype', default='float32', choices=SUPPORTED_DTYPES, help='Dtype of the embedding store')
+parser.add_argument('--part_size', default=256, type=int, help='Embeddings per part file written by a worker')
+
+
+def read_wavs(wavs):
+    if len(wavs) == 1 and not wavs[0].endswith('.wav'):
+        with open(wavs[0]) as f:
+            return [line.strip() for line in f if line.strip()]
+    return wavs
+
+
+def shard_by_size(wav_files, num_workers):
+    # longest first to the least loaded worker: shards of about the same audio duration
+    shards = [[] for _ in range(num_workers)]
+    loads = [0] * num_workers
+    for wav_file in sorted(wav_files, key=os.path.getsize, reverse=True):
+        i = loads.index(min(loads))
+        shards[i].append(wav_file)
+        loads[i] += os.path.getsize(wav_file)
+    return shards
+
+
+def part_files(part_dir):
+    return sorted(glob.glob(os.path.join(part_dir, '*.npz')))
+
+
+def read_part(path):
+    with np.load(path) as part:
+        return [str(k) for k in part['keys']], part['embeddings']
+
+
+def write_part(part_dir, worker, index, keys, embeddings):
+    # written under a temporary name and renamed: a crash never leaves a partial part
+    path = os.path.join(part_dir, f'w{worker:02d}_{index:05d}_{os.getpid()}.npz')
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, keys=np.array(keys), embeddings=np.stack(embeddings))
+    os.replace(path + '.tmp', path)
+
+
+def extract_shard(worker, model_conf, checkpoint, wav_files, cpus, setting, part_dir, part_size, queue):
+    """
+    Worker process: pins itself to `cpus`, applies `setting` (threads, inter-op
+    threads, batch size), loads the model once and embeds its shard, writing a
+    part every `part_size` wavs. Consecutive wavs with the same number of frames
+    share one forward of up to batch_size utterances (the shards are sorted by
+    size, so equal lengths are adjacent). Puts its statistics on `queue`.
+    """
+    pin_process(cpus)
+    batch_size = apply_setting(setting)
+    st = time.perf_counter()
+    model = build_embedding_model(model_conf, checkpoint)
+    feature_extractor = FBank(80, sample_rate=16000, mean_nor=True)
+    load_time = time.perf_counter() - st
+
+    keys, embeddings, parts, audio_seconds = [], [], 0, 0.0
+    batch = []
+
+    def flush():
+        # padding would change the pooled statistics: only equal lengths are batched
+        with torch.no_grad():
+            out = model(torch.cat([feat for _, feat in batch])).detach().cpu().numpy()
+        keys.extend(wav_file for wav_file, _ in batch)
+        embeddings.extend(out)
+        batch.clear()
+
+    st = time.perf_counter()
+    for wav_file in wav_files:
+        wav = load_wav(wav_file)
+        audio_seconds += wav.shape[1] / 16000
+        feat = feature_extractor(wav).unsqueeze(0)
+        if batch and (len(batch) == batch_size or feat.shape != batch[0][1].shape):
+            flush()
+        batch.append((wav_file, feat))
+        if len(keys) >= part_size:
+            write_part(part_dir, worker, parts, keys[:part_size], embeddings[:part_size])
+            del keys[:part_size], embeddings[:part_size]
+            parts += 1
+    if batch:
+        flush()
+    while keys:
+        write_part(part_dir, worker, parts, keys[:part_size], embeddings[:part_size])
+        del keys[:part_size], embeddings[:part_size]
+        parts += 1
+    elapsed = time.perf_counter() - st
+    queue.put({'worker': worker, 'cpus': cpus, 'files': len(wav_files), 'audio_s': audio_seconds,
+               'load_s': load_time, 'elapsed_s': elapsed})
+
+
+def recover_store(store_dir):
+    # a crash between removing the old store and renaming the new one leaves it complete in .tmp
+    tmp_dir = store_dir.rstrip('/') + '.tmp'
+    if not os.path.exists(store_dir) and os.path.exists(os.path.join(tmp_dir, 'meta.json')):
+        os.replace(tmp_dir, store_dir)
+
+
+def load_existing(store_dir, mmap=False):
+    # the store of a previous run, or None; one keyed by anything but the wav paths is refused
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return None
+    store = EmbeddingStore.load(store_dir, mmap=mmap)
+    if store.key_scheme != 'path':
+        raise ValueError(f'{store_dir} is not keyed by wav paths (key scheme {store.key_scheme}), '
+                         f'pass another --store_dir.')
+    return store
+
+
+def merge_parts(store_dir, part_dir, dtype):
+    """
+    Writes one store with the embeddings of the existing store and of every
+    part, then deletes the parts. Returns the number of embeddings.
+    """
+    existing = load_existing(store_dir)
+    store = EmbeddingStore(dtype, keep_full=True, key_scheme='path')
+    if existing is not None and len(existing):
+        store.add_batch(existing.keys, existing.get_batch(existing.keys))
+    parts = part_files(part_dir)
+    for path in parts:
+        keys, embeddings = read_part(path)
+        # a part merged before a crash may still be there
+        new = [i for i, key in enumerate(keys) if key not in store]
+        if new:
+            store.add_batch([keys[i] for i in new], embeddings[new])
+    # the old store is replaced only once the new one is complete
+    tmp_dir = store_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    store.save(tmp_dir)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    for path in parts:
+        os.remove(path)
+    return len(store)
+
+
+def main():
+    args = parser.parse_args()
+    from speakerlab.bin.infer_sv import supports
+    if args.model_id.startswith('damo/'):
+        args.model_id = args.model_id.replace('damo/', 'iic/', 1)
+    assert args.model_id in supports, "Model id not currently supported."
+    conf = supports[args.model_id]
+    save_dir, checkpoint = local_model_path(args.model_id, args.local_model_dir)
+    if not checkpoint.exists() and not flat_path(checkpoint).exists():
+        raise FileNotFoundError(f'{checkpoint} not found, run infer_sv.py --model_id {args.model_id} first.')
+
+    # its own name: infer_sv.py (keyed by base names) and extract_multi_model.py write store_*
+    store_dir = args.store_dir or str(save_dir / 'embeddings' / ('store_sharded_%s' % args.store_dtype))
+    part_dir = store_dir.rstrip('/') + '.parts'
+
+    # resume: skip the wavs in the store and in the parts of an interrupted run
+    recover_store(store_dir)
+    wav_files = list(dict.fromkeys(read_wavs(args.wavs)))
+    done = set()
+    existing = load_existing(store_dir, mmap=True)
+    if existing is not None:
+        done.update(existing.keys)
+    os.makedirs(part_dir, exist_ok=True)
+    for path in part_files(part_dir):
+        done.update(read_part(path)[0])
+    todo = [f for f in wav_files if f not in done]
+    print(f'[INFO]: {len(wav_files)} wavs, {len(wav_files) - len(todo)} already extracted, {len(todo)} to do.')
+
+    cpus = available_cpus()
+    tuned = load_tuned(save_dir)
+    best = tuned['best'] if tuned is not None else None
+    workers = args.workers or (best['workers'] if best else max(1, cpus // 4))
+    threads = args.threads or (best['num_threads'] if best and workers == best['workers'] else max(1, cpus // workers))
+    # the tuned batch size and inter-op threads were measured for the tuned split only
+    tuned_split = best is not None and (workers, threads) == (best['workers'], best['num_threads'])
+    setting = {'num_threads': threads,
+               'interop_threads': best['interop_threads'] if tuned_split else 1,
+               'batch_size': best['batch_size'] if tuned_split else 1}
+    workers = max(1, min(workers, len(todo)))
+    sets = cpu_sets(workers, threads)
+    print(f"[INFO]: {workers} worker(s) x {threads} thread(s), {setting['interop_threads']} inter-op, "
+          f"batch {setting['batch_size']}"
+          f"{', pinned' if sets else ', not pinned (not enough CPUs or no affinity support)'}"
+          f"{', tuned setting' if tuned_split else ''}.")
+
+    results = []
+    if todo:
+        ctx = multiprocessing.get_context('spawn')
+        stats_queue = ctx.Queue()
+        procs = []
+        wall = time.perf_counter()
+        for i, shard in enumerate(shard_by_size(todo, workers)):
+            p = ctx.Process(target=extract_shard, args=(i, conf['model'], checkpoint, shard, sets[i] if sets else None,
+                                                        setting, part_dir, args.part_size, stats_queue))
+            p.start()
+            procs.append(p)
+        # read the queue before joining: a process does not exit while its results are unread
+        while len(results) < workers and any(p.is_alive() for p in procs):
+            try:
+                results.append(stats_queue.get(timeout=1))
+            except Empty:
+                pass
+        for p in procs:
+            p.join()
+        while True:
+            try:
+                results.append(stats_queue.get_nowait())
+            except Empty:
+                break
+        wall = time.perf_counter() - wall
+
+        failed = [i for i, p in enumerate(procs) if p.exitcode != 0]
+        for r in sorted(results, key=lambda r: r['worker']):
+            print(f"[INFO]: worker {r['worker']:2d} cpus {r['cpus'] if r['cpus'] else '-'}: {r['files']} wavs, "
+                  f"{r['audio_s']:.0f}s audio in {r['elapsed_s']:.1f}s ({r['files'] / r['elapsed_s']:.2f} wavs/s, "
+                  f"RTF {r['elapsed_s'] / max(r['audio_s'], 1e-9):.4f}), model loaded in {r['load_s']:.2f}s")
+        if len(results) > 1:
+            elapsed = [r['elapsed_s'] for r in results]
+            print(f'[INFO]: {len(todo) / max(elapsed):.2f} wavs/s in total ({len(todo) / wall:.2f} with the start-up '
+                  f'of the workers); the slowest worker took {max(elapsed) / min(elapsed):.2f}x the fastest.')
+        if failed:
+            print(f'[WARNING]: Worker(s) {", ".join(map(str, failed))} failed; '
+                  f'their finished parts are kept, run again to resume.')
+
+    if part_files(part_dir):
+        total = merge_parts(store_dir, part_dir, args.store_dtype)
+        print(f'[INFO]: {total} embeddings in {store_dir}.')
+    if not os.listdir(part_dir):
+        os.rmdir(part_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@
 """
 This script will download pretrained models from modelscope (https://www.modelscope.cn/models)
 based on the given model id, and extract embeddings from input audio. 
-Please pre-install "modelscope".
+Models already in --local_model_dir are used in place, "modelscope" is only needed to download.
 Usage:
     1. extract the embedding from the wav file.
         `python infer_sv.py --model_id $model_id --wavs $wav_path `
@@ -10,11 +10,22 @@ Usage:
         `python infer_sv.py --model_id $model_id --wavs $wav_path1 $wav_path2 `
     3. extract embeddings from the wav list.
         `python infer_sv.py --model_id $model_id --wavs $wav_list `
+    4. also pack the embeddings extracted in this run into a compressed store (float16 or int8).
+        `python infer_sv.py --model_id $model_id --wavs $wav_list --store_dtype int8`
+    5. time every stage (read, resample, fbank, forward, save) and write a trace per wav.
+       With a batch size > 1 (see 7) the trace of a wav has its read and fbank and the
+       number of its batch; the forward and save of the batch are in a compute_batch line.
+        `python infer_sv.py --model_id $model_id --wavs $wav_list --timing trace.jsonl`
+    6. profile the model layers on the first wav: Chrome trace and per-module table.
+        `python infer_sv.py --model_id $model_id --wavs $wav_path --profile profile_dir`
+    7. threads, inter-op threads and batch size tuned by autotune_extraction.py for this
+       model on this machine are used automatically; --no_autotune ignores them.
+        `python infer_sv.py --model_id $model_id --wavs $wav_list --no_autotune`
 """
 
 import os
 import sys
-import re
+import time
 import pathlib
 import numpy as np
 import argparse
@@ -27,15 +38,28 @@ except ImportError:
     sys.path.append('%s/../..'%os.path.dirname(__file__))
     from speakerlab.process.processor import FBank
 
-from speakerlab.utils.builder import dynamic_import
-
-from modelscope.hub.snapshot_download import snapshot_download
-from modelscope.pipelines.util import is_official_hub_path
+from speakerlab.utils.extractor import build_embedding_model
+from speakerlab.utils.embedding_store import EmbeddingStore, SUPPORTED_DTYPES
+from speakerlab.process.projection import LinearProjection
+from speakerlab.utils.model_zoo import LocalModelZoo, OFFLINE_ENV
+from speakerlab.utils import timing
+from speakerlab.utils.memory import MemoryTracker
+from speakerlab.utils.autotune import load_tuned, apply_setting
 
 parser = argparse.ArgumentParser(description='Extract speaker embeddings.')
 parser.add_argument('--model_id', default='', type=str, help='Model id in modelscope')
 parser.add_argument('--wavs', nargs='+', type=str, help='Wavs')
 parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--use_projection', action='store_true', help='Apply <model dir>/projection.npz from train_projection.py')
+parser.add_argument('--offline', action='store_true', help=f'Never download, fail if the model is not local (also {OFFLINE_ENV}=1)')
+parser.add_argument('--timing', nargs='?', const='', default=None, type=str,
+                    help='Print per-stage timings, and write one json line per wav to this file if given '
+                         '(plus one per batch when batching)')
+parser.add_argument('--profile', default=None, type=str,
+                    help='Profile the model on the first wav and save a Chrome trace and a module table to this dir')
+parser.add_argument('--no_autotune', action='store_true',
+                    help='Ignore the threads and batch size tuned for this machine by autotune_extraction.py')
+parser.add_argument('--store_dtype', default=None, choices=SUPPORTED_DTYPES, help='Also pack the embeddings of this run into a store of this dtype')
 
 CAMPPLUS_VOX = {
     'obj': 'speakerlab.models.campplus.DTDNN.CAMPPlus',
@@ -224,55 +248,23 @@ supports = {
 
 def main():
     args = parser.parse_args()
-    assert isinstance(args.model_id, str) and \
-        is_official_hub_path(args.model_id), "Invalid modelscope model id."
+    assert isinstance(args.model_id, str), "Invalid modelscope model id."
     if args.model_id.startswith('damo/'):
         args.model_id = args.model_id.replace('damo/','iic/', 1)
     assert args.model_id in supports, "Model id not currently supported."
-    save_dir = os.path.join(args.local_model_dir, args.model_id.split('/')[1])
-    save_dir = pathlib.Path(save_dir)
-    save_dir.mkdir(exist_ok=True, parents=True)
-
     conf = supports[args.model_id]
-    # download models from modelscope according to model_id
-    cache_dir = snapshot_download(
-                args.model_id,
-                revision=conf['revision'],
-                )
-    cache_dir = pathlib.Path(cache_dir)
+    if args.timing is not None:
+        timing.enable(trace_path=args.timing or None)
+
+    # use the local artifacts in place, download only when something is missing
+    st = time.perf_counter()
+    save_dir = LocalModelZoo(args.local_model_dir, args.offline or None).resolve(args.model_id, conf)
+    print(f'[INFO]: Model resolved to {save_dir} in {time.perf_counter() - st:.2f}s.')
 
     embedding_dir = save_dir / 'embeddings'
     embedding_dir.mkdir(exist_ok=True, parents=True)
 
-    # link
-    download_files = ['examples', conf['model_pt']]
-    for src in cache_dir.glob('*'):
-        if re.search('|'.join(download_files), src.name):
-            dst = save_dir / src.name
-            try:
-                if dst.exists():
-                    if dst.is_dir():
-                        import shutil
-                        shutil.rmtree(dst)
-                    else:
-                        dst.unlink()
-            except (FileNotFoundError, PermissionError):
-                pass
-            
-            # Copy instead of symlink for Windows compatibility
-            try:
-                if src.is_dir():
-                    import shutil
-                    shutil.copytree(src, dst)
-                else:
-                    import shutil
-                    shutil.copy2(src, dst)
-            except (PermissionError, FileExistsError) as e:
-                print(f"[WARNING]: Could not copy {src.name}: {e}")
-                continue
-
     pretrained_model = save_dir / conf['model_pt']
-    pretrained_state = torch.load(pretrained_model, map_location='cpu')
 
     if torch.cuda.is_available():
         msg = 'Using gpu for inference.'
@@ -283,41 +275,123 @@ def main():
         print(f'[INFO]: {msg}')
         device = torch.device('cpu')
 
-    # load model
-    model = conf['model']
-    embedding_model = dynamic_import(model['obj'])(**model['args'])
-    embedding_model.load_state_dict(pretrained_state)
-    embedding_model.to(device)
-    embedding_model.eval()
+    # threads and batch size tuned for this model and machine, set before any torch work
+    batch_size = 1
+    tuned = None if args.no_autotune or device.type != 'cpu' else load_tuned(save_dir)
+    if tuned is not None and tuned['single_process'] is not None:
+        setting = tuned['single_process']
+        batch_size = apply_setting(setting)
+        print(f"[INFO]: Using the tuned setting of this machine: {setting['num_threads']} threads, "
+              f"{setting['interop_threads']} inter-op threads, batch size {batch_size}.")
+
+    # load model, memory-mapped when a flat checkpoint was made with convert_checkpoints.py
+    st = time.perf_counter()
+    embedding_model = build_embedding_model(conf['model'], pretrained_model, device)
+    print(f'[INFO]: Model loaded in {time.perf_counter() - st:.2f}s.')
 
     def load_wav(wav_file, obj_fs=16000):
-        wav, fs = torchaudio.load(wav_file)
+        with timing.span('read'):
+            wav, fs = torchaudio.load(wav_file)
         if fs != obj_fs:
             print(f'[WARNING]: The sample rate of {wav_file} is not {obj_fs}, resample it.')
             # Use functional.resample instead of sox_effects for Windows compatibility
-            wav = torchaudio.functional.resample(wav, fs, obj_fs)
+            with timing.span('resample'):
+                wav = torchaudio.functional.resample(wav, fs, obj_fs)
         if wav.shape[0] > 1:
             wav = wav[0, :].unsqueeze(0)
         return wav
 
+    projection = None
+    if args.use_projection:
+        projection = LinearProjection.load(save_dir / 'projection.npz')
+        print(f'[INFO]: Projecting embeddings to {projection.out_dim} dims.')
+
     feature_extractor = FBank(80, sample_rate=16000, mean_nor=True)
+    profiled = []
+    # RSS after every wav, to catch a long extraction job whose memory keeps growing
+    memory = MemoryTracker()
+    def profile_model(feat, wav_file):
+        from speakerlab.utils.profiling import profile_forward, group_by_type, format_table, save_table
+        profile_dir = pathlib.Path(args.profile)
+        profile_dir.mkdir(exist_ok=True, parents=True)
+        # model and utterance length in the file names, so runs can be compared side by side
+        name = '%s_%.1fs' % (conf['model']['obj'].rsplit('.', 1)[-1], feat.shape[1] / 100)
+        table = profile_forward(embedding_model, feat, trace_path=profile_dir / f'{name}.trace.json')
+        metadata = {'model_id': args.model_id, 'wav': str(wav_file), 'frames': feat.shape[1]}
+        save_table(table, profile_dir / f'{name}.modules.json', **metadata)
+        save_table(group_by_type(table), profile_dir / f'{name}.types.json', **metadata)
+        print(f'[INFO]: Time per module type of {name}:')
+        print(format_table(group_by_type(table)))
+        print(f'[INFO]: Profile of {wav_file} is saved to {profile_dir}/{name}.*')
+
     def compute_embedding(wav_file, save=True):
-        # load wav
-        wav = load_wav(wav_file)
-        # compute feat
-        feat = feature_extractor(wav).unsqueeze(0).to(device)
-        # compute embedding
-        with torch.no_grad():
-            embedding = embedding_model(feat).detach().squeeze(0).cpu().numpy()
+        with timing.request('compute_embedding', wav=str(wav_file)):
+            # load wav
+            wav = load_wav(wav_file)
+            # compute feat
+            with timing.span('fbank'):
+                feat = feature_extractor(wav).unsqueeze(0).to(device)
+            if args.profile is not None and not profiled:
+                profiled.append(wav_file)
+                profile_model(feat, wav_file)
+            # compute embedding
+            with timing.span('forward', frames=feat.shape[1]), torch.no_grad():
+                embedding = embedding_model(feat).detach().squeeze(0).cpu().numpy()
+            embedding = finish_embedding(wav_file, embedding, save)
+        memory.mark('compute_embedding')
+        
+        return embedding
+
+    # embeddings of this run, packed into the store with --store_dtype
+    computed = {}
+
+    def finish_embedding(wav_file, embedding, save=True):
+        if projection is not None:
+            with timing.span('projection'):
+                embedding = projection.transform(embedding)
         
+        key = os.path.basename(wav_file).rsplit('.', 1)[0]
+        computed[key] = embedding
         if save:
-            save_path = embedding_dir / (
-            '%s.npy' % (os.path.basename(wav_file).rsplit('.', 1)[0]))
-            np.save(save_path, embedding)
+            save_path = embedding_dir / ('%s.npy' % key)
+            with timing.span('save'):
+                np.save(save_path, embedding)
             print(f'[INFO]: The extracted embedding from {wav_file} is saved to {save_path}.')
-        
         return embedding
 
+    def compute_embeddings(wav_files):
+        # consecutive wavs with the same number of frames share one forward of up to
+        # batch_size utterances; padding would change the pooled statistics
+        # traces: one request per wav (read, fbank) and one per batch (forward, save),
+        # tied by the batch number
+        batch = []
+        batch_index = [0]
+
+        def flush():
+            with timing.request('compute_batch', batch=batch_index[0], size=len(batch)):
+                feats = torch.cat([feat for _, feat in batch])
+                with timing.span('forward', frames=feats.shape[1], batch=len(batch)), torch.no_grad():
+                    embeddings = embedding_model(feats).detach().cpu().numpy()
+                for (wav_file, _), embedding in zip(batch, embeddings):
+                    finish_embedding(wav_file, embedding)
+            memory.mark('compute_embedding')
+            batch.clear()
+            batch_index[0] += 1
+
+        for wav_file in wav_files:
+            with timing.request('compute_embedding', wav=str(wav_file)):
+                wav = load_wav(wav_file)
+                with timing.span('fbank'):
+                    feat = feature_extractor(wav).unsqueeze(0).to(device)
+                # the current batch is flushed first when full or of another length
+                new_batch = bool(batch) and (len(batch) == batch_size or feat.shape != batch[0][1].shape)
+                timing.annotate(batch=batch_index[0] + 1 if new_batch else batch_index[0])
+            if new_batch:
+                flush()
+            batch.append((wav_file, feat))
+        if batch:
+            flush()
+
     # extract embeddings
     print(f'[INFO]: Extracting embeddings...')
 
@@ -356,12 +430,39 @@ def main():
                     wav_list = f.readlines()
             except:
                 raise Exception('[ERROR]: Input should be wav file or wav list.')
-            for wav_path in wav_list:
-                wav_path = wav_path.strip()
-                embedding = compute_embedding(wav_path)
+            wav_list = [wav_path.strip() for wav_path in wav_list if wav_path.strip()]
+            if batch_size > 1 and args.profile is None:
+                compute_embeddings(wav_list)
+            else:
+                for wav_path in wav_list:
+                    embedding = compute_embedding(wav_path)
     else:
         raise Exception('[ERROR]: Supports up to two input files')
 
+    if args.store_dtype is not None:
+        # only the wavs of this run: the dir also holds the .npy of earlier runs, maybe
+        # of another dimension (--use_projection); keep a float32 copy for top-k re-ranking
+        store = EmbeddingStore(args.store_dtype, keep_full=True, key_scheme='basename')
+        if computed:
+            store.add_batch(list(computed), np.stack([e.reshape(-1) for e in computed.values()]))
+        store_dir = embedding_dir / ('store_%s' % args.store_dtype)
+        store.save(store_dir)
+        print(f'[INFO]: {len(store)} embeddings are packed into {store_dir} ({store.nbytes} bytes).')
+
+    report = memory.report()
+    if report['rss'] is not None:
+        print(f"[INFO]: RSS {report['rss'] / 2**20:.0f} MB (start {report['start_rss'] / 2**20:.0f} MB, "
+              f"peak {report['peak_rss'] / 2**20:.0f} MB).")
+    if report['growth']['flagged']:
+        print(f"[WARNING]: RSS grew by {report['growth']['rise'] / 2**20:.0f} MB over the last "
+              f"{report['growth']['marks']} wavs and is still rising.")
+
+    if timing.is_enabled():
+        print('[INFO]: Stage timings:')
+        print(timing.format_stats())
+        if args.timing:
+            print(f'[INFO]: Per-wav traces are appended to {args.timing}.')
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,211 @@
+
+"""
+This script scores a trials file (`enroll_id test_id [label]` per line) with cosine
+similarity. Every unique id is embedded once, taken either from an embedding store,
+a directory of .npy embeddings (as written by infer_sv.py) or by extracting a
+wav.scp with a local model. Trials are sorted by enrollment id and scored in chunks
+by a process pool: every enrollment id of a chunk scores all its test ids with one
+matrix-vector product (one GEMM when the chunk has few ids). The scores are then
+written to the output file in the original trial order.
+Usage:
+    1. score with the embeddings written by infer_sv.py.
+        `python speakerlab/bin/score_trials.py --trials $trials --embedding_dir $embedding_dir --output scores.txt`
+    2. score with a (possibly int8/float16) embedding store.
+        `python speakerlab/bin/score_trials.py --trials $trials --store $store_dir --output scores.txt --nj 8`
+    3. extract the embeddings of a wav.scp (`id path` per line) first.
+        `python speakerlab/bin/score_trials.py --trials $trials --wav_scp $wav_scp --model_id $model_id --output scores.txt`
+    4. apply AS-norm with a cohort of embeddings (store dir or .npy dir).
+        `python speakerlab/bin/score_trials.py --trials $trials --store $store_dir --cohort $cohort_dir --output scores.txt`
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+try:
+    from speakerlab.utils.embedding_store import EmbeddingStore, l2_normalize
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.embedding_store import EmbeddingStore, l2_normalize
+
+from speakerlab.utils.score_metrics import compute_eer
+from speakerlab.process.score_norm import cohort_stats
+
+parser = argparse.ArgumentParser(description='Score a speaker verification trials file.')
+parser.add_argument('--trials', required=True, type=str, help='Trials file: enroll_id test_id [label]')
+parser.add_argument('--output', required=True, type=str, help='Output score file')
+parser.add_argument('--store', default=None, type=str, help='Embedding store dir')
+parser.add_argument('--embedding_dir', default=None, type=str, help='Dir of <id>.npy embeddings')
+parser.add_argument('--wav_scp', default=None, type=str, help='wav.scp to extract the embeddings from')
+parser.add_argument('--model_id', default='iic/speech_eres2net_base_sv_zh-cn_3dspeaker_16k', type=str, help='Model used with --wav_scp')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--nj', default=1, type=int, help='Number of scoring processes')
+parser.add_argument('--cohort', default=None, type=str, help='Cohort embeddings (store dir or .npy dir) for score normalisation')
+parser.add_argument('--norm', default='asnorm', choices=['asnorm', 'snorm'], help='Score normalisation used with --cohort')
+parser.add_argument('--norm_top_k', default=300, type=int, help='Top-k cohort scores for AS-norm')
+parser.add_argument('--chunk_size', default=1000000, type=int, help='Trials scored per task')
+
+TARGET_LABELS = ('1', 'target', 'tgt', 'true')
+
+# set in every worker by _init_worker
+_EMB = None
+_KEYS = None
+_STATS = None
+
+
+def _init_worker(emb, keys, stats=None):
+    global _EMB, _KEYS, _STATS
+    _EMB, _KEYS, _STATS = emb, keys, stats
+
+
+def score_chunk(emb, enroll, test, dense_factor=4):
+    # enroll, test: [N,] row indices into emb (L2-normalised), best sorted by enroll
+    u_enroll, enroll_pos = np.unique(enroll, return_inverse=True)
+    u_test, test_pos = np.unique(test, return_inverse=True)
+    if len(u_enroll) * len(u_test) <= dense_factor * len(enroll):
+        # few ids: one GEMM per chunk, then gather the trials
+        scores = emb[u_test] @ emb[u_enroll].T
+        return scores[test_pos, enroll_pos]
+    order = None
+    if np.any(enroll[1:] < enroll[:-1]):
+        order = np.argsort(enroll, kind='stable')
+        enroll, test = enroll[order], test[order]
+    # one enrollment embedding against the test embeddings of its group
+    bounds = np.append(np.flatnonzero(np.diff(enroll)) + 1, len(enroll))
+    scores = np.empty(len(enroll), dtype=np.float32)
+    st = 0
+    for ed in bounds:
+        scores[st:ed] = emb[test[st:ed]] @ emb[enroll[st]]
+        st = ed
+    if order is not None:
+        scores[order] = scores.copy()
+    return scores
+
+
+def _score_task(task):
+    enroll, test = task
+    scores = score_chunk(_EMB, enroll, test)
+    if _STATS is not None:
+        mean, std = _STATS
+        scores = 0.5 * ((scores - mean[enroll]) / std[enroll] + (scores - mean[test]) / std[test])
+    return scores
+
+
+def _format_task(task):
+    enroll, test, scores, labels = task
+    keys = _KEYS
+    if labels is None:
+        lines = [f'{keys[e]} {keys[t]} {s:.5f}' for e, t, s in zip(enroll, test, scores)]
+    else:
+        lines = [f'{keys[e]} {keys[t]} {s:.5f} {l}' for e, t, s, l in zip(enroll, test, scores, labels)]
+    return '\n'.join(lines) + '\n'
+
+
+def read_trials(trials_file):
+    trials = pd.read_csv(trials_file, sep=r'\s+', header=None, dtype=str)
+    if trials.shape[1] < 2:
+        raise ValueError(f'[ERROR]: {trials_file} should have at least two columns.')
+    labels = trials[2].to_numpy() if trials.shape[1] > 2 else None
+    return trials[0].to_numpy(), trials[1].to_numpy(), labels
+
+
+def load_embeddings(args, keys):
+    if args.store is not None:
+        store = EmbeddingStore.load(args.store, mmap=True)
+    elif args.embedding_dir is not None:
+        store = EmbeddingStore.from_npy_dir(args.embedding_dir)
+    elif args.wav_scp is not None:
+        # torch is only needed when extracting
+        from speakerlab.utils.fileio import load_wav_scp
+        from speakerlab.utils.extractor import EmbeddingExtractor
+        wav_scp = load_wav_scp(args.wav_scp)
+        missing = [k for k in keys if k not in wav_scp]
+        if missing:
+            raise KeyError(f'[ERROR]: {len(missing)} ids are not in {args.wav_scp}, e.g. {missing[:5]}')
+        extractor = EmbeddingExtractor.from_model_id(args.model_id, args.local_model_dir)
+        print(f'[INFO]: Extracting {len(keys)} embeddings with {args.model_id}...')
+        return l2_normalize(np.stack([extractor(wav_scp[k]) for k in keys]))
+    else:
+        raise ValueError('[ERROR]: One of --store, --embedding_dir or --wav_scp is needed.')
+    missing = [k for k in keys if k not in store]
+    if missing:
+        raise KeyError(f'[ERROR]: {len(missing)} ids have no embedding, e.g. {missing[:5]}')
+    return l2_normalize(store.get_batch(keys))
+
+
+def main():
+    args = parser.parse_args()
+    st = time.perf_counter()
+    enroll, test, labels = read_trials(args.trials)
+    num = len(enroll)
+    codes, keys = pd.factorize(np.concatenate([enroll, test]))
+    enroll_idx, test_idx = codes[:num], codes[num:]
+    keys = list(keys)
+    print(f'[INFO]: Read {num} trials with {len(keys)} unique ids in {time.perf_counter() - st:.1f}s.')
+
+    st_emb = time.perf_counter()
+    emb = load_embeddings(args, keys)
+    print(f'[INFO]: Loaded {emb.shape[0]} x {emb.shape[1]} embeddings in {time.perf_counter() - st_emb:.1f}s.')
+
+    stats = None
+    if args.cohort is not None:
+        st_norm = time.perf_counter()
+        if os.path.exists(os.path.join(args.cohort, 'meta.json')):
+            cohort = EmbeddingStore.load(args.cohort, mmap=True)
+        else:
+            cohort = EmbeddingStore.from_npy_dir(args.cohort)
+        cohort = l2_normalize(cohort.get_batch(cohort.keys))
+        top_k = args.norm_top_k if args.norm == 'asnorm' else None
+        stats = cohort_stats(emb, cohort, top_k)
+        print(f'[INFO]: {args.norm} statistics against {cohort.shape[0]} cohort embeddings '
+              f'computed in {time.perf_counter() - st_norm:.1f}s.')
+
+    all_scores = np.empty(num, dtype=np.float32)
+    # grouped by enrollment id: every chunk holds whole groups of consecutive trials
+    order = np.argsort(enroll_idx, kind='stable')
+    score_tasks = (
+        (enroll_idx[order[i:i + args.chunk_size]], test_idx[order[i:i + args.chunk_size]])
+        for i in range(0, num, args.chunk_size))
+    format_tasks = (
+        (enroll_idx[i:i + args.chunk_size], test_idx[i:i + args.chunk_size], all_scores[i:i + args.chunk_size],
+         None if labels is None else labels[i:i + args.chunk_size])
+        for i in range(0, num, args.chunk_size))
+
+    st_score = time.perf_counter()
+    pool = None
+    if args.nj > 1:
+        pool = multiprocessing.Pool(args.nj, initializer=_init_worker, initargs=(emb, keys, stats))
+    else:
+        _init_worker(emb, keys, stats)
+    imap = pool.imap if pool is not None else map
+    try:
+        offset = 0
+        for scores in imap(_score_task, score_tasks):
+            all_scores[order[offset:offset + len(scores)]] = scores
+            offset += len(scores)
+        score_time = time.perf_counter() - st_score
+        # written in the original trial order
+        with open(args.output, 'w') as f:
+            for text in imap(_format_task, format_tasks):
+                f.write(text)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - st_score
+    print(f'[INFO]: Scored {num} trials in {score_time:.1f}s ({num / max(score_time, 1e-9):.0f} trials/s), '
+          f'written in {elapsed - score_time:.1f}s, total {time.perf_counter() - st:.1f}s. '
+          f'Scores are saved to {args.output}.')
+
+    if labels is not None:
+        targets = pd.Series(labels).str.lower().isin(TARGET_LABELS).to_numpy()
+        if targets.any() and not targets.all():
+            print(f'[INFO]: EER = {compute_eer(all_scores, targets) * 100:.2f}%')
+
+
+if __name__ == '__main__':
+    main()
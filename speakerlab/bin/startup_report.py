@@ -0,0 +1,94 @@
+
+"""
+This script reports where the start-up time of the apps goes. Every module is
+imported in a fresh interpreter with `python -X importtime`, and the report lists
+the time of the import and the slowest modules it imports directly (cumulative
+time, including everything they import in turn).
+Usage:
+    1. report the launcher, the CLI and the GUI.
+        `python speakerlab/bin/startup_report.py`
+    2. report some modules, 20 imports each, and save the raw numbers.
+        `python speakerlab/bin/startup_report.py --modules voice_control torch --top 20 --output startup.json`
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+parser = argparse.ArgumentParser(description='Import-time breakdown of the apps.')
+parser.add_argument('--modules', nargs='+', default=['launcher', 'voice_control', 'voice_control_gui', 'audio_comparator_menu'],
+                    type=str, help='Modules to import')
+parser.add_argument('--top', default=10, type=int, help='Number of imports listed per module')
+parser.add_argument('--output', default=None, type=str, help='Also write the report to this json file')
+
+ROOT_DIR = os.path.abspath('%s/../..'%os.path.dirname(__file__))
+
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        imports.append({'name': name.strip(), 'depth': depth,
+                        'self': int(self_us) / 1e6, 'cumulative': int(cumulative_us) / 1e6})
+    return imports
+
+
+def direct_imports(imports, module):
+    """
+    Modules imported directly by `module`. A module is listed after everything it
+    imports, one level deeper. When the import of `module` failed there is no line
+    for it and its pending imports are returned.
+    """
+    stack = []
+    for entry in imports:
+        children = []
+        while stack and stack[-1]['depth'] > entry['depth']:
+            children.append(stack.pop())
+        if entry['name'] == module:
+            return [c for c in children if c['depth'] == entry['depth'] + 1]
+        stack.append(entry)
+    return [e for e in stack if e['depth'] == 1]
+
+
+def import_report(module):
+    st = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - st
+    imports = parse_importtime(proc.stderr)
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1]
+    own = [i for i in imports if i['depth'] == 0 and i['name'] == module]
+    return {'module': module, 'wall': wall, 'error': error, 'imports': len(imports),
+            'cumulative': own[0]['cumulative'] if own else None,
+            'direct': sorted(direct_imports(imports, module), key=lambda i: i['cumulative'], reverse=True)}
+
+
+def main():
+    args = parser.parse_args()
+    reports = []
+    for module in args.modules:
+        report = import_report(module)
+        reports.append(report)
+        status = '' if report['error'] is None else f" (failed: {report['error']})"
+        own = '' if report['cumulative'] is None else f"{report['cumulative']:.3f}s importing, "
+        print(f"[INFO]: import {module}: {own}{report['wall']:.3f}s wall with interpreter start-up, "
+              f"{report['imports']} modules{status}")
+        for i in report['direct'][:args.top]:
+            print(f"    {i['cumulative']:8.3f}s  {i['name']}")
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=1)
+        print(f'[INFO]: Report saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
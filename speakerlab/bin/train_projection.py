@@ -0,0 +1,82 @@
+
+"""
+This script fits a PCA-whitening + LDA projection on embeddings of a labelled
+directory tree (data/<speaker>/*.wav) and saves it next to the model as
+`projection.npz`, where `infer_sv.py --use_projection` picks it up.
+The EER of the raw and projected embeddings is reported on a held-out half of
+every speaker's files before the final projection is refitted on all of them.
+Usage:
+    `python speakerlab/bin/train_projection.py --model_id $model_id --data_dir data --out_dim 128`
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+
+try:
+    from speakerlab.utils.extractor import EmbeddingExtractor, local_model_path
+except ImportError:
+    sys.path.append('%s/../..'%os.path.dirname(__file__))
+    from speakerlab.utils.extractor import EmbeddingExtractor, local_model_path
+
+from speakerlab.process.projection import LinearProjection
+from speakerlab.utils.score_metrics import compute_eer
+
+parser = argparse.ArgumentParser(description='Train a PCA/LDA embedding projection.')
+parser.add_argument('--model_id', default='iic/speech_eres2net_base_sv_zh-cn_3dspeaker_16k', type=str, help='Model id in modelscope')
+parser.add_argument('--data_dir', default='data', type=str, help='Directory with one sub-directory per speaker')
+parser.add_argument('--local_model_dir', default='pretrained', type=str, help='Local model dir')
+parser.add_argument('--out_dim', default=None, type=int, help='Projected dim, default is a quarter of the embedding size')
+parser.add_argument('--pca_dim', default=None, type=int, help='PCA dim before LDA')
+parser.add_argument('--output', default=None, type=str, help='Output file, default is <model dir>/projection.npz')
+
+
+def all_pair_trials(embeddings, labels):
+    emb = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = emb @ emb.T
+    iu = np.triu_indices(len(labels), k=1)
+    labels = np.asarray(labels)
+    return scores[iu], (labels[iu[0]] == labels[iu[1]]).astype(int)
+
+
+def main():
+    args = parser.parse_args()
+    extractor = EmbeddingExtractor.from_model_id(args.model_id, args.local_model_dir)
+
+    print(f'[INFO]: Extracting embeddings from {args.data_dir}...')
+    keys, embeddings, labels = extractor.extract_dir(args.data_dir)
+    labels = np.array(labels)
+    dim = embeddings.shape[1]
+    out_dim = args.out_dim if args.out_dim is not None else dim // 4
+    print(f'[INFO]: {len(keys)} files from {len(set(labels))} speakers, embedding dim {dim}.')
+
+    # hold out every other file of each speaker to measure the EER impact
+    rank = np.zeros(len(labels), dtype=int)
+    for spk in set(labels):
+        idx = np.where(labels == spk)[0]
+        rank[idx] = np.arange(len(idx))
+    train, test = rank % 2 == 0, rank % 2 == 1
+    fit_dim = min(out_dim, train.sum() - 1)
+    if fit_dim < out_dim:
+        print(f'[WARNING]: Only {train.sum()} training files, held-out projection uses dim {fit_dim}.')
+    if test.sum() > 1 and len(set(labels[test])) > 1:
+        proj = LinearProjection().fit(embeddings[train], labels[train], fit_dim, args.pca_dim)
+        eer_raw = compute_eer(*all_pair_trials(embeddings[test], labels[test]))
+        eer_proj = compute_eer(*all_pair_trials(proj.transform(embeddings[test]), labels[test]))
+        print(f'[INFO]: Held-out EER: raw {dim}-d {eer_raw*100:.2f}%, projected {fit_dim}-d {eer_proj*100:.2f}%.')
+    else:
+        print('[WARNING]: Not enough held-out files to measure the EER.')
+
+    out_dim = min(out_dim, len(labels) - 1)
+    proj = LinearProjection().fit(embeddings, labels, out_dim, args.pca_dim)
+    if args.output is None:
+        save_dir, _ = local_model_path(args.model_id, args.local_model_dir)
+        args.output = str(save_dir / 'projection.npz')
+    proj.save(args.output)
+    print(f'[INFO]: Projection {dim} -> {out_dim} saved to {args.output}. '
+          f'Stored vectors and scoring cost shrink by x{dim / out_dim:.1f}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+    Two-stage (or n-stage) cascade for speaker identification.
+
+    A cheap model scores first. When its best score is clearly above or below an
+    uncertainty band, the decision is taken at once. Only borderline cases are
+    re-scored by the next, more expensive model, and the last stage always decides.
+    The band of a stage is calibrated on leave-one-out centroid scores of a
+    labelled set, so it is as narrow as the wanted miss / false-alarm rates allow.
+"""
+
+import time
+import collections
+import numpy as np
+
+from speakerlab.utils.embedding_store import l2_normalize
+
+
+def loo_centroid_scores(embeddings, labels):
+    """
+    Scores every embedding against the centroid of every speaker, its own file left
+    out of its own centroid. Returns (target scores, non-target scores).
+    Speakers with a single file have no leave-one-out centroid and only
+    contribute non-target scores.
+    """
+    emb = l2_normalize(np.asarray(embeddings, dtype=np.float32))
+    labels = np.asarray(labels)
+    speakers, idx = np.unique(labels, return_inverse=True)
+    sums = np.zeros((len(speakers), emb.shape[1]), dtype=np.float32)
+    np.add.at(sums, idx, emb)
+    counts = np.bincount(idx, minlength=len(speakers)).astype(np.float32)
+
+    scores = emb @ (sums / counts[:, None]).T
+    rows = np.arange(len(emb))
+    own = counts[idx] > 1
+    # (sum - e) / (n - 1) is the centroid without e
+    scores_own = (emb * (sums[idx] - emb)).sum(axis=1)[own] / (counts[idx][own] - 1)
+    mask = np.ones_like(scores, dtype=bool)
+    mask[rows, idx] = False
+    return scores_own, scores[mask]
+
+
+def calibrate_band(target_scores, nontarget_scores, max_miss=0.01, max_fa=0.01):
+    """
+    Returns (lower, upper): at most max_miss of the target scores fall at or below
+    lower and at most max_fa of the non-target scores above upper. When both rates
+    can be met by one threshold the band collapses to it.
+    """
+    lower = float(np.quantile(target_scores, max_miss))
+    upper = float(np.quantile(nontarget_scores, 1 - max_fa))
+    if lower >= upper:
+        lower = upper = 0.5 * (lower + upper)
+    return lower, upper
+
+
+class CascadeIdentifier(object):
+    def __init__(self, stages, history=1000):
+        """
+        stages: list of dicts, cheapest first, with
+            'name': name reported in the telemetry,
+            'identify': sample -> (ranking, embedding), ranking being
+                [(speaker, score), ...] sorted by decreasing score. The sample
+                (a wav path, or features shared by all the stages) is passed as is,
+            'band': (lower, upper), accept above upper, reject at or below lower,
+            (-inf, inf) passes every case on to the next stage,
+            'pairs' (optional): (target, non-target) pairs the band was
+                calibrated on, reported in the summary.
+        The last stage decides every case that reaches it, in its band at the midpoint.
+        """
+        assert len(stages) > 0, 'At least one stage is needed.'
+        self.stages = stages
+        # one record per request, the most recent `history` are kept
+        self.telemetry = collections.deque(maxlen=history)
+
+    def identify(self, sample):
+        """
+        Returns a dict with 'speaker' (None when rejected), 'score', 'ranking' and
+        'embedding' of the deciding stage, 'stage' (its name), 'stage_index',
+        'latency' and 'stage_latency' (seconds per stage that ran).
+        """
+        stage_latency = []
+        for i, stage in enumerate(self.stages):
+            st = time.perf_counter()
+            ranking, embedding = stage['identify'](sample)
+            stage_latency.append(time.perf_counter() - st)
+            best, score = ranking[0] if ranking else (None, -np.inf)
+            lower, upper = stage['band']
+            if i == len(self.stages) - 1:
+                accepted = score > 0.5 * (lower + upper)
+            elif score > upper:
+                accepted = True
+            elif score <= lower:
+                accepted = False
+            else:
+                continue
+            break
+        result = {
+            'speaker': best if accepted else None,
+            'score': float(score),
+            'ranking': ranking,
+            'embedding': embedding,
+            'stage': stage['name'],
+            'stage_index': i,
+            'latency': sum(stage_latency),
+            'stage_latency': stage_latency,
+        }
+        self.telemetry.append({k: v for k, v in result.items() if k not in ('ranking', 'embedding')})
+        return result
+
+    def summary(self):
+        """
+        Aggregates the telemetry: requests decided per stage, mean latency, mean
+        latency of every stage when it ran, the latency saved per request
+        compared with always running the last stage alone, and the calibration
+        pairs of every stage that has them.
+        """
+        records = list(self.telemetry)
+        pairs = {s['name']: s['pairs'] for s in self.stages if 'pairs' in s}
+        if not records:
+            return {'requests': 0, 'calibration_pairs': pairs}
+        decided = collections.Counter(r['stage'] for r in records)
+        stage_runs = [[] for _ in self.stages]
+        for r in records:
+            for i, lat in enumerate(r['stage_latency']):
+                stage_runs[i].append(lat)
+        stage_mean = [float(np.mean(v)) if v else None for v in stage_runs]
+        mean_latency = float(np.mean([r['latency'] for r in records]))
+        summary = {
+            'requests': len(records),
+            'decided_by': {s['name']: decided.get(s['name'], 0) for s in self.stages},
+            'mean_latency': mean_latency,
+            'stage_mean_latency': {s['name']: m for s, m in zip(self.stages, stage_mean)},
+            'saved_latency': None,
+            'calibration_pairs': pairs,
+        }
+        if stage_mean[-1] is not None:
+            summary['saved_latency'] = stage_mean[-1] - mean_latency
+        return summary
@@ -0,0 +1,87 @@
+"""
+    Linear projection backend: PCA whitening followed by LDA.
+
+    Both steps are folded into a single [D, d] matrix, so applying the backend
+    at extraction time costs one small GEMM and every stored vector and score
+    afterwards only pays for d dimensions.
+"""
+
+import numpy as np
+
+
+class LinearProjection(object):
+    def __init__(self, mean=None, weight=None):
+        # mean: [D], weight: [D, d]
+        self.mean = mean
+        self.weight = weight
+
+    @property
+    def in_dim(self):
+        return self.weight.shape[0]
+
+    @property
+    def out_dim(self):
+        return self.weight.shape[1]
+
+    def fit(self, embeddings, labels, out_dim, pca_dim=None, eps=1e-6):
+        """
+        embeddings: [N, D], labels: [N,] speaker ids.
+        LDA can produce at most (num_spks - 1) discriminant directions, the
+        remaining out_dim are filled with the leading whitened PCA directions
+        orthogonal to them.
+        """
+        x = np.asarray(embeddings, dtype=np.float64)
+        x = x / np.linalg.norm(x, axis=1, keepdims=True)
+        labels = np.asarray(labels)
+        num, dim = x.shape
+        spks, spk_idx = np.unique(labels, return_inverse=True)
+
+        if pca_dim is None:
+            pca_dim = min(dim, num - 1)
+        pca_dim = min(pca_dim, dim, num - 1)
+        assert out_dim <= pca_dim, \
+            f'out_dim ({out_dim}) must not exceed the PCA dim ({pca_dim}).'
+
+        # PCA whitening
+        mean = x.mean(0)
+        xc = x - mean
+        cov = xc.T @ xc / num
+        eigval, eigvec = np.linalg.eigh(cov)
+        order = np.argsort(eigval)[::-1][:pca_dim]
+        w_pca = eigvec[:, order] / np.sqrt(eigval[order] + eps)
+        y = xc @ w_pca
+
+        # LDA in the whitened space: total covariance is identity, so the
+        # eigenvectors of the between-class covariance solve the LDA problem.
+        counts = np.bincount(spk_idx).astype(np.float64)
+        spk_means = np.zeros((len(spks), pca_dim))
+        np.add.at(spk_means, spk_idx, y)
+        spk_means /= counts[:, None]
+        sb = (spk_means * counts[:, None]).T @ spk_means / num
+        eigval, eigvec = np.linalg.eigh(sb)
+        num_lda = min(out_dim, len(spks) - 1)
+        order = np.argsort(eigval)[::-1][:num_lda]
+        w_lda = eigvec[:, order]
+        if out_dim > num_lda:
+            # whitened axes are already sorted by PCA variance
+            rest = np.eye(pca_dim)[:, :out_dim] - w_lda @ w_lda[:out_dim].T
+            rest, _ = np.linalg.qr(rest)
+            w_lda = np.concatenate([w_lda, rest[:, :out_dim - num_lda]], axis=1)
+
+        self.mean = mean.astype(np.float32)
+        self.weight = (w_pca @ w_lda).astype(np.float32)
+        return self
+
+    def transform(self, embeddings):
+        x = np.asarray(embeddings, dtype=np.float32)
+        x = x / np.linalg.norm(x, axis=-1, keepdims=True)
+        y = (x - self.mean) @ self.weight
+        return y / np.maximum(np.linalg.norm(y, axis=-1, keepdims=True), 1e-12)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, weight=self.weight)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['mean'], data['weight'])
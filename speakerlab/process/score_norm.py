@@ -0,0 +1,146 @@
+"""
+    Adaptive score normalisation (AS-norm) and symmetric normalisation (S-norm).
+
+    The cohort statistics of a side (enrollment or test) are the mean and std
+    of its top-k cosine scores against a cohort set. Enrollment statistics are
+    computed once and cached, so normalising a new test costs one GEMM of the
+    test embedding against the cohort plus an argpartition.
+
+    GalleryScoreNorm applies the same to the centroid scores of a small
+    enrolled gallery (the live apps), with the enrolled files as the cohort.
+"""
+
+import numpy as np
+
+from speakerlab.utils.embedding_store import l2_normalize
+
+
+def cohort_stats(embeddings, cohort, top_k=None, block_size=256):
+    """
+    embeddings: [N, D], cohort: [C, D], both L2-normalised.
+    Returns (mean [N], std [N]) of the top_k cohort scores of every row,
+    all cohort scores are used when top_k is None (S-norm).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    num = embeddings.shape[0]
+    mean = np.empty(num, dtype=np.float32)
+    std = np.empty(num, dtype=np.float32)
+    use_top = top_k is not None and top_k < cohort.shape[0]
+    for st in range(0, num, block_size):
+        ed = min(st + block_size, num)
+        scores = embeddings[st:ed] @ cohort.T
+        if use_top:
+            scores = np.partition(scores, -top_k, axis=1)[:, -top_k:]
+        mean[st:ed] = scores.mean(axis=1)
+        std[st:ed] = scores.std(axis=1)
+    return mean, np.maximum(std, 1e-6)
+
+
+class ScoreNormalizer(object):
+    def __init__(self, cohort, top_k=300, mode='asnorm'):
+        assert mode in ('asnorm', 'snorm'), f'Unknown mode {mode}.'
+        self.cohort = l2_normalize(cohort)
+        self.top_k = top_k if mode == 'asnorm' else None
+        self.mode = mode
+        # enrollment key -> (mean, std)
+        self.cache = {}
+
+    def stats(self, embeddings):
+        return cohort_stats(l2_normalize(np.atleast_2d(embeddings)), self.cohort, self.top_k)
+
+    def enroll(self, keys, embeddings):
+        # precompute and cache the cohort statistics of enrolled speakers
+        mean, std = self.stats(embeddings)
+        for key, m, s in zip(keys, mean, std):
+            self.cache[key] = (float(m), float(s))
+
+    def enroll_stats(self, keys):
+        mean = np.array([self.cache[k][0] for k in keys], dtype=np.float32)
+        std = np.array([self.cache[k][1] for k in keys], dtype=np.float32)
+        return mean, std
+
+    def normalize(self, scores, enroll_keys, test_embedding):
+        """
+        scores: [E] raw scores of one test embedding against the enrolled keys.
+        Returns the normalised scores [E].
+        """
+        e_mean, e_std = self.enroll_stats(enroll_keys)
+        t_mean, t_std = self.stats(test_embedding)
+        scores = np.asarray(scores, dtype=np.float32)
+        return 0.5 * ((scores - e_mean) / e_std + (scores - t_mean[0]) / t_std[0])
+
+    def normalize_matrix(self, scores, enroll_keys, test_embeddings):
+        """
+        scores: [E, T] raw score matrix, enroll_keys: E cached keys,
+        test_embeddings: [T, D]. Returns the normalised [E, T] matrix.
+        """
+        e_mean, e_std = self.enroll_stats(enroll_keys)
+        t_mean, t_std = self.stats(test_embeddings)
+        scores = np.asarray(scores, dtype=np.float32)
+        return 0.5 * ((scores - e_mean[:, None]) / e_std[:, None] + \
+            (scores - t_mean[None, :]) / t_std[None, :])
+
+    def save_cache(self, path):
+        keys = list(self.cache.keys())
+        mean, std = self.enroll_stats(keys)
+        np.savez(path, keys=np.array(keys), mean=mean, std=std,
+                 top_k=-1 if self.top_k is None else self.top_k,
+                 cohort_size=self.cohort.shape[0])
+
+    def load_cache(self, path):
+        data = np.load(path)
+        top_k = None if int(data['top_k']) < 0 else int(data['top_k'])
+        if top_k != self.top_k or int(data['cohort_size']) != self.cohort.shape[0]:
+            raise ValueError(f'{path} was computed with another cohort configuration.')
+        for key, m, s in zip(data['keys'], data['mean'], data['std']):
+            self.cache[str(key)] = (float(m), float(s))
+
+
+def _top_stats(scores, top_k=None):
+    # mean and std of the top_k scores of the last axis (all of them when top_k is None)
+    if top_k is not None and top_k < scores.shape[-1]:
+        scores = np.partition(scores, -top_k, axis=-1)[..., -top_k:]
+    return scores.mean(axis=-1), np.maximum(scores.std(axis=-1), 1e-6)
+
+
+class GalleryScoreNorm(object):
+    """
+    S-norm (AS-norm with top_k) of the centroid scores of a SpeakerGallery. The
+    cohort is the enrolled files; the cohort of a speaker leaves out its own
+    files, so a genuine test is not normalised against its own speaker. The
+    centroid statistics are computed once for the gallery snapshot, a test
+    costs one product against the cohort. Raises ValueError when a speaker has
+    fewer than min_cohort cohort files.
+    """
+    def __init__(self, gallery, embeddings, labels, top_k=None, min_cohort=3):
+        labels = np.asarray(labels)
+        self.gallery = gallery
+        self.top_k = top_k
+        self.cohort = l2_normalize(np.asarray(embeddings, dtype=np.float32))
+        self.masks = [labels != speaker for speaker in gallery.speakers]
+        short = [spk for spk, mask in zip(gallery.speakers, self.masks) if mask.sum() < min_cohort]
+        if not gallery.speakers or short:
+            raise ValueError(f'Fewer than {min_cohort} cohort files for {", ".join(short) or "the gallery"}.')
+        # centroid scores are on the scale of gallery.score (mean of the normalised embeddings)
+        scores = gallery.centroids @ self.cohort.T
+        stats = [_top_stats(scores[i, mask], top_k) for i, mask in enumerate(self.masks)]
+        self.e_mean = np.array([m for m, _ in stats], dtype=np.float32)
+        self.e_std = np.array([s for _, s in stats], dtype=np.float32)
+
+    def normalize(self, embedding, scores):
+        """
+        embedding: [D] test embedding, scores: [S] its raw scores against the
+        gallery speakers. Returns the normalised scores [S].
+        """
+        test_scores = self.cohort @ l2_normalize(np.asarray(embedding, dtype=np.float32))
+        stats = [_top_stats(test_scores[mask], self.top_k) for mask in self.masks]
+        t_mean = np.array([m for m, _ in stats], dtype=np.float32)
+        t_std = np.array([s for _, s in stats], dtype=np.float32)
+        scores = np.asarray(scores, dtype=np.float32)
+        return 0.5 * ((scores - self.e_mean) / self.e_std + (scores - t_mean) / t_std)
+
+    def identify(self, embedding):
+        # like SpeakerGallery.identify, with normalised scores
+        scores = self.normalize(embedding, self.gallery.score(embedding))
+        order = np.argsort(-scores)
+        return [(self.gallery.speakers[i], float(scores[i])) for i in order]
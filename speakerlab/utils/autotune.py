@@ -0,0 +1,216 @@
+"""
+    Autotuner of extraction jobs: batch size, intra-op threads
+    (torch.set_num_threads), inter-op threads and worker processes.
+
+    Every trial starts `workers` fresh processes (inter-op threads can only be
+    set before a process runs torch work), pins them to disjoint CPU sets, builds
+    the model with random weights (speed does not depend on the weights) and
+    runs forwards of `batch_size` synthetic utterances for `trial_seconds` after
+    a warm-up, all workers starting together. A trial scores the utterances per
+    second of all workers together and the sum of their peak RSS.
+
+    The space is searched one coordinate at a time instead of as a full grid:
+        1. workers x threads (workers * threads <= available CPUs), batch 1
+        2. batch sizes 2, 4, 8, ... for the best split, while each is at
+           least MIN_GAIN faster than the previous best
+        3. inter-op threads 2 for the best of those, under the same rule
+    Steps 2 and 3 are also run for the best single-process split, used by
+    extraction jobs that run one process. Settings over the memory cap are
+    discarded.
+
+    The result is cached per (model, machine) in
+    <model dir>/autotune/<hardware fingerprint id>.json and read by
+    load_tuned(model_dir).
+"""
+
+import os
+import json
+import time
+import multiprocessing
+
+import torch
+
+from speakerlab.utils.memory import PeakRSS
+from speakerlab.utils.hardware import (available_cpus, cpu_sets, pin_process, total_memory,
+                                       hardware_fingerprint, fingerprint_id)
+
+FRAMES_PER_SECOND = 100
+FEAT_DIM = 80
+MAX_BATCH_SIZE = 64
+# a refinement (larger batch, inter-op threads) has to beat the current best by this factor,
+# so that trial noise does not decide
+MIN_GAIN = 1.02
+
+_barrier = None
+
+
+def default_memory_cap():
+    # 3/4 of the physical memory, None when it is not known
+    total = total_memory()
+    return None if total is None else int(0.75 * total)
+
+
+def _init_trial(threads, interop_threads, barrier):
+    global _barrier
+    _barrier = barrier
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(interop_threads)
+
+
+def _trial_worker(task):
+    model_conf, cpus, batch_size, duration, trial_seconds, warmup = task
+    from speakerlab.utils.extractor import build_embedding_model
+    pin_process(cpus)
+    with PeakRSS() as mem:
+        model = build_embedding_model(model_conf)
+        feat = torch.randn(batch_size, int(duration * FRAMES_PER_SECOND), FEAT_DIM)
+        with torch.no_grad():
+            for _ in range(warmup):
+                model(feat)
+            _barrier.wait()
+            utts, start = 0, time.perf_counter()
+            while time.perf_counter() - start < trial_seconds:
+                model(feat)
+                utts += batch_size
+            elapsed = time.perf_counter() - start
+    return utts, elapsed, mem.peak
+
+
+def run_trial(model_conf, setting, duration=3.0, trial_seconds=2.0, warmup=2):
+    """
+    Throughput and memory of one setting {batch_size, num_threads,
+    interop_threads, workers}. Returns the setting with utts_per_sec and
+    peak_rss_mb (sum over the workers) added.
+    """
+    workers, threads = setting['workers'], setting['num_threads']
+    sets = cpu_sets(workers, threads) or [None] * workers
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(workers)
+    with ctx.Pool(workers, initializer=_init_trial,
+                  initargs=(threads, setting['interop_threads'], barrier)) as pool:
+        tasks = [(model_conf, cpus, setting['batch_size'], duration, trial_seconds, warmup) for cpus in sets]
+        # a task blocks on the barrier until all are running, so each runs in its own worker
+        results = pool.map(_trial_worker, tasks, chunksize=1)
+    utts = sum(r[0] for r in results)
+    elapsed = max(r[1] for r in results)
+    peaks = [r[2] for r in results]
+    res = dict(setting)
+    res['utts_per_sec'] = utts / elapsed
+    res['peak_rss_mb'] = None if None in peaks else sum(peaks) / 2**20
+    res['pinned'] = sets[0] is not None
+    return res
+
+
+def worker_splits(cpus):
+    # (workers, threads per worker) with powers of two and `cpus` itself, workers * threads <= cpus
+    counts = sorted({2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus} | {cpus})
+    return [(w, t) for w in counts for t in counts if w * t <= cpus]
+
+
+class Autotuner(object):
+    """
+    Coordinate search over the extraction settings of one model (see the
+    module docstring). `log` receives one line per trial.
+    """
+    def __init__(self, model_conf, duration=3.0, memory_cap=None, trial_seconds=2.0, cpus=None, log=print):
+        self.model_conf = model_conf
+        self.duration = duration
+        self.memory_cap = memory_cap
+        self.trial_seconds = trial_seconds
+        self.cpus = cpus or available_cpus()
+        self.log = log
+        self.trials = []
+
+    def _fits(self, res):
+        return self.memory_cap is None or res['peak_rss_mb'] is None or res['peak_rss_mb'] * 2**20 <= self.memory_cap
+
+    def trial(self, **setting):
+        for res in self.trials:
+            if all(res[k] == v for k, v in setting.items()):
+                return res
+        res = run_trial(self.model_conf, setting, self.duration, self.trial_seconds)
+        res['fits'] = self._fits(res)
+        self.trials.append(res)
+        if self.log is not None:
+            self.log(f"[INFO]: workers {res['workers']:2d} x threads {res['num_threads']:2d}, "
+                     f"interop {res['interop_threads']}, batch {res['batch_size']:3d}: "
+                     f"{res['utts_per_sec']:8.2f} utts/s, RSS {res['peak_rss_mb'] or 0:6.0f} MB"
+                     f"{'' if res['fits'] else ' (over the memory cap)'}")
+        return res
+
+    @staticmethod
+    def _best(results):
+        results = [r for r in results if r['fits']]
+        return max(results, key=lambda r: r['utts_per_sec']) if results else None
+
+    def _refine(self, best):
+        # batch sizes, then inter-op threads, for the split of `best`
+        split = {'workers': best['workers'], 'num_threads': best['num_threads'], 'interop_threads': 1}
+        batch_size = 2
+        while batch_size <= MAX_BATCH_SIZE:
+            res = self.trial(batch_size=batch_size, **split)
+            if not res['fits'] or res['utts_per_sec'] < MIN_GAIN * best['utts_per_sec']:
+                break
+            best = res
+            batch_size *= 2
+        res = self.trial(batch_size=best['batch_size'], workers=best['workers'],
+                         num_threads=best['num_threads'], interop_threads=2)
+        if res['fits'] and res['utts_per_sec'] >= MIN_GAIN * best['utts_per_sec']:
+            best = res
+        return best
+
+    def run(self):
+        """
+        Returns {'best': setting, 'single_process': setting, 'trials': [...]}.
+        Raises RuntimeError when no setting fits the memory cap.
+        """
+        splits = [self.trial(batch_size=1, workers=w, num_threads=t, interop_threads=1)
+                  for w, t in worker_splits(self.cpus)]
+        best = self._best(splits)
+        single = self._best([r for r in splits if r['workers'] == 1])
+        if best is None:
+            raise RuntimeError('No setting fits the memory cap.')
+        best = self._refine(best)
+        single = best if best['workers'] == 1 else (self._refine(single) if single is not None else None)
+        return {'best': best, 'single_process': single, 'trials': self.trials}
+
+
+def autotune_path(model_dir):
+    return os.path.join(str(model_dir), 'autotune', f'{fingerprint_id()}.json')
+
+
+def save_tuned(model_dir, result, **settings):
+    path = autotune_path(model_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = dict(result, settings=settings, fingerprint=hardware_fingerprint(), time=time.time())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_tuned(model_dir):
+    # the tuning of this model on this machine, None when it was never run here
+    path = autotune_path(model_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def apply_setting(setting):
+    """
+    Sets the intra-op and inter-op threads of this process. Inter-op threads
+    can only be set before torch runs parallel work, so a failure there is
+    ignored. Returns the batch size to use.
+    """
+    torch.set_num_threads(setting['num_threads'])
+    try:
+        torch.set_num_interop_threads(setting['interop_threads'])
+    except RuntimeError:
+        pass
+    return setting['batch_size']
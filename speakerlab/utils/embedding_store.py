@@ -0,0 +1,232 @@
+"""
+    Compact on-disk/in-memory store for speaker embeddings.
+
+    Embeddings are L2-normalised and kept as float32, float16 or int8 (with a
+    per-vector scale). Scoring never materialises the whole gallery in float32:
+    rows are decompressed block by block inside the dot-product kernel, and an
+    optional float32 copy (memory-mapped) is only touched to re-rank top-k hits.
+"""
+
+import os
+import json
+import numpy as np
+
+SUPPORTED_DTYPES = ('float32', 'float16', 'int8')
+
+
+def l2_normalize(x, axis=-1, eps=1e-12):
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=axis, keepdims=True)
+    return x / np.maximum(norm, eps)
+
+
+def quantize(x, dtype):
+    # x: [N, D] float32. Returns (data, scale), scale is None unless int8.
+    x = np.asarray(x, dtype=np.float32)
+    if dtype == 'float32':
+        return x, None
+    if dtype == 'float16':
+        return x.astype(np.float16), None
+    if dtype == 'int8':
+        scale = np.abs(x).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        data = np.rint(x / scale[:, None]).clip(-127, 127).astype(np.int8)
+        return data, scale.astype(np.float32)
+    raise ValueError(f'Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}.')
+
+
+def dequantize(data, scale=None):
+    x = np.asarray(data, dtype=np.float32)
+    if scale is not None:
+        x = x * np.asarray(scale, dtype=np.float32)[:, None]
+    return x
+
+
+def blocked_dot(query, data, scale=None, block_size=2048, out=None):
+    """
+    query: [Q, D] float32, data: [N, D] in any supported dtype.
+    Returns [Q, N] float32 dot products, decompressing only one block of
+    `data` at a time so the temporary float32 buffer stays bounded.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    num = data.shape[0]
+    if out is None:
+        out = np.empty((query.shape[0], num), dtype=np.float32)
+    for start in range(0, num, block_size):
+        end = min(start + block_size, num)
+        block = np.asarray(data[start:end], dtype=np.float32)
+        scores = query @ block.T
+        if scale is not None:
+            scores *= scale[start:end]
+        out[:, start:end] = scores
+    return out
+
+
+class EmbeddingStore(object):
+    def __init__(self, dtype='float32', keep_full=False, key_scheme=None):
+        assert dtype in SUPPORTED_DTYPES, \
+            f'Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}.'
+        self.dtype = dtype
+        # keep a float32 copy for re-ranking (pointless for float32 stores)
+        self.keep_full = keep_full and dtype != 'float32'
+        # what the keys are ('path', 'basename', ...), saved so writers do not mix schemes
+        self.key_scheme = key_scheme
+        self.keys = []
+        self.key2idx = {}
+        self.data = None
+        self.scale = None
+        self.full = None
+        self._pending_keys = []
+        self._pending = []
+
+    def __len__(self):
+        return len(self.keys) + len(self._pending_keys)
+
+    def __contains__(self, key):
+        return key in self.key2idx or key in self._pending_keys
+
+    @property
+    def dim(self):
+        self._flush()
+        return None if self.data is None else self.data.shape[1]
+
+    @property
+    def nbytes(self):
+        # bytes needed to score (the float32 re-rank copy lives on disk)
+        self._flush()
+        if self.data is None:
+            return 0
+        nbytes = self.data.nbytes
+        if self.scale is not None:
+            nbytes += self.scale.nbytes
+        return nbytes
+
+    def add(self, key, embedding):
+        self.add_batch([key], np.asarray(embedding).reshape(1, -1))
+
+    def add_batch(self, keys, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        assert embeddings.ndim == 2 and embeddings.shape[0] == len(keys)
+        if len(set(keys)) != len(keys):
+            raise ValueError('The keys of a batch are not unique.')
+        for key in keys:
+            if key in self:
+                raise ValueError(f'The key {key} already exists in the store.')
+        self._pending_keys.extend(keys)
+        self._pending.append(l2_normalize(embeddings))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        new = np.concatenate(self._pending, axis=0)
+        data, scale = quantize(new, self.dtype)
+        if self.data is None:
+            self.data, self.scale = data, scale
+            self.full = new if self.keep_full else None
+        else:
+            self.data = np.concatenate([self.data, data], axis=0)
+            if scale is not None:
+                self.scale = np.concatenate([self.scale, scale], axis=0)
+            if self.keep_full:
+                self.full = np.concatenate([self.full, new], axis=0)
+        for key in self._pending_keys:
+            self.key2idx[key] = len(self.keys)
+            self.keys.append(key)
+        self._pending_keys = []
+        self._pending = []
+
+    def get(self, key):
+        self._flush()
+        idx = self.key2idx[key]
+        if self.full is not None:
+            return np.asarray(self.full[idx], dtype=np.float32)
+        scale = None if self.scale is None else self.scale[idx:idx + 1]
+        return dequantize(self.data[idx:idx + 1], scale)[0]
+
+    def get_batch(self, keys):
+        self._flush()
+        idx = np.array([self.key2idx[k] for k in keys], dtype=np.int64)
+        if self.full is not None:
+            return np.asarray(self.full[idx], dtype=np.float32)
+        scale = None if self.scale is None else self.scale[idx]
+        return dequantize(self.data[idx], scale)
+
+    def score(self, query, block_size=2048):
+        # query: [D] or [Q, D]. Returns cosine scores [N] or [Q, N].
+        self._flush()
+        query = np.asarray(query, dtype=np.float32)
+        single = query.ndim == 1
+        query = l2_normalize(query.reshape(-1, query.shape[-1]))
+        scores = blocked_dot(query, self.data, self.scale, block_size)
+        return scores[0] if single else scores
+
+    def search(self, query, top_k=10, rerank=True, rerank_factor=4, block_size=2048):
+        """
+        Return the top_k (keys, scores) for every query. Candidates are picked
+        on the compressed scores, then re-scored in float32 when a full copy
+        is available.
+        """
+        self._flush()
+        query = np.asarray(query, dtype=np.float32)
+        single = query.ndim == 1
+        query = l2_normalize(query.reshape(-1, query.shape[-1]))
+        num = len(self.keys)
+        top_k = min(top_k, num)
+        use_full = rerank and self.full is not None
+        num_cand = min(num, top_k * rerank_factor) if use_full else top_k
+
+        scores = blocked_dot(query, self.data, self.scale, block_size)
+        if num_cand < num:
+            cand = np.argpartition(-scores, num_cand - 1, axis=1)[:, :num_cand]
+        else:
+            cand = np.tile(np.arange(num), (query.shape[0], 1))
+        if use_full:
+            cand_emb = np.asarray(self.full[cand.reshape(-1)], dtype=np.float32)
+            cand_emb = cand_emb.reshape(cand.shape[0], cand.shape[1], -1)
+            cand_scores = np.einsum('qd,qkd->qk', query, cand_emb)
+        else:
+            cand_scores = np.take_along_axis(scores, cand, axis=1)
+        order = np.argsort(-cand_scores, axis=1)[:, :top_k]
+        top_idx = np.take_along_axis(cand, order, axis=1)
+        top_scores = np.take_along_axis(cand_scores, order, axis=1)
+        results = [([self.keys[i] for i in row], s) for row, s in zip(top_idx, top_scores)]
+        return results[0] if single else results
+
+    def save(self, store_dir):
+        self._flush()
+        os.makedirs(store_dir, exist_ok=True)
+        meta = {'dtype': self.dtype, 'keep_full': self.keep_full, 'key_scheme': self.key_scheme, 'keys': self.keys}
+        np.save(os.path.join(store_dir, 'data.npy'), self.data)
+        if self.scale is not None:
+            np.save(os.path.join(store_dir, 'scale.npy'), self.scale)
+        if self.full is not None:
+            np.save(os.path.join(store_dir, 'full.npy'), np.asarray(self.full))
+        with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, store_dir, mmap=False):
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        store = cls(meta['dtype'], keep_full=meta['keep_full'], key_scheme=meta.get('key_scheme'))
+        mmap_mode = 'r' if mmap else None
+        store.data = np.load(os.path.join(store_dir, 'data.npy'), mmap_mode=mmap_mode)
+        if meta['dtype'] == 'int8':
+            store.scale = np.load(os.path.join(store_dir, 'scale.npy'))
+        if meta['keep_full']:
+            # only read on re-ranking, keep it on disk
+            store.full = np.load(os.path.join(store_dir, 'full.npy'), mmap_mode='r')
+        store.keys = list(meta['keys'])
+        store.key2idx = {k: i for i, k in enumerate(store.keys)}
+        return store
+
+    @classmethod
+    def from_npy_dir(cls, embedding_dir, dtype='float32', keep_full=False):
+        # build a store from the per-file .npy embeddings written by infer_sv.py
+        store = cls(dtype, keep_full=keep_full)
+        files = sorted(f for f in os.listdir(embedding_dir) if f.endswith('.npy'))
+        if files:
+            keys = [f.rsplit('.', 1)[0] for f in files]
+            embs = np.stack([np.load(os.path.join(embedding_dir, f)).reshape(-1) for f in files])
+            store.add_batch(keys, embs)
+        return store
@@ -0,0 +1,475 @@
+"""
+    Incremental speaker enrollment from a data_dir/<speaker>/*.wav layout.
+
+    Every speaker folder is one enrolled speaker. A manifest keeps the size,
+    mtime and sha1 of every enrolled file, so a sync only embeds files that are
+    new or whose content changed; a file whose mtime changed but whose hash did
+    not is just re-stamped. Per-speaker centroids are running sums of the
+    L2-normalised file embeddings, updated by adding and subtracting single
+    embeddings. Everything is persisted in cache_dir, so a process starting on
+    an unchanged data_dir does no model work at all. The manifest also keeps the
+    stamp of the checkpoint the files were embedded with: a cache from other
+    weights is dropped and everything is embedded again.
+
+    Readers get an immutable SpeakerGallery snapshot which is swapped in one
+    assignment after every sync, so identification never waits on enrollment.
+
+    Optionally (enable_adaptation), embeddings of accepted live utterances are
+    folded into the centroid of their speaker as a weighted running mean over a
+    bounded history, with score / margin / rate-limit guardrails and rollback.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import collections
+import numpy as np
+
+from speakerlab.utils.embedding_store import l2_normalize
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.m4a', '.ogg')
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def checkpoint_stamp(path):
+    # identity of the weights behind a cache: file name, size and mtime of the checkpoint
+    stat = os.stat(path)
+    return {'name': os.path.basename(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def scan_speakers(data_dir, min_size=1000):
+    """
+    Returns {speaker: {file_name: (size, mtime_ns)}} for the audio files of every
+    data_dir/<speaker>/ folder, hidden folders and files below min_size bytes are skipped.
+    """
+    speakers = {}
+    if not os.path.isdir(data_dir):
+        return speakers
+    for spk_entry in os.scandir(data_dir):
+        if not spk_entry.is_dir() or spk_entry.name.startswith('.'):
+            continue
+        files = {}
+        for entry in os.scandir(spk_entry.path):
+            if not entry.is_file() or not entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            if stat.st_size > min_size:
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        if files:
+            speakers[spk_entry.name] = files
+    return dict(sorted(speakers.items()))
+
+
+class SpeakerGallery(object):
+    """
+    Read-only snapshot of the enrolled speakers. centroids[i] is the mean of the
+    L2-normalised embeddings of speakers[i], so centroid scores equal the average
+    cosine score against every enrolled file of that speaker.
+    """
+    def __init__(self, speakers=(), centroids=None, counts=()):
+        self.speakers = tuple(speakers)
+        self.centroids = centroids
+        self.counts = tuple(counts)
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def score(self, embedding):
+        # embedding: [D] or [N, D] -> scores [S] or [N, S]
+        if not self.speakers:
+            return np.zeros(np.shape(embedding)[:-1] + (0,), dtype=np.float32)
+        return l2_normalize(embedding) @ self.centroids.T
+
+    def identify(self, embedding):
+        # returns [(speaker, score), ...] sorted by decreasing score
+        scores = self.score(embedding)
+        order = np.argsort(-scores)
+        return [(self.speakers[i], float(scores[i])) for i in order]
+
+
+class EnrollmentManager(object):
+    def __init__(self, data_dir, cache_dir, embed_fn, min_size=1000, model_stamp=None, persist=True):
+        """
+        data_dir: folder with one sub folder per speaker.
+        cache_dir: where the manifest, embeddings and centroids are persisted,
+            it must be specific to the model behind embed_fn.
+        embed_fn: wav_file -> embedding [D], only called for new or changed files.
+        model_stamp: checkpoint_stamp of the weights behind embed_fn, a cache
+            stamped differently is discarded.
+        persist: with False nothing is read from or written to cache_dir, for
+            galleries that must not outlive the process (e.g. random weights).
+        """
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.embed_fn = embed_fn
+        self.min_size = min_size
+        self.model_stamp = model_stamp
+        self.persist = persist
+        # speaker -> {file_name: embedding}, only used with persist=False
+        self._memory = {}
+        # speaker -> {file_name: {'size', 'mtime_ns', 'sha1'}}
+        self.manifest = {}
+        # speaker -> (sum of normalised embeddings [D], count)
+        self.sums = {}
+        # (speaker, file_name) -> (size, mtime_ns) of files that failed to embed
+        self.failed = {}
+        # online adaptation, see enable_adaptation
+        self.adaptation = None
+        # speaker -> deque of adapted embeddings, oldest first
+        self.adapt_history = {}
+        # speaker -> sum of the embeddings in adapt_history [D]
+        self.adapt_sums = {}
+        self._session_updates = collections.Counter()
+        self._last_update = {}
+        self.gallery = SpeakerGallery()
+        self._sync_lock = threading.Lock()
+        self._watcher = None
+        self._stop_event = threading.Event()
+        self.load()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.cache_dir, 'manifest.json')
+
+    @property
+    def adaptation_path(self):
+        return os.path.join(self.cache_dir, 'adaptation.npz')
+
+    def _embedding_path(self, speaker):
+        return os.path.join(self.cache_dir, 'embeddings', speaker + '.npz')
+
+    def load(self):
+        if not self.persist or not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('model') != self.model_stamp:
+            print(f'[INFO]: {self.cache_dir} was embedded with another checkpoint, it will be embedded again.')
+            self.clear_cache()
+            return
+        self.manifest = manifest['speakers']
+        centroids = np.load(os.path.join(self.cache_dir, 'centroids.npz'))
+        for spk, s, c in zip(centroids['speakers'], centroids['sums'], centroids['counts']):
+            self.sums[str(spk)] = (s, int(c))
+        if os.path.exists(self.adaptation_path):
+            data = np.load(self.adaptation_path)
+            history = np.split(data['embeddings'], np.cumsum(data['lengths'])[:-1])
+            for spk, embs in zip(data['speakers'], history):
+                self.adapt_history[str(spk)] = collections.deque(embs)
+                self.adapt_sums[str(spk)] = embs.sum(axis=0)
+        self._publish()
+
+    def clear_cache(self):
+        # the manifest goes first, a crash half way leaves a cache that is simply rebuilt
+        for name in ('manifest.json', 'centroids.npz', 'adaptation.npz'):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(os.path.join(self.cache_dir, 'embeddings'), ignore_errors=True)
+
+    def save(self):
+        if not self.persist:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        speakers = sorted(self.sums)
+        dim = self.sums[speakers[0]][0].shape[0] if speakers else 0
+        np.savez(os.path.join(self.cache_dir, 'centroids.npz'),
+                 speakers=np.array(speakers, dtype=str),
+                 sums=np.array([self.sums[s][0] for s in speakers]).reshape(len(speakers), dim),
+                 counts=np.array([self.sums[s][1] for s in speakers], dtype=np.int64))
+        # write the manifest last, a crash before this point only costs re-embedding
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'data_dir': self.data_dir, 'model': self.model_stamp, 'speakers': self.manifest}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _load_embeddings(self, speaker):
+        if not self.persist:
+            return dict(self._memory.get(speaker, {}))
+        path = self._embedding_path(speaker)
+        if not os.path.exists(path):
+            return {}
+        data = np.load(path)
+        return dict(zip((str(k) for k in data['names']), data['embeddings']))
+
+    def _save_embeddings(self, speaker, embeddings):
+        if not self.persist:
+            if embeddings:
+                self._memory[speaker] = dict(embeddings)
+            else:
+                self._memory.pop(speaker, None)
+            return
+        path = self._embedding_path(speaker)
+        if not embeddings:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        names = sorted(embeddings)
+        np.savez(path, names=np.array(names, dtype=str),
+                 embeddings=np.stack([embeddings[n] for n in names]))
+
+    def _centroid(self, speaker):
+        total, count = self.sums[speaker]
+        adapted = self.adapt_history.get(speaker)
+        if self.adaptation is None or not adapted:
+            return total / count
+        # every adapted utterance counts as `weight` enrolled files
+        weight = self.adaptation['weight']
+        return (total + weight * self.adapt_sums[speaker]) / (count + weight * len(adapted))
+
+    def _publish(self, speaker=None):
+        gallery = self.gallery
+        if speaker is not None and speaker in gallery.speakers:
+            # copy-on-write of a single row, the old snapshot stays valid for readers
+            centroids = gallery.centroids.copy()
+            centroids[gallery.speakers.index(speaker)] = self._centroid(speaker)
+            self.gallery = SpeakerGallery(gallery.speakers, centroids, gallery.counts)
+            return
+        speakers = [s for s in sorted(self.sums) if self.sums[s][1] > 0]
+        if speakers:
+            centroids = np.stack([self._centroid(s) for s in speakers]).astype(np.float32)
+        else:
+            centroids = None
+        # a single assignment, readers keep whichever snapshot they already hold
+        self.gallery = SpeakerGallery(speakers, centroids, [self.sums[s][1] for s in speakers])
+
+    def _changes(self, speaker, files):
+        # returns (files to embed, files whose stamp only needs a refresh, removed files)
+        known = self.manifest.get(speaker, {})
+        to_embed, restamp = [], {}
+        for name, (size, mtime_ns) in files.items():
+            entry = known.get(name)
+            if entry is not None and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+                continue
+            if self.failed.get((speaker, name)) == (size, mtime_ns):
+                # retried only once the file changes again
+                continue
+            digest = file_digest(os.path.join(self.data_dir, speaker, name))
+            if entry is not None and entry['sha1'] == digest:
+                restamp[name] = {'size': size, 'mtime_ns': mtime_ns, 'sha1': digest}
+            else:
+                to_embed.append((name, {'size': size, 'mtime_ns': mtime_ns, 'sha1': digest}))
+        removed = [name for name in known if name not in files]
+        return to_embed, restamp, removed
+
+    def sync(self):
+        """
+        Brings the gallery in line with data_dir. Returns a dict with the number of
+        embedded, removed and re-stamped files; an unchanged data_dir only costs
+        one stat per file.
+        """
+        with self._sync_lock:
+            stats = {'embedded': 0, 'removed': 0, 'restamped': 0, 'failed': 0}
+            scanned = scan_speakers(self.data_dir, self.min_size)
+            changed = False
+            for speaker in sorted(set(scanned) | set(self.manifest)):
+                to_embed, restamp, removed = self._changes(speaker, scanned.get(speaker, {}))
+                if restamp:
+                    self.manifest.setdefault(speaker, {}).update(restamp)
+                    stats['restamped'] += len(restamp)
+                    changed = True
+                if not to_embed and not removed:
+                    continue
+                embeddings = self._load_embeddings(speaker)
+                total, count = self.sums.get(speaker, (None, 0))
+                entries = self.manifest.setdefault(speaker, {})
+                for name in removed:
+                    old = embeddings.pop(name, None)
+                    if old is not None:
+                        total, count = total - old, count - 1
+                    entries.pop(name)
+                    stats['removed'] += 1
+                for name, entry in to_embed:
+                    try:
+                        emb = l2_normalize(np.asarray(
+                            self.embed_fn(os.path.join(self.data_dir, speaker, name)), dtype=np.float32))
+                    except Exception as e:
+                        print(f'[WARNING]: Could not embed {speaker}/{name}: {e}')
+                        self.failed[(speaker, name)] = (entry['size'], entry['mtime_ns'])
+                        stats['failed'] += 1
+                        continue
+                    self.failed.pop((speaker, name), None)
+                    old = embeddings.get(name)
+                    if old is not None:
+                        total, count = total - old, count - 1
+                    embeddings[name] = emb
+                    total, count = (emb.copy() if total is None else total + emb), count + 1
+                    entries[name] = entry
+                    stats['embedded'] += 1
+                if entries:
+                    self.sums[speaker] = (total, count)
+                else:
+                    self.manifest.pop(speaker, None)
+                    self.sums.pop(speaker, None)
+                    if self.adapt_history.pop(speaker, None) is not None:
+                        self.adapt_sums.pop(speaker)
+                        self.save_adaptation()
+                self._save_embeddings(speaker, embeddings)
+                changed = True
+            if changed:
+                self.save()
+                self._publish()
+            return stats
+
+    def enable_adaptation(self, weight=0.5, max_history=20, min_score=0.6, min_margin=0.1,
+                          max_updates_per_session=3, min_interval=30.0):
+        """
+        Opt-in online adaptation of the centroids from accepted live utterances.
+        weight: weight of one adapted utterance relative to one enrolled file.
+        max_history: adapted utterances kept per speaker, the oldest is dropped first.
+        min_score, min_margin: the utterance must score at least min_score against
+            its speaker and beat the runner-up by min_margin.
+        max_updates_per_session, min_interval: at most that many updates per
+            (session, speaker), and min_interval seconds between updates of a speaker.
+        """
+        with self._sync_lock:
+            self.adaptation = {
+                'weight': weight, 'max_history': max_history, 'min_score': min_score,
+                'min_margin': min_margin, 'max_updates_per_session': max_updates_per_session,
+                'min_interval': min_interval,
+            }
+            self._publish()
+
+    def disable_adaptation(self):
+        # the history is kept, enable_adaptation brings it back
+        with self._sync_lock:
+            self.adaptation = None
+            self._publish()
+
+    def adapt(self, speaker, embedding, ranking, session_id=None):
+        """
+        Folds the embedding of an accepted utterance into the centroid of speaker.
+        ranking: [(speaker, score), ...] sorted by decreasing score, as returned
+            by SpeakerGallery.identify for this embedding.
+        Returns (updated, reason). The update is O(D) plus a copy of the centroid
+        matrix for the new snapshot, identification keeps reading the old one.
+        """
+        conf = self.adaptation
+        if conf is None:
+            return False, 'adaptation disabled'
+        scores = dict(ranking)
+        if speaker not in scores or speaker not in self.sums:
+            return False, 'unknown speaker'
+        if ranking[0][0] != speaker:
+            return False, 'not the best match'
+        runner_up = ranking[1][1] if len(ranking) > 1 else -1.0
+        if scores[speaker] < conf['min_score']:
+            return False, f"score {scores[speaker]:.3f} < {conf['min_score']}"
+        if scores[speaker] - runner_up < conf['min_margin']:
+            return False, f"margin {scores[speaker] - runner_up:.3f} < {conf['min_margin']}"
+
+        emb = l2_normalize(np.asarray(embedding, dtype=np.float32))
+        with self._sync_lock:
+            now = time.monotonic()
+            if self._session_updates[(session_id, speaker)] >= conf['max_updates_per_session']:
+                return False, 'session limit reached'
+            if now - self._last_update.get(speaker, -np.inf) < conf['min_interval']:
+                return False, 'too soon after the last update'
+            history = self.adapt_history.setdefault(speaker, collections.deque())
+            total = self.adapt_sums.get(speaker)
+            total = emb.copy() if total is None else total + emb
+            history.append(emb)
+            while len(history) > conf['max_history']:
+                total = total - history.popleft()
+            self.adapt_sums[speaker] = total
+            self._session_updates[(session_id, speaker)] += 1
+            self._last_update[speaker] = now
+            self._publish(speaker)
+            self.save_adaptation()
+        return True, 'updated'
+
+    def rollback(self, speaker, steps=1):
+        # undoes the last `steps` adaptations of speaker, returns how many were undone
+        with self._sync_lock:
+            history = self.adapt_history.get(speaker)
+            undone = 0
+            while history and undone < steps:
+                self.adapt_sums[speaker] = self.adapt_sums[speaker] - history.pop()
+                undone += 1
+            if history is not None and not history:
+                self.adapt_history.pop(speaker)
+                self.adapt_sums.pop(speaker)
+            if undone:
+                self._publish(speaker)
+                self.save_adaptation()
+            return undone
+
+    def reset_adaptation(self, speaker=None):
+        # drops the adapted history of one speaker (or of all), back to the enrolled centroids
+        with self._sync_lock:
+            speakers = list(self.adapt_history) if speaker is None else [speaker]
+            for spk in speakers:
+                self.adapt_history.pop(spk, None)
+                self.adapt_sums.pop(spk, None)
+            self._publish()
+            self.save_adaptation()
+
+    def save_adaptation(self):
+        if not self.persist:
+            return
+        speakers = sorted(self.adapt_history)
+        if not speakers:
+            if os.path.exists(self.adaptation_path):
+                os.remove(self.adaptation_path)
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.savez(self.adaptation_path, speakers=np.array(speakers, dtype=str),
+                 lengths=np.array([len(self.adapt_history[s]) for s in speakers]),
+                 embeddings=np.concatenate([np.stack(self.adapt_history[s]) for s in speakers]))
+
+    def embeddings(self):
+        """
+        Returns (keys, embeddings [N, D], speaker labels) of every enrolled file
+        from the cache, without running the model.
+        """
+        keys, embeddings, labels = [], [], []
+        for speaker in sorted(self.manifest):
+            for name, emb in sorted(self._load_embeddings(speaker).items()):
+                keys.append(os.path.join(self.data_dir, speaker, name))
+                embeddings.append(emb)
+                labels.append(speaker)
+        if not embeddings:
+            return keys, np.zeros((0, 0), dtype=np.float32), labels
+        return keys, np.stack(embeddings), labels
+
+    def speaker_files(self, speaker):
+        return sorted(os.path.join(self.data_dir, speaker, name) for name in self.manifest.get(speaker, {}))
+
+    def start_watching(self, interval=2.0, on_change=None):
+        """
+        Polls data_dir every `interval` seconds in a daemon thread and hot-reloads
+        the gallery; on_change(stats) is called after a sync that changed something.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop_event.clear()
+
+        def watch():
+            while not self._stop_event.wait(interval):
+                try:
+                    stats = self.sync()
+                except Exception as e:
+                    print(f'[WARNING]: Enrollment sync failed: {e}')
+                    continue
+                if on_change is not None and any(stats.values()):
+                    on_change(stats)
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_event.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,290 @@
+"""
+    Helpers shared by the scripts in speakerlab/bin that need to turn wav files
+    into embeddings with one of the models listed in infer_sv.supports.
+"""
+
+import os
+import time
+import inspect
+import functools
+import threading
+import contextlib
+import pathlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torchaudio
+
+from speakerlab.process.processor import FBank
+from speakerlab.utils.builder import dynamic_import
+from speakerlab.utils.enrollment import scan_speakers
+from speakerlab.utils.flat_checkpoint import flat_path, is_fresh, load_flat
+from speakerlab.utils.utils import load_params
+
+
+def load_wav(wav_file, obj_fs=16000):
+    wav, fs = torchaudio.load(wav_file)
+    if fs != obj_fs:
+        wav = torchaudio.functional.resample(wav, fs, obj_fs)
+    if wav.shape[0] > 1:
+        wav = wav[0, :].unsqueeze(0)
+    return wav
+
+
+# torch >= 2.1 can build a model on the meta device and adopt checkpoint tensors
+META_INIT = 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+def _torch_load(pretrained_model, **kwargs):
+    # only tensors and plain containers are unpickled; torch < 1.13 has no weights_only
+    try:
+        return torch.load(pretrained_model, map_location='cpu', weights_only=True, **kwargs)
+    except TypeError:
+        if kwargs:
+            raise
+        return torch.load(pretrained_model, map_location='cpu')
+
+
+def load_checkpoint(pretrained_model):
+    try:
+        # zip checkpoints are memory-mapped instead of read into memory
+        state = _torch_load(pretrained_model, mmap=True)
+    except (TypeError, RuntimeError):
+        # torch < 2.1, or a checkpoint in the legacy (non-zip) format, which cannot be mapped
+        state = _torch_load(pretrained_model)
+    if isinstance(state, dict):
+        if 'model' in state:
+            state = state['model']
+        elif 'state_dict' in state:
+            state = state['state_dict']
+    return state
+
+
+_META_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def meta_init():
+    """
+    Modules built inside are placed on the meta device: no memory is allocated and
+    the torch.nn.init functions are skipped for their tensors (running them on meta
+    tensors still costs a python decomposition per call). Real tensors created by
+    other threads meanwhile are initialised as usual.
+    """
+    def skip_on_meta(init_fn):
+        @functools.wraps(init_fn)
+        def wrapper(tensor, *args, **kwargs):
+            return tensor if tensor.is_meta else init_fn(tensor, *args, **kwargs)
+        return wrapper
+
+    names = [n for n in dir(torch.nn.init) if n.endswith('_') and not n.startswith('_')]
+    with _META_LOCK:
+        saved = {n: getattr(torch.nn.init, n) for n in names}
+        try:
+            for n in names:
+                setattr(torch.nn.init, n, skip_on_meta(saved[n]))
+            with torch.device('meta'):
+                yield
+        finally:
+            for n in names:
+                setattr(torch.nn.init, n, saved[n])
+
+
+def load_weights(pretrained_model):
+    # a converted flat checkpoint is memory-mapped instead of unpickled
+    if is_fresh(flat_path(pretrained_model), pretrained_model):
+        return load_flat(flat_path(pretrained_model))
+    return load_checkpoint(pretrained_model)
+
+
+def materialize_meta(model):
+    """
+    Gives real tensors to the parameters and buffers still on the meta device
+    after a non-strict load: each module holding one is re-initialised as in
+    its constructor (reset_parameters, zeros without it), and the tensors it
+    adopted from the checkpoint are put back.
+    """
+    for module in model.modules():
+        tensors = {**module._parameters, **module._buffers}
+        if not any(t is not None and t.is_meta for t in tensors.values()):
+            continue
+        # to_empty may swap the data of the loaded parameters in place: keep their data
+        loaded = {name: t.data for name, t in tensors.items() if t is not None and not t.is_meta}
+        module.to_empty(device='cpu', recurse=False)
+        if hasattr(module, 'reset_parameters'):
+            module.reset_parameters()
+        else:
+            with torch.no_grad():
+                for name, t in itertools.chain(module.named_parameters(recurse=False),
+                                               module.named_buffers(recurse=False)):
+                    if name not in loaded:
+                        t.zero_()
+        for name, t in loaded.items():
+            if name in module._parameters:
+                module._parameters[name] = torch.nn.Parameter(t, requires_grad=module._parameters[name].requires_grad)
+            else:
+                module._buffers[name] = t
+    return model
+
+
+def build_embedding_model(model_conf, pretrained_model=None, device='cpu', strict=True):
+    # model_conf: {'obj': ..., 'args': ...} as in infer_sv.supports[model_id]['model']
+    model_class = dynamic_import(model_conf['obj'])
+    if pretrained_model is None or not META_INIT:
+        model = model_class(**model_conf['args'])
+        if pretrained_model is not None:
+            load_params(model, load_weights(pretrained_model), strict=strict)
+    else:
+        # all the weights come from the checkpoint: build the architecture on the
+        # meta device (nothing allocated, no initialisers run) and adopt its tensors
+        with meta_init():
+            model = model_class(**model_conf['args'])
+        load_params(model, load_weights(pretrained_model), strict=strict, assign=True)
+        missing = [name for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers())
+                   if tensor.is_meta]
+        if missing:
+            if strict:
+                raise RuntimeError(f'{pretrained_model} has no weights for {", ".join(missing[:5])}'
+                                   f'{" ..." if len(missing) > 5 else ""}.')
+            print(f'[WARNING]: {pretrained_model} has no weights for {len(missing)} tensors '
+                  f'({", ".join(missing[:5])}{" ..." if len(missing) > 5 else ""}), they are initialised.')
+            materialize_meta(model)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def local_model_path(model_id, local_model_dir='pretrained'):
+    from speakerlab.bin.infer_sv import supports
+    conf = supports[model_id]
+    save_dir = pathlib.Path(local_model_dir) / model_id.split('/')[1]
+    return save_dir, save_dir / conf['model_pt']
+
+
+def get_speaker_files(data_dir, min_size=1000):
+    # data_dir/<speaker>/*.wav -> {speaker: [files]}
+    return {spk: sorted(os.path.join(data_dir, spk, f) for f in files)
+            for spk, files in scan_speakers(data_dir, min_size).items()}
+
+
+class EmbeddingExtractor(object):
+    def __init__(self, model, device='cpu', projection=None, sample_rate=16000):
+        self.model = model
+        self.device = torch.device(device)
+        self.projection = projection
+        self.sample_rate = sample_rate
+        self.feature_extractor = FBank(80, sample_rate=sample_rate, mean_nor=True)
+
+    @classmethod
+    def from_model_id(cls, model_id, local_model_dir='pretrained', device='cpu', projection=None):
+        from speakerlab.bin.infer_sv import supports
+        _, pretrained_model = local_model_path(model_id, local_model_dir)
+        if not pretrained_model.exists() and not flat_path(pretrained_model).exists():
+            raise FileNotFoundError(
+                f'{pretrained_model} not found, run infer_sv.py --model_id {model_id} first.')
+        model = build_embedding_model(supports[model_id]['model'], pretrained_model, device)
+        return cls(model, device, projection)
+
+    def __call__(self, wav_file):
+        wav = load_wav(wav_file, self.sample_rate)
+        feat = self.feature_extractor(wav).unsqueeze(0).to(self.device)
+        with torch.no_grad():
+            embedding = self.model(feat).detach().squeeze(0).cpu().numpy()
+        if self.projection is not None:
+            embedding = self.projection.transform(embedding)
+        return embedding
+
+    def extract_dir(self, data_dir):
+        # returns (keys, embeddings [N, D], speaker labels)
+        keys, embeddings, labels = [], [], []
+        for spk, files in get_speaker_files(data_dir).items():
+            for wav_file in files:
+                keys.append(wav_file)
+                embeddings.append(self(wav_file))
+                labels.append(spk)
+        return keys, np.stack(embeddings), labels
+
+
+class MultiModelExtractor(object):
+    """
+    Embeds every file with several models while decoding it and computing its
+    fbank only once: all the models in infer_sv.supports take the same 80-dim
+    fbank at 16 kHz. With parallel=True each model runs in its own thread with
+    num_threads // len(models) intra-op threads, and the features of the next
+    file are computed while the models work on the current one.
+    """
+    def __init__(self, models, device='cpu', sample_rate=16000, parallel=False, num_threads=None):
+        # models: {name: model in eval mode}
+        self.models = models
+        self.device = torch.device(device)
+        self.sample_rate = sample_rate
+        self.feature_extractor = FBank(80, sample_rate=sample_rate, mean_nor=True)
+        # accumulated seconds of feature computation and of every model
+        self.timing = {'features': 0.0}
+        self.timing.update({name: 0.0 for name in models})
+        self.executors = None
+        if parallel and len(models) > 1:
+            num_threads = num_threads or torch.get_num_threads()
+            per_model = max(1, num_threads // len(models))
+            # torch.set_num_threads only affects the intra-op pool of the calling thread
+            self.executors = {
+                name: ThreadPoolExecutor(1, initializer=torch.set_num_threads, initargs=(per_model,))
+                for name in models}
+        elif num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+    @classmethod
+    def from_model_ids(cls, model_ids, local_model_dir='pretrained', device='cpu', **kwargs):
+        models = {}
+        for model_id in model_ids:
+            models[model_id] = EmbeddingExtractor.from_model_id(model_id, local_model_dir, device).model
+        return cls(models, device, **kwargs)
+
+    def features(self, wav_file):
+        st = time.perf_counter()
+        wav = load_wav(wav_file, self.sample_rate)
+        feat = self.feature_extractor(wav).unsqueeze(0).to(self.device)
+        self.timing['features'] += time.perf_counter() - st
+        return feat
+
+    def _embed(self, name, feat):
+        st = time.perf_counter()
+        with torch.no_grad():
+            embedding = self.models[name](feat).detach().squeeze(0).cpu().numpy()
+        self.timing[name] += time.perf_counter() - st
+        return embedding
+
+    def _submit(self, feat):
+        if self.executors is None:
+            return {name: self._embed(name, feat) for name in self.models}
+        return {name: self.executors[name].submit(self._embed, name, feat) for name in self.models}
+
+    @staticmethod
+    def _collect(pending):
+        return {name: r.result() if hasattr(r, 'result') else r for name, r in pending.items()}
+
+    def __call__(self, wav_file):
+        # returns {name: embedding [D]}
+        return self._collect(self._submit(self.features(wav_file)))
+
+    def extract(self, wav_files):
+        # returns {name: embeddings [N, D]} in the order of wav_files
+        outputs = {name: [] for name in self.models}
+        pending = None
+        for wav_file in wav_files:
+            feat = self.features(wav_file)
+            if pending is not None:
+                for name, emb in self._collect(pending).items():
+                    outputs[name].append(emb)
+            pending = self._submit(feat)
+        if pending is not None:
+            for name, emb in self._collect(pending).items():
+                outputs[name].append(emb)
+        return {name: np.stack(embs) for name, embs in outputs.items() if embs}
+
+    def close(self):
+        if self.executors is not None:
+            for executor in self.executors.values():
+                executor.shutdown()
+            self.executors = None
@@ -0,0 +1,134 @@
+"""
+    Flat checkpoint format: a state dict stored as one JSON header followed by the
+    raw bytes of every tensor, each aligned to ALIGNMENT bytes.
+
+        magic (8 bytes) | header length (8 bytes, little endian) | JSON header | data
+
+    The header maps every tensor name to its dtype, shape and offset in the data
+    section. Loading memory-maps the file (copy-on-write) and returns tensors that
+    are views on the mapping, so nothing is unpickled or copied and all the
+    processes that load the same file share one page-cache copy of the weights.
+"""
+
+import os
+import json
+import struct
+import pathlib
+import torch
+
+MAGIC = b'SPKFLAT1'
+ALIGNMENT = 64
+SUFFIX = '.flat'
+
+
+def _align(n, alignment=ALIGNMENT):
+    return (n + alignment - 1) // alignment * alignment
+
+
+def flat_path(checkpoint):
+    # <dir>/campplus_cn_common.bin -> <dir>/campplus_cn_common.flat
+    return pathlib.Path(checkpoint).with_suffix(SUFFIX)
+
+
+def save_flat(state_dict, path, metadata=None):
+    """
+    Writes the tensors of state_dict to path. Non-tensor entries are not supported,
+    metadata is an optional json-serializable dict stored in the header.
+    """
+    tensors = {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        if not isinstance(tensor, torch.Tensor):
+            raise TypeError(f'{name} is a {type(tensor).__name__}, only tensors can be stored.')
+        nbytes = tensor.numel() * tensor.element_size()
+        tensors[name] = {
+            'dtype': str(tensor.dtype).replace('torch.', ''),
+            'shape': list(tensor.shape),
+            'offset': offset,
+            'nbytes': nbytes,
+        }
+        offset = _align(offset + nbytes)
+    header = json.dumps({'tensors': tensors, 'metadata': metadata or {}}).encode('utf-8')
+    # pad the header with spaces so that the data section starts aligned
+    header += b' ' * (_align(len(MAGIC) + 8 + len(header)) - len(MAGIC) - 8 - len(header))
+
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        data_start = f.tell()
+        for name, tensor in state_dict.items():
+            f.seek(data_start + tensors[name]['offset'])
+            data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8)
+            f.write(data.numpy().tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    """
+    Returns (header dict, absolute offset of the data section).
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a flat checkpoint.')
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    return header, len(MAGIC) + 8 + header_len
+
+
+def load_flat(path):
+    """
+    Returns the state dict of a flat checkpoint as zero-copy views on a private
+    memory map of the file: writing to a tensor only copies the touched pages and
+    never changes the file.
+    """
+    header, data_start = read_header(path)
+    nbytes = os.path.getsize(path)
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=nbytes)
+    state = {}
+    for name, info in header['tensors'].items():
+        dtype = getattr(torch, info['dtype'])
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        tensor = torch.empty(0, dtype=dtype)
+        tensor.set_(storage, (data_start + info['offset']) // itemsize, info['shape'])
+        state[name] = tensor
+    return state
+
+
+def convert_checkpoint(checkpoint, path=None):
+    """
+    Converts a torch checkpoint (a state dict, or a dict with a 'model' or
+    'state_dict' entry) to the flat format, 'module.' prefixes stripped.
+    Returns the path of the flat checkpoint, <checkpoint>.flat by default.
+    """
+    from speakerlab.utils.extractor import load_checkpoint
+    checkpoint = pathlib.Path(checkpoint)
+    path = flat_path(checkpoint) if path is None else pathlib.Path(path)
+    state = {(k[7:] if k.startswith('module') else k): v for k, v in load_checkpoint(checkpoint).items()}
+    stat = checkpoint.stat()
+    save_flat(state, path, {'source': checkpoint.name, 'source_size': stat.st_size,
+                            'source_mtime_ns': stat.st_mtime_ns})
+    return path
+
+
+def is_fresh(path, checkpoint):
+    """
+    True when the flat checkpoint at path exists and was converted from the
+    current version of checkpoint.
+    """
+    path = pathlib.Path(path)
+    if not path.is_file():
+        return False
+    if not os.path.exists(checkpoint):
+        return True
+    try:
+        metadata = read_header(path)[0]['metadata']
+    except (ValueError, json.JSONDecodeError, struct.error):
+        return False
+    stat = os.stat(checkpoint)
+    return (metadata.get('source_size') == stat.st_size
+            and metadata.get('source_mtime_ns') == stat.st_mtime_ns)
+
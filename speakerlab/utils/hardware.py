@@ -0,0 +1,83 @@
+"""
+    Fingerprint of the machine a process runs on, to key results that only hold
+    for the hardware they were measured on (model latency, tuned thread counts).
+
+    The fingerprint covers what changes those results: CPU model and
+    architecture, CPUs available to the process, physical memory, GPU and the
+    torch version. fingerprint_id is a short stable hash of it. cpu_sets and
+    pin_process split the available CPUs between worker processes.
+
+        fp = hardware_fingerprint()
+        if cached['fingerprint_id'] != fingerprint_id(fp):
+            recalibrate()
+"""
+
+import os
+import json
+import hashlib
+import platform
+
+import torch
+
+
+def cpu_model():
+    # "model name" of /proc/cpuinfo on Linux, platform.processor() elsewhere
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def available_cpus():
+    # CPUs this process may run on (affinity / cgroup cpuset), not the CPUs of the machine
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def cpu_sets(num_workers, threads_per_worker):
+    """
+    Disjoint lists of CPU ids, one per worker, from the CPUs available to this
+    process. None where pinning is not supported (no sched_setaffinity) or
+    there are not enough CPUs for disjoint sets.
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    if num_workers * threads_per_worker > len(cpus):
+        return None
+    return [cpus[i * threads_per_worker:(i + 1) * threads_per_worker] for i in range(num_workers)]
+
+
+def pin_process(cpus):
+    # restricts this process (and the threads it starts later) to `cpus`
+    if cpus is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+
+def total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def hardware_fingerprint():
+    return {
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'cpu': cpu_model(),
+        'cpus': available_cpus(),
+        'memory_gb': None if total_memory() is None else round(total_memory() / 2**30),
+        'gpu': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        'torch': torch.__version__,
+    }
+
+
+def fingerprint_id(fingerprint=None):
+    fingerprint = hardware_fingerprint() if fingerprint is None else fingerprint
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:12]
@@ -0,0 +1,37 @@
+"""
+    Deferred imports for the apps. lazy_import returns a module object right away
+    and only executes the module the first time one of its attributes is used, so
+    heavy packages (torch, audio and GUI automation backends) do not slow down the
+    start of the launcher, the CLI or the GUI. module_available checks that a
+    package is installed by looking up its spec, without importing it.
+"""
+
+import sys
+import importlib.util
+
+
+def module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        # a parent package is missing or broken
+        return False
+
+
+def lazy_import(name):
+    """
+    Returns module `name`, executed on first attribute access. Raises
+    ModuleNotFoundError at once when it is not installed; errors raised by the
+    module itself (e.g. a missing shared library) show up at first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
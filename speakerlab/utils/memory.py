@@ -0,0 +1,244 @@
+"""
+    Process memory helpers: current resident set size, a sampler that records
+    the peak RSS of a block of code (benchmarks), the bytes held by models,
+    caches and galleries (object_bytes) and a tracker that samples RSS at the
+    stage boundaries of a long-running process and flags steady growth
+    (MemoryTracker).
+"""
+
+import os
+import sys
+import time
+import threading
+import collections
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _windows_memory_info():
+    # psapi GetProcessMemoryInfo through ctypes: the working set is what psutil reports as rss
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    get_process = ctypes.WinDLL('kernel32').GetCurrentProcess
+    get_process.restype = wintypes.HANDLE
+    get_info = ctypes.WinDLL('psapi').GetProcessMemoryInfo
+    get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    get_info.restype = wintypes.BOOL
+    process = get_process()
+
+    def working_set():
+        # a structure per call, the samplers of PeakRSS and MemoryTracker may run concurrently
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not get_info(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+    return working_set
+
+
+_windows_rss = None
+if psutil is None and sys.platform == 'win32':
+    try:
+        _windows_rss = _windows_memory_info()
+    except (OSError, AttributeError):
+        pass
+
+
+def rss_bytes():
+    """
+    Resident set size of this process in bytes: psutil, else /proc on Linux or
+    GetProcessMemoryInfo on Windows. None when none of them is available.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    if _windows_rss is not None:
+        return _windows_rss()
+    return None
+
+
+class PeakRSS(object):
+    """
+    Context manager sampling the RSS in a background thread every `interval`
+    seconds. After the block, `peak` and `start` hold the maximum and initial
+    RSS in bytes (None when RSS is not available).
+
+        with PeakRSS() as mem:
+            run()
+        print(mem.peak - mem.start)
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = rss_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start = rss_bytes()
+        self.peak = self.start
+        if self.start is not None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._sample()
+        return False
+
+
+def torch_memory():
+    """
+    Allocator stats of torch in bytes. The CPU allocator keeps no statistics,
+    so this is empty unless cuda is in use; RSS covers the CPU side.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return {}
+    return {'cuda_allocated': torch.cuda.memory_allocated(),
+            'cuda_reserved': torch.cuda.memory_reserved(),
+            'cuda_peak_allocated': torch.cuda.max_memory_allocated()}
+
+
+def object_bytes(obj, max_depth=8):
+    """
+    Bytes of the tensors, numpy arrays, strings and bytes reachable from `obj`
+    through containers, torch modules and the attributes of speakerlab objects
+    (e.g. an EnrollmentManager and its gallery). Storages shared by several
+    tensors are counted once; functions, threads and other objects are not
+    followed, so a cache does not count the model its callbacks refer to.
+    """
+    seen = set()
+    storages = set()
+
+    def visit(o, depth):
+        if id(o) in seen or depth > max_depth:
+            return 0
+        seen.add(id(o))
+        if isinstance(o, (str, bytes)):
+            return len(o)
+        if hasattr(o, 'untyped_storage') and hasattr(o, 'element_size'):
+            storage = o.untyped_storage()
+            if storage.data_ptr() in storages:
+                return 0
+            storages.add(storage.data_ptr())
+            return storage.nbytes()
+        if hasattr(o, 'nbytes') and hasattr(o, 'dtype'):
+            # numpy views are counted by their base
+            base = getattr(o, 'base', None)
+            return visit(base, depth) if base is not None else o.nbytes
+        if isinstance(o, dict):
+            return sum(visit(k, depth + 1) + visit(v, depth + 1) for k, v in o.items())
+        if isinstance(o, (list, tuple, set, frozenset, collections.deque)):
+            return sum(visit(v, depth + 1) for v in o)
+        if hasattr(o, 'state_dict') and hasattr(o, 'named_parameters'):
+            return sum(visit(t, depth + 1) for t in list(o.parameters()) + list(o.buffers()))
+        if type(o).__module__.startswith('speakerlab') and hasattr(o, '__dict__'):
+            return visit(vars(o), depth + 1)
+        return 0
+
+    return visit(obj, 0)
+
+
+class MemoryTracker(object):
+    """
+    RSS samples at the stage boundaries of a long-running process.
+
+    sample(stage) is called at the end of a stage (e.g. fbank, forward) and
+    keeps, per stage, the number of samples, the last RSS and the largest
+    growth since the previous sample of any stage. mark() is called once per
+    request (identification, extracted file); the RSS at the last `window`
+    marks is used by growth() to flag a session whose memory keeps rising.
+    Every call is O(1).
+    """
+    def __init__(self, window=20, min_growth=32 * 2**20, history=1000):
+        self.window = window
+        self.min_growth = min_growth
+        self.samples = collections.deque(maxlen=history)
+        self.marks = collections.deque(maxlen=window)
+        self.stages = {}
+        self.start = rss_bytes()
+        self.peak = self.start
+        self.last = self.start
+        self._lock = threading.Lock()
+
+    def sample(self, stage):
+        rss = rss_bytes()
+        if rss is None:
+            return None
+        with self._lock:
+            delta = rss - self.last if self.last is not None else 0
+            self.last = rss
+            if self.peak is None or rss > self.peak:
+                self.peak = rss
+            info = self.stages.setdefault(stage, {'count': 0, 'rss': rss, 'max_delta': 0})
+            info['count'] += 1
+            info['rss'] = rss
+            info['max_delta'] = max(info['max_delta'], delta)
+            self.samples.append((time.time(), stage, rss))
+        return rss
+
+    def mark(self, stage='request'):
+        rss = self.sample(stage)
+        if rss is not None:
+            with self._lock:
+                self.marks.append(rss)
+        return rss
+
+    def growth(self):
+        """
+        {'flagged', 'rise', 'slope', 'rising_fraction', 'marks'}: flagged when
+        the window is full, RSS grew by more than `min_growth` bytes over it,
+        the least-squares slope per mark is positive and at least 3/4 of the
+        steps between marks went up.
+        """
+        with self._lock:
+            marks = list(self.marks)
+        res = {'flagged': False, 'rise': None, 'slope': None, 'rising_fraction': None, 'marks': len(marks)}
+        if len(marks) < 2:
+            return res
+        n = len(marks)
+        mean_x, mean_y = (n - 1) / 2, sum(marks) / n
+        slope = sum((i - mean_x) * (y - mean_y) for i, y in enumerate(marks)) / \
+            sum((i - mean_x) ** 2 for i in range(n))
+        rising = sum(b > a for a, b in zip(marks, marks[1:])) / (n - 1)
+        res.update(rise=marks[-1] - marks[0], slope=slope, rising_fraction=rising)
+        res['flagged'] = (n == self.window and res['rise'] > self.min_growth
+                          and slope > 0 and rising >= 0.75)
+        return res
+
+    def report(self):
+        with self._lock:
+            stages = {k: dict(v) for k, v in self.stages.items()}
+            start, peak = self.start, self.peak
+        return {'rss': rss_bytes(), 'start_rss': start, 'peak_rss': peak,
+                'torch': torch_memory(), 'stages': stages, 'growth': self.growth()}
@@ -0,0 +1,153 @@
+"""
+    In-memory metrics of a long-running process: counters, gauges and rolling
+    histograms, each optionally split by labels (e.g. the identified speaker).
+
+    Every update is a dict lookup and an O(1) change under one lock, so it can
+    be called from the audio threads. Histograms keep their last `window`
+    values plus the all-time count, sum and counts per fixed bucket (seconds by
+    default, see `buckets`); percentiles are computed by the reader from a copy. The number of series is capped by `max_series`: updates
+    of new series past the cap are dropped and counted in `dropped`, so labels
+    with unbounded values cannot grow the registry. Gauges can also be
+    callbacks (register_gauge, e.g. a queue size), read only when a snapshot
+    is taken.
+
+        metrics = MetricsRegistry()
+        metrics.inc('identifications', result='accepted')
+        with metrics.timer('identification_seconds'):
+            identify()
+        metrics.summary('identification_seconds')['p95']
+"""
+
+import time
+import threading
+import contextlib
+
+from speakerlab.utils.timing import LATENCY_BUCKETS, RollingHistogram, percentile
+
+
+def series_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class MetricsRegistry(object):
+    def __init__(self, window=500, max_series=256, buckets=None):
+        # buckets: {histogram name: bucket upper bounds}, LATENCY_BUCKETS for the others
+        self.window = window
+        self.max_series = max_series
+        self.buckets = dict(buckets or {})
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.gauge_fns = {}
+        self.dropped = 0
+        self.created = time.time()
+        self._lock = threading.Lock()
+
+    def _num_series(self):
+        return len(self.counters) + len(self.gauges) + len(self.histograms)
+
+    def _admit(self, table, key):
+        # True when `key` exists in `table` or there is room for a new series
+        if key in table:
+            return True
+        if self._num_series() >= self.max_series:
+            self.dropped += 1
+            return False
+        return True
+
+    def inc(self, name, value=1, **labels):
+        key = series_key(name, labels)
+        with self._lock:
+            if self._admit(self.counters, key):
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = series_key(name, labels)
+        with self._lock:
+            if self._admit(self.gauges, key):
+                self.gauges[key] = value
+
+    def register_gauge(self, name, fn, **labels):
+        # fn() is called by snapshot(), outside the lock
+        with self._lock:
+            self.gauge_fns[series_key(name, labels)] = fn
+
+    def observe(self, name, value, **labels):
+        key = series_key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                if not self._admit(self.histograms, key):
+                    return
+                hist = self.histograms[key] = RollingHistogram(self.window, self.buckets.get(name, LATENCY_BUCKETS))
+            hist.add(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        # observes the seconds spent in the block, also when it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        return self.counters.get(series_key(name, labels), 0)
+
+    def gauge(self, name, default=None, **labels):
+        return self.gauges.get(series_key(name, labels), default)
+
+    def total(self, name):
+        # sum of counter `name` over all its label sets
+        with self._lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def by_label(self, name, label):
+        # {label value: counter value} for counter `name`
+        res = {}
+        with self._lock:
+            for (n, labels), v in self.counters.items():
+                labels = dict(labels)
+                if n == name and label in labels:
+                    res[labels[label]] = res.get(labels[label], 0) + v
+        return res
+
+    def summary(self, name, percentiles=(50, 95, 99), **labels):
+        """
+        {count, sum, mean, p50, p95, p99, max} of histogram `name`, in the units
+        it was observed in; the percentiles are over the rolling window and are
+        None before the first value.
+        """
+        with self._lock:
+            hist = self.histograms.get(series_key(name, labels))
+            if hist is None:
+                values, count, total = [], 0, 0.0
+            else:
+                values, count, total = list(hist.values), hist.count, hist.total
+        values.sort()
+        res = {'count': count, 'sum': total, 'mean': total / count if count else None}
+        for p in percentiles:
+            res[f'p{p}'] = percentile(values, p) if values else None
+        res['max'] = values[-1] if values else None
+        return res
+
+    def snapshot(self):
+        """
+        Copy of every series: {'counters': {(name, labels): value}, 'gauges':
+        {...}, 'histograms': {(name, labels): (window values, count, sum)},
+        'buckets': {(name, labels): (upper bounds, count per bucket)}}.
+        """
+        with self._lock:
+            snapshot = {'counters': dict(self.counters),
+                        'gauges': dict(self.gauges),
+                        'histograms': {k: (list(h.values), h.count, h.total) for k, h in self.histograms.items()},
+                        'buckets': {k: (h.buckets, list(h.bucket_counts)) for k, h in self.histograms.items()},
+                        'dropped': self.dropped}
+            gauge_fns = dict(self.gauge_fns)
+        for key, fn in gauge_fns.items():
+            try:
+                snapshot['gauges'][key] = fn()
+            except Exception:
+                # e.g. the object behind the callback is gone
+                pass
+        return snapshot
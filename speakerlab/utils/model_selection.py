@@ -0,0 +1,94 @@
+"""
+    Latency-budget model selection: measure every candidate model on this
+    machine, keep those whose p95 latency fits the budget and take the most
+    accurate of them. The decision is stored with the hardware fingerprint and
+    the settings it was made for, and is only reused while both match.
+
+    Accuracy is the EER measured on the local gallery when every candidate has
+    one, rounded to `eer_resolution` so that the noise of a small gallery does
+    not override the known ranking, and the configured accuracy rank otherwise
+    (1 = most accurate).
+
+        results = {choice: {**measure_latency(run), 'eer': eer, 'accuracy_rank': rank}}
+        choice, fits = choose_model(results, budget_ms=300)
+        save_calibration(path, choice, results, settings)
+"""
+
+import os
+import json
+import time
+
+from speakerlab.utils.timing import percentile
+from speakerlab.utils.hardware import hardware_fingerprint, fingerprint_id
+
+
+def measure_latency(fn, repeat=20, warmup=2):
+    """
+    Calls fn() `warmup` times untimed and `repeat` times timed. Returns
+    {p50_ms, p95_ms, mean_ms}.
+    """
+    for _ in range(warmup):
+        fn()
+    values = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        values.append(time.perf_counter() - start)
+    values.sort()
+    return {'p50_ms': 1000 * percentile(values, 50),
+            'p95_ms': 1000 * percentile(values, 95),
+            'mean_ms': 1000 * sum(values) / len(values)}
+
+
+def accuracy_key(results, eer_resolution=0.01):
+    # sort key of a candidate, most accurate first
+    use_eer = all(r.get('eer') is not None for r in results.values())
+
+    def key(name):
+        r = results[name]
+        eer = round(r['eer'] / eer_resolution) if use_eer else 0
+        return (eer, r.get('accuracy_rank', float('inf')))
+    return key
+
+
+def choose_model(results, budget_ms, eer_resolution=0.01):
+    """
+    results: {name: {'p95_ms', 'eer' (or None), 'accuracy_rank'}}.
+    Returns (name, True) for the most accurate candidate within the budget, or
+    (fastest name, False) when none fits.
+    """
+    if not results:
+        raise ValueError('No candidate models to choose from.')
+    fitting = [name for name, r in results.items() if r['p95_ms'] <= budget_ms]
+    if not fitting:
+        return min(results, key=lambda name: results[name]['p95_ms']), False
+    return min(fitting, key=accuracy_key(results, eer_resolution)), True
+
+
+def load_calibration(path, settings):
+    """
+    The stored decision if it was made on this hardware with the same
+    settings (budget, utterance length, candidates...), else None.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if record.get('fingerprint_id') != fingerprint_id() or record.get('settings') != settings:
+        return None
+    return record
+
+
+def save_calibration(path, choice, results, settings, fits=True):
+    fingerprint = hardware_fingerprint()
+    record = {'choice': choice, 'fits_budget': fits, 'results': results, 'settings': settings,
+              'fingerprint': fingerprint, 'fingerprint_id': fingerprint_id(fingerprint), 'time': time.time()}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=1)
+    os.replace(tmp_path, path)
+    return record
@@ -0,0 +1,148 @@
+"""
+    Local model zoo: resolves a model id of infer_sv.supports to a directory in
+    local_model_dir without touching the network when the artifacts are there.
+
+    <local_model_dir>/<model>/manifest.json records the size, mtime and sha256 of
+    every artifact. When they match, the files are used in place; a changed stat
+    only triggers a re-hash. Missing or stale files are taken from the modelscope
+    snapshot by hard link (copy only when linking is not possible), files with
+    identical content are skipped, and a download only happens when something is
+    missing. In offline mode a missing artifact fails fast instead.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import pathlib
+
+from speakerlab.utils.flat_checkpoint import flat_path
+
+OFFLINE_ENV = 'SPEAKERLAB_OFFLINE'
+
+
+class ModelNotAvailableError(FileNotFoundError):
+    pass
+
+
+def sha256sum(path, chunk_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_offline(offline=None):
+    if offline is not None:
+        return offline
+    return os.environ.get(OFFLINE_ENV, '').lower() in ('1', 'true', 'yes')
+
+
+class LocalModelZoo(object):
+    def __init__(self, local_model_dir='pretrained', offline=None):
+        self.local_model_dir = pathlib.Path(local_model_dir)
+        self.offline = is_offline(offline)
+
+    def model_dir(self, model_id):
+        return self.local_model_dir / model_id.split('/')[1]
+
+    def _read_manifest(self, save_dir):
+        path = save_dir / 'manifest.json'
+        if not path.exists():
+            return {}
+        with open(path) as f:
+            return json.load(f).get('files', {})
+
+    def _write_manifest(self, save_dir, model_id, revision, files):
+        path = save_dir / 'manifest.json'
+        tmp_path = save_dir / 'manifest.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'model_id': model_id, 'revision': revision, 'files': files}, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _stamp(path, digest=None):
+        stat = path.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'sha256': digest if digest is not None else sha256sum(path)}
+
+    def _check(self, path, entry):
+        """
+        Returns the up-to-date manifest entry of an existing file, re-hashing it
+        only when its size or mtime differ from the recorded ones.
+        """
+        stat = path.stat()
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry
+        return self._stamp(path)
+
+    def local_files(self, save_dir, conf):
+        # tracked artifacts that exist locally: the checkpoint and the example wavs
+        files = [conf['model_pt']] if (save_dir / conf['model_pt']).is_file() else []
+        examples = save_dir / 'examples'
+        if examples.is_dir():
+            files += sorted(p.relative_to(save_dir).as_posix() for p in examples.rglob('*') if p.is_file())
+        return files
+
+    def resolve(self, model_id, conf):
+        """
+        Returns the local directory of model_id, conf being its infer_sv.supports entry.
+        Raises ModelNotAvailableError in offline mode when an artifact is missing.
+        """
+        save_dir = self.model_dir(model_id)
+        manifest = self._read_manifest(save_dir)
+        checkpoint = save_dir / conf['model_pt']
+        if checkpoint.is_file() or flat_path(checkpoint).is_file():
+            files = {rel: self._check(save_dir / rel, manifest.get(rel)) for rel in self.local_files(save_dir, conf)}
+            if files != manifest:
+                self._write_manifest(save_dir, model_id, conf['revision'], files)
+            return save_dir
+        if self.offline:
+            raise ModelNotAvailableError(
+                f'{conf["model_pt"]} of {model_id} not found in {save_dir} and offline mode is on '
+                f'(unset {OFFLINE_ENV} or drop --offline to download it).')
+        return self.fetch(model_id, conf, manifest)
+
+    def fetch(self, model_id, conf, manifest=None):
+        # imported here so that resolving local models does not need modelscope
+        from modelscope.hub.snapshot_download import snapshot_download
+        save_dir = self.model_dir(model_id)
+        save_dir.mkdir(exist_ok=True, parents=True)
+        cache_dir = pathlib.Path(snapshot_download(model_id, revision=conf['revision']))
+        manifest = dict(manifest or {})
+
+        sources = [cache_dir / conf['model_pt']]
+        examples = cache_dir / 'examples'
+        if examples.is_dir():
+            sources += sorted(p for p in examples.rglob('*') if p.is_file())
+        for src in sources:
+            if not src.is_file():
+                continue
+            rel = src.relative_to(cache_dir).as_posix()
+            dst = save_dir / rel
+            digest = sha256sum(src)
+            if dst.is_file() and self._check(dst, manifest.get(rel))['sha256'] == digest:
+                manifest[rel] = self._stamp(dst, digest)
+                continue
+            dst.parent.mkdir(exist_ok=True, parents=True)
+            tmp = dst.with_name(dst.name + '.tmp')
+            if tmp.exists():
+                tmp.unlink()
+            try:
+                os.link(src, tmp)
+            except OSError:
+                # other file system, or no hard links (e.g. FAT, some Windows setups)
+                shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+            manifest[rel] = self._stamp(dst, digest)
+        self._write_manifest(save_dir, model_id, conf['revision'], manifest)
+        return save_dir
+
+
+def resolve_model(model_id, local_model_dir='pretrained', offline=None):
+    """
+    Local directory of a model of infer_sv.supports, see LocalModelZoo.resolve.
+    """
+    from speakerlab.bin.infer_sv import supports
+    return LocalModelZoo(local_model_dir, offline).resolve(model_id, supports[model_id])
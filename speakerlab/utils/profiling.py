@@ -0,0 +1,183 @@
+"""
+    Layer-level profiling of the embedding models with the PyTorch profiler.
+
+    annotate_modules wraps the forward of every submodule in a profiler range
+    named module::<type>::<input shape>, so the Chrome trace shows the FCM head,
+    the TDNN / residual blocks, the fusion and the pooling as nested ranges with
+    the aten ops inside them. module_table folds the profiler events into one
+    row per module type and input shape with:
+        self_ms   time of the module minus the time of its child modules
+        total_ms  time of the module including its children
+        flops     FLOPs of the ops run directly by the module, as counted by the
+                  profiler (conv2d / matmul); Conv1d, which the profiler does
+                  not count, is computed from its output shape
+        alloc_mb  memory allocated by those ops
+    Times include the profiler overhead, so compare the self_pct column (share
+    of the forward) between model variants and utterance lengths rather than
+    the absolute numbers.
+
+        table = profile_forward(model, feat, trace_path='campplus_3s.json')
+        print(format_table(table))
+"""
+
+import csv
+import json
+import contextlib
+import torch
+from torch.profiler import profile, ProfilerActivity, record_function
+
+MODULE_PREFIX = 'module::'
+
+
+def _shape(inputs):
+    for x in inputs:
+        if torch.is_tensor(x):
+            return 'x'.join(str(d) for d in x.shape)
+    return ''
+
+
+def conv1d_flops(module, output):
+    # one multiply and one add per weight and output element
+    return 2 * output.numel() * module.in_channels // module.groups * module.kernel_size[0]
+
+
+@contextlib.contextmanager
+def annotate_modules(model, flops=None):
+    """
+    Opens a profiler range around the forward of every module of `model`
+    (the model itself included) while the block runs. If `flops` is a dict,
+    the FLOPs of the Conv1d calls are added to it by range name.
+    """
+    stack = []
+
+    def pre_hook(module, inputs):
+        name = f'{MODULE_PREFIX}{type(module).__name__}::{_shape(inputs)}'
+        ctx = record_function(name)
+        ctx.__enter__()
+        stack.append((ctx, name))
+
+    def post_hook(module, inputs, output):
+        ctx, name = stack.pop()
+        ctx.__exit__(None, None, None)
+        if flops is not None and isinstance(module, torch.nn.Conv1d):
+            flops[name] = flops.get(name, 0) + conv1d_flops(module, output)
+
+    handles = []
+    for module in model.modules():
+        handles.append(module.register_forward_pre_hook(pre_hook))
+        handles.append(module.register_forward_hook(post_hook))
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def profile_forward(model, feat, warmup=1, trace_path=None):
+    """
+    Runs `warmup` untimed forwards, then one forward under the profiler with
+    module annotations. Writes the Chrome trace to `trace_path` if given and
+    returns the module_table of the profiled forward.
+    """
+    conv1d = {}
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(feat)
+        with annotate_modules(model, conv1d), profile(activities=[ProfilerActivity.CPU], record_shapes=True,
+                                                      profile_memory=True, with_flops=True) as prof:
+            model(feat)
+    if trace_path is not None:
+        prof.export_chrome_trace(str(trace_path))
+    return module_table(prof.events(), conv1d)
+
+
+def _module_parent(event):
+    # innermost module range around `event`, None at top level
+    parent = event.cpu_parent
+    while parent is not None and not parent.name.startswith(MODULE_PREFIX):
+        parent = parent.cpu_parent
+    return parent
+
+
+def module_table(events, extra_flops=None):
+    """
+    One row per (module type, input shape), sorted by self time. See the module
+    docstring for the columns; `extra_flops` maps range names to FLOPs the
+    profiler did not count.
+    """
+    modules = {}  # event id -> [type, shape, total_us, self_us, flops, alloc]
+    top_us = 0.0
+    for event in events:
+        if event.name.startswith(MODULE_PREFIX):
+            mod_type, shape = event.name[len(MODULE_PREFIX):].split('::', 1)
+            modules[event.id] = [mod_type, shape, event.cpu_time_total, event.cpu_time_total, 0, 0]
+    for event in events:
+        parent = _module_parent(event)
+        if parent is None:
+            if event.name.startswith(MODULE_PREFIX):
+                top_us += event.cpu_time_total
+            continue
+        if event.name.startswith(MODULE_PREFIX):
+            modules[parent.id][3] -= event.cpu_time_total
+        else:
+            modules[parent.id][4] += event.flops or 0
+            modules[parent.id][5] += max(event.self_cpu_memory_usage, 0)
+
+    rows = {}
+    for mod_type, shape, total_us, self_us, flops, alloc in modules.values():
+        row = rows.setdefault((mod_type, shape), {'module': mod_type, 'shape': shape, 'calls': 0, 'self_ms': 0.0,
+                                                   'total_ms': 0.0, 'flops': 0, 'alloc_mb': 0.0})
+        row['calls'] += 1
+        row['self_ms'] += self_us / 1000
+        row['total_ms'] += total_us / 1000
+        row['flops'] += flops
+        row['alloc_mb'] += alloc / 2**20
+    for name, flops in (extra_flops or {}).items():
+        key = tuple(name[len(MODULE_PREFIX):].split('::', 1))
+        if key in rows:
+            rows[key]['flops'] += flops
+    rows = sorted(rows.values(), key=lambda r: r['self_ms'], reverse=True)
+    for row in rows:
+        row['self_pct'] = 100 * row['self_ms'] / (top_us / 1000) if top_us else None
+        row['gflops_per_s'] = row['flops'] / row['self_ms'] / 1e6 if row['self_ms'] > 0 else None
+    return rows
+
+
+def group_by_type(rows):
+    # the same table summed over the input shapes
+    grouped = {}
+    for row in rows:
+        g = grouped.setdefault(row['module'], {'module': row['module'], 'shape': '*', 'calls': 0, 'self_ms': 0.0,
+                                               'total_ms': 0.0, 'flops': 0, 'alloc_mb': 0.0, 'self_pct': 0.0})
+        for k in ('calls', 'self_ms', 'total_ms', 'flops', 'alloc_mb', 'self_pct'):
+            g[k] += row[k] or 0
+    grouped = sorted(grouped.values(), key=lambda r: r['self_ms'], reverse=True)
+    for g in grouped:
+        g['gflops_per_s'] = g['flops'] / g['self_ms'] / 1e6 if g['self_ms'] > 0 else None
+    return grouped
+
+
+def format_table(rows, top=20):
+    lines = [f"{'module':24s} {'input shape':20s} {'calls':>5s} {'self ms':>9s} {'self %':>6s} "
+             f"{'total ms':>9s} {'GFLOPs':>8s} {'GFLOP/s':>8s} {'alloc MB':>8s}"]
+    for r in rows[:top]:
+        lines.append(f"{r['module'][:24]:24s} {r['shape'][:20]:20s} {r['calls']:5d} {r['self_ms']:9.2f} "
+                     f"{r['self_pct'] or 0:6.1f} {r['total_ms']:9.2f} {r['flops'] / 1e9:8.3f} "
+                     f"{r['gflops_per_s'] or 0:8.1f} {r['alloc_mb']:8.1f}")
+    return '\n'.join(lines)
+
+
+def save_table(rows, path, **metadata):
+    """
+    Writes the rows to a .csv file, or to json with `metadata` (model,
+    duration, ...) so that runs of different variants can be told apart.
+    """
+    path = str(path)
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump({'metadata': metadata, 'modules': rows}, f, indent=1)
@@ -0,0 +1,135 @@
+"""
+    Prometheus text-format export of a MetricsRegistry over a local HTTP
+    endpoint, for scraping an unattended voice controller.
+
+    Counters are exported as <prefix><name>_total, gauges as <prefix><name>
+    and histograms as histograms: all-time cumulative _bucket{le=...} counts
+    over fixed bounds, _count and _sum, so they can be aggregated and turned
+    into quantiles with histogram_quantile() on the server. With stages=True
+    the per-stage spans of speakerlab.utils.timing are exported too, as
+    <prefix>stage_seconds{stage=...}.
+
+    Export is pull-based: nothing happens until a scrape, which copies the
+    series under the registry lock and formats them in the server thread, so
+    the audio threads only ever wait for that copy.
+
+        server = MetricsServer(metrics, port=9464).start()
+        # curl http://127.0.0.1:9464/metrics
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from speakerlab.utils import timing
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _histogram_lines(name, labels, buckets, bucket_counts, count, total):
+    lines = []
+    cumulative = 0
+    for bound, n in zip(buckets, bucket_counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{_labels(labels, le=repr(float(bound)))} {cumulative}')
+    lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+    lines.append(f'{name}_count{_labels(labels)} {count}')
+    lines.append(f'{name}_sum{_labels(labels)} {total!r}')
+    return lines
+
+
+def prometheus_text(registry, prefix='voicecompare_', stages=True):
+    """
+    The registry (and the timing stages) in the Prometheus text format 0.0.4.
+    """
+    snapshot = registry.snapshot()
+    families = {}  # metric name -> (type, lines)
+
+    def family(name, kind):
+        return families.setdefault(name, (kind, []))[1]
+
+    for (name, labels), value in sorted(snapshot['counters'].items()):
+        family(f'{prefix}{name}_total', 'counter').append(f'{prefix}{name}_total{_labels(labels)} {value!r}')
+    for (name, labels), value in sorted(snapshot['gauges'].items()):
+        family(f'{prefix}{name}', 'gauge').append(f'{prefix}{name}{_labels(labels)} {value!r}')
+    for (name, labels), (_, count, total) in sorted(snapshot['histograms'].items()):
+        buckets, bucket_counts = snapshot['buckets'][(name, labels)]
+        family(f'{prefix}{name}', 'histogram').extend(
+            _histogram_lines(f'{prefix}{name}', labels, buckets, bucket_counts, count, total))
+    if stages:
+        # buckets first: a span recorded between the two copies only raises _count and le="+Inf"
+        stage_buckets = timing.bucket_snapshot()
+        for stage, (_, count, total) in sorted(timing.snapshot().items()):
+            buckets, bucket_counts = stage_buckets.get(stage, ((), []))
+            family(f'{prefix}stage_seconds', 'histogram').extend(
+                _histogram_lines(f'{prefix}stage_seconds', (('stage', stage),), buckets, bucket_counts, count, total))
+    family(f'{prefix}metrics_dropped_series', 'gauge').append(
+        f"{prefix}metrics_dropped_series {snapshot['dropped']}")
+
+    out = []
+    for name, (kind, lines) in families.items():
+        out.append(f'# TYPE {name} {kind}')
+        out.extend(lines)
+    return '\n'.join(out) + '\n'
+
+
+class MetricsServer(object):
+    """
+    Serves prometheus_text(registry) on GET /metrics from a daemon thread.
+    Binds to localhost by default; port 0 picks a free port (see .port).
+    """
+    def __init__(self, registry, port=9464, host='127.0.0.1', prefix='voicecompare_', stages=True):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.stages = stages
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = prometheus_text(exporter.registry, exporter.prefix, exporter.stages).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # no line per scrape on the console of the apps
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}/metrics'
@@ -0,0 +1,165 @@
+"""
+    Verification metrics derived from a single sort of the scores.
+
+    The scores are sorted once; cumulative sums of the sorted labels give the
+    miss / false-alarm rates at every distinct threshold, from which the EER,
+    minDCF, the DET curve and the average precision follow with vector ops only.
+"""
+
+import multiprocessing
+import numpy as np
+
+
+def _as_arrays(scores, labels):
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    labels = np.asarray(labels).reshape(-1).astype(bool)
+    assert scores.shape[0] == labels.shape[0], 'Scores and labels differ in length.'
+    return scores, labels
+
+
+def sort_scores(scores, labels):
+    # ascending sort, shared by every metric below
+    scores, labels = _as_arrays(scores, labels)
+    order = np.argsort(scores, kind='mergesort')
+    return scores[order], labels[order]
+
+
+def compute_det_curve(scores, labels, presorted=False):
+    """
+    Returns (fnr, fpr, thresholds) for every distinct threshold, trials with
+    score >= threshold are accepted. fnr is increasing, fpr decreasing.
+    """
+    if presorted:
+        scores, labels = _as_arrays(scores, labels)
+    else:
+        scores, labels = sort_scores(scores, labels)
+    num_tar = labels.sum()
+    num_non = labels.size - num_tar
+    assert num_tar > 0 and num_non > 0, 'Both target and non-target trials are needed.'
+    tar_cum = np.concatenate([[0], np.cumsum(labels)])
+    non_cum = np.concatenate([[0], np.cumsum(~labels)])
+    # a threshold is only meaningful between two distinct scores
+    keep = np.concatenate([[True], scores[1:] != scores[:-1], [True]])
+    fnr = tar_cum[keep] / num_tar
+    fpr = 1 - non_cum[keep] / num_non
+    thresholds = np.concatenate([scores, [np.inf]])[keep]
+    return fnr, fpr, thresholds
+
+
+def eer_from_det(fnr, fpr, thresholds=None):
+    # interpolate between the two points around the fnr == fpr crossing
+    diff = fnr - fpr
+    x1 = np.flatnonzero(diff >= 0)[0]
+    x2 = np.flatnonzero(diff < 0)[-1]
+    a = (fnr[x1] - fpr[x1]) / (fpr[x2] - fpr[x1] - (fnr[x2] - fnr[x1]))
+    eer = fnr[x1] + a * (fnr[x2] - fnr[x1])
+    if thresholds is None:
+        return float(eer)
+    return float(eer), float(thresholds[x1])
+
+
+def min_dcf_from_det(fnr, fpr, thresholds=None, p_target=0.01, c_miss=1, c_fa=1):
+    c_det = c_miss * p_target * fnr + c_fa * (1 - p_target) * fpr
+    c_def = min(c_miss * p_target, c_fa * (1 - p_target))
+    idx = np.argmin(c_det)
+    min_dcf = c_det[idx] / c_def
+    if thresholds is None:
+        return float(min_dcf)
+    return float(min_dcf), float(thresholds[idx])
+
+
+def average_precision_sorted(labels_desc):
+    # labels_desc: labels sorted by decreasing score
+    labels_desc = np.asarray(labels_desc).astype(np.float64)
+    tp = labels_desc.cumsum()
+    recall = tp / tp[-1]
+    precision = tp / (np.arange(len(labels_desc)) + 1)
+
+    recall = np.concatenate([[0], recall, [1]])
+    precision = np.concatenate([[0], precision, [0]])
+    # Smooth precision to be monotonically decreasing.
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+
+    indices = np.where(recall[1:] != recall[:-1])[0] + 1
+    return float(np.sum((recall[indices] - recall[indices - 1]) * precision[indices]))
+
+
+def compute_eer(scores, labels):
+    return eer_from_det(*compute_det_curve(scores, labels)[:2])
+
+
+def compute_min_dcf(scores, labels, p_target=0.01, c_miss=1, c_fa=1):
+    fnr, fpr, _ = compute_det_curve(scores, labels)
+    return min_dcf_from_det(fnr, fpr, p_target=p_target, c_miss=c_miss, c_fa=c_fa)
+
+
+def average_precision(scores, labels):
+    scores, labels = _as_arrays(scores, labels)
+    order = np.argsort(scores)[::-1]
+    return average_precision_sorted(labels[order])
+
+
+def compute_metrics(scores, labels, p_targets=(0.01, 0.001), c_miss=1, c_fa=1, det=False):
+    """
+    EER, minDCF for every p_target, and AP from one sort of the scores.
+    The DET curve (fnr, fpr, thresholds) is included when det=True.
+    """
+    scores, labels = sort_scores(scores, labels)
+    fnr, fpr, thresholds = compute_det_curve(scores, labels, presorted=True)
+    eer, eer_threshold = eer_from_det(fnr, fpr, thresholds)
+    results = {
+        'num_trials': int(labels.size),
+        'num_targets': int(labels.sum()),
+        'eer': eer,
+        'eer_threshold': eer_threshold,
+        'ap': average_precision_sorted(labels[::-1]),
+        'min_dcf': {},
+    }
+    for p_target in p_targets:
+        min_dcf, threshold = min_dcf_from_det(fnr, fpr, thresholds, p_target, c_miss, c_fa)
+        results['min_dcf'][p_target] = {'value': min_dcf, 'threshold': threshold}
+    if det:
+        results['det'] = (fnr, fpr, thresholds)
+    return results
+
+
+# set in every bootstrap worker by _init_bootstrap
+_BOOT = None
+
+
+def _init_bootstrap(scores, labels, p_targets, c_miss, c_fa):
+    global _BOOT
+    _BOOT = (scores, labels, p_targets, c_miss, c_fa)
+
+
+def _bootstrap_task(seed):
+    scores, labels, p_targets, c_miss, c_fa = _BOOT
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(scores), len(scores))
+    res = compute_metrics(scores[idx], labels[idx], p_targets, c_miss, c_fa)
+    return [res['eer']] + [res['min_dcf'][p]['value'] for p in p_targets]
+
+
+def bootstrap_metrics(scores, labels, p_targets=(0.01, 0.001), num_samples=100,
+                      alpha=0.05, nj=1, seed=0, c_miss=1, c_fa=1):
+    """
+    Percentile bootstrap confidence intervals of EER and minDCF, trials are
+    resampled with replacement and the replicates run in `nj` processes.
+    Returns {'eer': (low, high), 'min_dcf': {p_target: (low, high)}}.
+    """
+    scores, labels = _as_arrays(scores, labels)
+    # the arrays are sent to every worker once, the tasks are only the seeds
+    initargs = (scores, labels, tuple(p_targets), c_miss, c_fa)
+    seeds = range(seed, seed + num_samples)
+    if nj > 1:
+        with multiprocessing.Pool(nj, initializer=_init_bootstrap, initargs=initargs) as pool:
+            reps = pool.map(_bootstrap_task, seeds)
+    else:
+        _init_bootstrap(*initargs)
+        reps = [_bootstrap_task(s) for s in seeds]
+    reps = np.array(reps)
+    low, high = np.quantile(reps, [alpha / 2, 1 - alpha / 2], axis=0)
+    return {
+        'eer': (float(low[0]), float(high[0])),
+        'min_dcf': {p: (float(low[i + 1]), float(high[i + 1])) for i, p in enumerate(p_targets)},
+    }
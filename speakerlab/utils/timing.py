@@ -0,0 +1,301 @@
+"""
+    Per-stage timing of the embedding path: recording, file write/read,
+    resampling, fbank, forward and scoring.
+
+    `span(name)` (context manager) and `timed(name)` (decorator) time a stage.
+    `request(name)` groups the spans of one identification or extraction: the
+    spans opened inside it, in the same thread, are kept with their offsets and
+    nesting depth and the finished request is appended to `recent_requests()`
+    and, when a trace file is set, written to it as one json line. Every span
+    and request also feeds a rolling histogram of its last `window` durations,
+    read with `stats()`, and all-time counts in fixed buckets (LATENCY_BUCKETS),
+    read with `bucket_snapshot()`.
+
+    Timing is off by default and then `span` returns a shared no-op context, so
+    the instrumented code pays one global lookup per stage. It is switched on
+    with `enable()`, or at import with SPEAKERLAB_TIMING=1 (histograms only) or
+    SPEAKERLAB_TIMING=<path.jsonl> (also the trace file).
+
+        from speakerlab.utils import timing
+        timing.enable(trace_path='trace.jsonl')
+        with timing.request('identify'):
+            with timing.span('fbank'):
+                feat = fbank(wav)
+        print(timing.stats()['fbank']['p95_ms'])
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+import collections
+
+TIMING_ENV = 'SPEAKERLAB_TIMING'
+# upper bounds (seconds) of the fixed histogram buckets, e.g. for Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_window = 1000
+_histograms = {}
+_requests = collections.deque(maxlen=100)
+_trace_file = None
+
+
+class RollingHistogram(object):
+    """
+    Last `window` values of a stage plus the all-time count, total and counts
+    per bucket (upper bounds `buckets`, inclusive). Adding a value is O(1) plus
+    a bisect over the bounds; percentiles are computed when they are read.
+    """
+    def __init__(self, window=1000, buckets=LATENCY_BUCKETS):
+        self.values = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.buckets = tuple(buckets)
+        # not cumulative, the last one counts the values above every bound
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+
+    def add(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def summary(self, percentiles=(50, 95, 99)):
+        return summarize(list(self.values), self.count, self.total, percentiles)
+
+
+def percentile(sorted_values, p):
+    # linear interpolation between closest ranks, like numpy.percentile
+    pos = (len(sorted_values) - 1) * p / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def summarize(values, count, total, percentiles=(50, 95, 99)):
+    # seconds in, milliseconds out; None for an empty window. No numpy, so the
+    # apps can import this module before their heavy dependencies.
+    values = sorted(values)
+    res = {'count': count, 'window': len(values), 'mean_ms': 1000 * total / count if count else None}
+    for p in percentiles:
+        res[f'p{p}_ms'] = 1000 * percentile(values, p) if values else None
+    res['max_ms'] = 1000 * values[-1] if values else None
+    return res
+
+
+class _NoopSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def _record(name, seconds):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = RollingHistogram(_window)
+        hist.add(seconds)
+
+
+class _Span(object):
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        current = getattr(_local, 'request', None)
+        if current is not None:
+            current.depth += 1
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start
+        _record(self.name, seconds)
+        current = getattr(_local, 'request', None)
+        if current is not None:
+            current.depth -= 1
+            span = {'name': self.name, 'start_ms': 1000 * (self.start - current.start),
+                    'ms': 1000 * seconds, 'depth': current.depth}
+            if self.attrs:
+                span.update(self.attrs)
+            if exc_type is not None:
+                span['error'] = exc_type.__name__
+            current.spans.append(span)
+        return False
+
+
+class _Request(object):
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.depth = 0
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        _local.request = self
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start
+        _local.request = None
+        _record(self.name, seconds)
+        record = {'request': self.name, 'time': self.wall, 'ms': 1000 * seconds}
+        if self.attrs:
+            record.update(self.attrs)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record['spans'] = sorted(self.spans, key=lambda s: s['start_ms'])
+        with _lock:
+            _requests.append(record)
+            if _trace_file is not None:
+                _trace_file.write(json.dumps(record) + '\n')
+                _trace_file.flush()
+        return False
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(trace_path=None, window=1000, max_requests=100):
+    """
+    Starts timing. `window` is the number of durations kept per stage,
+    `max_requests` the number of finished requests kept in memory and
+    `trace_path` an optional json-lines file the requests are appended to.
+    """
+    global _enabled, _window, _requests, _trace_file
+    with _lock:
+        _window = window
+        _requests = collections.deque(_requests, maxlen=max_requests)
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+        if trace_path is not None:
+            _trace_file = open(trace_path, 'a')
+        _enabled = True
+
+
+def disable():
+    global _enabled, _trace_file
+    with _lock:
+        _enabled = False
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _requests.clear()
+
+
+def span(name, **attrs):
+    """
+    Times the block as stage `name`. Keyword arguments are stored with the span
+    in the request trace.
+    """
+    if not _enabled:
+        return _NOOP
+    return _Span(name, attrs)
+
+
+def request(name, **attrs):
+    """
+    Like span, and groups the spans opened inside it in this thread into one
+    trace record. A request opened inside another one is a plain span.
+    """
+    if not _enabled:
+        return _NOOP
+    if getattr(_local, 'request', None) is not None:
+        return _Span(name, attrs)
+    return _Request(name, attrs)
+
+
+def annotate(**attrs):
+    """
+    Adds fields (e.g. the decision) to the record of the request open in this
+    thread; does nothing outside a request or when timing is off.
+    """
+    current = getattr(_local, 'request', None) if _enabled else None
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def timed(name=None, as_request=False):
+    """
+    Decorator timing every call of the function as stage `name` (default: its
+    qualified name), or as a request with as_request=True.
+    """
+    def decorator(fn):
+        stage = name or fn.__qualname__
+        context = request if as_request else span
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with context(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stats():
+    """
+    {stage: {count, window, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}} over the
+    rolling window of every stage seen so far.
+    """
+    # copied under the lock, sorted outside it: span exits never wait on a reader
+    histograms = snapshot()
+    return {name: summarize(*histograms[name]) for name in sorted(histograms)}
+
+
+def snapshot():
+    # {stage: (window of durations in seconds, all-time count, all-time sum)}
+    with _lock:
+        return {name: (list(h.values), h.count, h.total) for name, h in _histograms.items()}
+
+
+def bucket_snapshot():
+    # {stage: (bucket upper bounds, all-time count per bucket, the last one above every bound)}
+    with _lock:
+        return {name: (h.buckets, list(h.bucket_counts)) for name, h in _histograms.items()}
+
+
+def recent_requests(n=None):
+    with _lock:
+        records = list(_requests)
+    return records if n is None else records[-n:]
+
+
+def format_stats(stage_stats=None):
+    # one line per stage, for the [INFO] output of the scripts and the apps
+    stage_stats = stats() if stage_stats is None else stage_stats
+    lines = []
+    for name, s in stage_stats.items():
+        if not s['window']:
+            continue
+        lines.append(f"    {name:24s} n={s['count']:<6d} mean {s['mean_ms']:9.2f} ms  p50 {s['p50_ms']:9.2f} ms  "
+                     f"p95 {s['p95_ms']:9.2f} ms  max {s['max_ms']:9.2f} ms")
+    return '\n'.join(lines)
+
+
+_env = os.environ.get(TIMING_ENV, '')
+if _env.lower() in ('1', 'true', 'yes'):
+    enable()
+elif _env and _env.lower() not in ('0', 'false', 'no'):
+    enable(trace_path=_env)
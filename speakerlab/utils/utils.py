@@ -11,6 +11,7 @@ from contextlib import contextmanager
 
 import torch
 from speakerlab.utils.fileio import load_yaml
+from speakerlab.utils import score_metrics
 
 def parse_config(config_file):
     if config_file.endwith('.yaml'):
@@ -96,34 +97,20 @@ def average_precision(scores, labels):
     assert len(scores.shape)==1 and len(labels.shape)==1 and \
         scores.shape[0]==labels.shape[0]
 
-    sort_idx = np.argsort(scores)[::-1]
-    scores = scores[sort_idx]
-    labels = labels[sort_idx]
-    tp_count = (labels==1).sum()
-    tp = labels.cumsum()
-    recall = tp / tp_count
-    precision = tp / (np.arange(len(labels)) + 1)
+    return score_metrics.average_precision(scores, labels)
 
-    recall = np.concatenate([[0], recall, [1]])
-    precision = np.concatenate([[0], precision, [0]])
-
-    # Smooth precision to be monotonically decreasing.
-    for i in range(len(precision) - 2, -1, -1):
-        precision[i] = np.maximum(precision[i], precision[i + 1])
-
-    indices = np.where(recall[1:] != recall[:-1])[0] + 1
-    average_precision = np.sum(
-        (recall[indices] - recall[indices - 1]) * precision[indices])
-    return average_precision
-
-def load_params(dst_model, src_state, strict=True):
+def load_params(dst_model, src_state, strict=True, assign=False):
     dst_state = {}
     for k in src_state:
         if k.startswith('module'):
             dst_state[k[7:]] = src_state[k]
         else:
             dst_state[k] = src_state[k]
-    dst_model.load_state_dict(dst_state, strict=strict)
+    if assign:
+        # the tensors of src_state become the parameters (torch >= 2.1), no copy
+        dst_model.load_state_dict(dst_state, strict=strict, assign=True)
+    else:
+        dst_model.load_state_dict(dst_state, strict=strict)
     return dst_model
 
 def merge_vad(vad1: list, vad2: list):
@@ -4,23 +4,45 @@ Sistema de Control por Voz con Identificación de Hablante
 Permite ejecutar comandos específicos según la identidad del hablante identificado
 """
 
-import speech_recognition as sr
 import subprocess
-import pyautogui
 import os
 import sys
 import time
+import threading
 from pathlib import Path
 
 # Agregar rutas del proyecto para poder importar el comparador
 sys.path.append(os.path.dirname(__file__))
 
-try:
-    from audio_comparator_menu import AudioComparator
-    COMPARATOR_AVAILABLE = True
-except ImportError:
+from speakerlab.utils.lazy_import import lazy_import, module_available
+from speakerlab.utils import timing
+from speakerlab.utils.metrics import MetricsRegistry
+
+# Se cargan al usarse por primera vez, no al importar este módulo
+sr = lazy_import('speech_recognition')
+pyautogui = lazy_import('pyautogui')
+
+# El comparador (torch, torchaudio, sounddevice) se importa al crear el
+# VoiceController; aquí solo se comprueba que las dependencias estén instaladas
+COMPARATOR_AVAILABLE = all(module_available(dep) for dep in ('torch', 'torchaudio', 'sounddevice'))
+
+# Puerto del endpoint de métricas Prometheus (opcional; también con --metrics-port en el launcher)
+METRICS_PORT_ENV = 'VOICECOMPARE_METRICS_PORT'
+# Límites de los buckets del histograma de scores: coseno (hasta 1) y S-norm (más allá)
+BUCKETS_SCORE = (-0.5, 0.0, 0.25, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 2.0, 3.0, 4.0, 6.0, 8.0)
+
+# Presupuesto de latencia p95 (ms) del modelo de identificación (también --latency-budget)
+LATENCY_BUDGET_ENV = 'VOICECOMPARE_LATENCY_BUDGET_MS'
+RECALIBRATE_ENV = 'VOICECOMPARE_RECALIBRATE'
+# Identificación en cascada CAM++ -> modelo elegido (opcional; también --cascade)
+CASCADE_ENV = 'VOICECOMPARE_CASCADE'
+PRESUPUESTO_LATENCIA_MS = 300
+# Modelo usado si no hay pesos locales para calibrar (ERes2Net)
+MODELO_POR_DEFECTO = "2"
+# Decisión de la calibración, con la huella del hardware en que se midió
+CALIBRACION_PATH = os.path.join('pretrained', 'seleccion_modelo.json')
+if not COMPARATOR_AVAILABLE:
     print("⚠️  AudioComparator no disponible. Funcionando en modo básico.")
-    COMPARATOR_AVAILABLE = False
 
 class VoiceController:
     def __init__(self):
@@ -48,11 +70,25 @@ class VoiceController:
             "Desconocido": []
         }
         
+        # Contadores y latencias de la sesión (ventana de estadísticas de la GUI)
+        self.metricas = MetricsRegistry(buckets={'identification_score': BUCKETS_SCORE})
+        self.servidor_metricas = None
+        # Identificaciones en curso (profundidad de la cola de trabajo)
+        self.identificaciones_en_curso = 0
+        self.lock_en_curso = threading.Lock()
+        self.metricas.register_gauge('identifications_in_progress', lambda: self.identificaciones_en_curso)
+        
         # Inicializar audio comparator si está disponible
+        global COMPARATOR_AVAILABLE
         if COMPARATOR_AVAILABLE:
             try:
-                self.audio_comparator = AudioComparator()
+                from audio_comparator_menu import AudioComparator
+                self.audio_comparator = AudioComparator(metrics=self.metricas)
                 print("✅ Audio Comparator inicializado correctamente")
+            except ImportError as e:
+                print(f"⚠️  AudioComparator no disponible ({e}). Funcionando en modo básico.")
+                COMPARATOR_AVAILABLE = False
+                self.audio_comparator = None
             except Exception as e:
                 print(f"⚠️ Error inicializando Audio Comparator: {e}")
                 self.audio_comparator = None
@@ -64,6 +100,26 @@ class VoiceController:
         self.current_speaker = "Desconocido"
         self.authenticated = False
         
+        # Identificación en cascada (opcional): CAM++ decide los casos claros y el
+        # modelo elegido los dudosos; su banda se calibra con los archivos de data/
+        self.usar_cascada = os.environ.get(CASCADE_ENV, '').lower() in ('1', 'true', 'yes')
+        
+        # Modelo de identificación: el más preciso cuya latencia p95 cabe en el
+        # presupuesto en esta máquina (se calibra al precalentar, ver calibrar_modelo)
+        self.duracion_identificacion = 3
+        try:
+            self.presupuesto_latencia_ms = float(os.environ.get(LATENCY_BUDGET_ENV) or PRESUPUESTO_LATENCIA_MS)
+        except ValueError:
+            print(f"⚠️ {LATENCY_BUDGET_ENV} no es un número; se usan {PRESUPUESTO_LATENCIA_MS} ms")
+            self.presupuesto_latencia_ms = PRESUPUESTO_LATENCIA_MS
+        self.modelo_identificacion = MODELO_POR_DEFECTO
+        self.calibracion = None
+        
+        # Adaptación online de los hablantes (opcional, desactivada por defecto)
+        self.adaptacion_activa = False
+        self.sesion_id = f"sesion_{int(time.time())}"
+        self.ultima_adaptacion = None  # (carpeta del hablante, galería usada)
+        
         # Control de escucha continua
         self.continuous_listening = False
         self.stop_listening = False
@@ -79,6 +135,141 @@ class VoiceController:
         
         # Verificar dependencias críticas
         self.verificar_dependencias()
+        
+        # Precalentar modelos y galería en segundo plano
+        self.estado_precalentamiento = "inactivo"  # inactivo, calentando, listo, error
+        self.tiempo_precalentamiento = None
+        self.precalentamiento_listo = threading.Event()
+        self.iniciar_precalentamiento()
+        
+        # Endpoint de métricas si se pidió por variable de entorno
+        if os.environ.get(METRICS_PORT_ENV):
+            try:
+                self.iniciar_servidor_metricas(int(os.environ[METRICS_PORT_ENV]))
+            except (ValueError, OSError) as e:
+                print(f"⚠️ No se pudo iniciar el endpoint de métricas: {e}")
+
+    def iniciar_servidor_metricas(self, puerto=9464, host='127.0.0.1'):
+        """Exponer las métricas en formato Prometheus en http://host:puerto/metrics
+        
+        Activa también los tiempos por etapa (grabación, fbank, forward...) para
+        exportar la latencia de identificación desglosada.
+        
+        Returns:
+            MetricsServer: el servidor en marcha
+        """
+        from speakerlab.utils.prometheus import MetricsServer
+        if self.servidor_metricas is not None:
+            return self.servidor_metricas
+        if not timing.is_enabled():
+            timing.enable()
+        self.servidor_metricas = MetricsServer(self.metricas, puerto, host).start()
+        print(f"📡 Métricas disponibles en {self.servidor_metricas.url}")
+        return self.servidor_metricas
+
+    def detener_servidor_metricas(self):
+        """Detener el endpoint de métricas si está activo"""
+        if self.servidor_metricas is not None:
+            self.servidor_metricas.stop()
+            self.servidor_metricas = None
+
+    def iniciar_precalentamiento(self):
+        """Cargar los modelos de identificación en un hilo aparte
+        
+        Carga los pesos, hace inferencias con audio sintético de duraciones
+        típicas (reserva de memoria, primeras llamadas a los kernels) y prepara
+        la galería de hablantes y la cascada. Las identificaciones esperan a que
+        termine en lugar de pagar ese coste en la primera petición.
+        """
+        if not self.audio_comparator:
+            self.precalentamiento_listo.set()
+            return
+        
+        def precalentar():
+            self.estado_precalentamiento = "calentando"
+            inicio = time.perf_counter()
+            try:
+                try:
+                    self.modelo_identificacion = self.calibrar_modelo(
+                        forzar=os.environ.get(RECALIBRATE_ENV, '').lower() in ('1', 'true', 'yes'))
+                except Exception as e:
+                    self.metricas.inc('errors', source='calibracion')
+                    print(f"⚠️ Error calibrando los modelos, se usa el modelo por defecto: {e}")
+                # La cascada prepara las galerías de CAM++ y del modelo elegido; sin ella solo el elegido
+                cascada = self.obtener_cascada()
+                modelos = [etapa['choice'] for etapa in cascada.stages] if cascada else [self.modelo_identificacion]
+                for modelo in modelos:
+                    self.audio_comparator.get_enrollment(modelo)
+                    self.audio_comparator.warm_up(modelo)
+                if self.audio_comparator.normalizar_scores:
+                    self.audio_comparator.get_score_norm(self.modelo_identificacion)
+                self.estado_precalentamiento = "listo"
+                self.tiempo_precalentamiento = time.perf_counter() - inicio
+                print(f"🔥 Modelos listos en {self.tiempo_precalentamiento:.1f}s")
+            except Exception as e:
+                self.estado_precalentamiento = "error"
+                self.metricas.inc('errors', source='precalentamiento')
+                print(f"⚠️ Error precalentando los modelos: {e}")
+            finally:
+                self.precalentamiento_listo.set()
+        
+        threading.Thread(target=precalentar, daemon=True).start()
+
+    def calibrar_modelo(self, forzar=False):
+        """Elegir el modelo de identificación según el presupuesto de latencia
+        
+        Mide en esta máquina la latencia de fbank + forward de cada modelo con
+        pesos locales para la duración de identificación configurada, y elige el
+        más preciso cuya p95 cabe en el presupuesto (si no cabe ninguno, el más
+        rápido). La precisión es el EER con los archivos de data/, o el orden
+        accuracy_rank de models_config si no hay datos suficientes. La decisión
+        se guarda con la huella del hardware y se reutiliza mientras no cambien
+        la máquina, el presupuesto, la duración ni los modelos disponibles.
+        
+        Returns:
+            str: opción de models_config elegida
+        """
+        from speakerlab.utils.model_selection import choose_model, load_calibration, save_calibration
+        config = self.audio_comparator.models_config
+        candidatos = {choice: cfg['model_id'] for choice, cfg in config.items()
+                      if 'config' in cfg and self.audio_comparator.model_available(choice)}
+        if not candidatos:
+            print(f"⚠️ No hay pesos locales para calibrar; se usa {config[MODELO_POR_DEFECTO]['name']}")
+            return MODELO_POR_DEFECTO
+        
+        ajustes = {'budget_ms': self.presupuesto_latencia_ms, 'duration': self.duracion_identificacion,
+                   'candidates': candidatos}
+        registro = None if forzar else load_calibration(CALIBRACION_PATH, ajustes)
+        if registro is None:
+            print(f"📐 Calibrando modelos para {self.duracion_identificacion}s de audio "
+                  f"(presupuesto p95: {self.presupuesto_latencia_ms:.0f} ms)...")
+            resultados = {}
+            for choice in candidatos:
+                resultados[choice] = self.audio_comparator.benchmark_model(choice, self.duracion_identificacion)
+                resultados[choice]['eer'] = self.audio_comparator.gallery_eer(choice)
+                resultados[choice]['accuracy_rank'] = config[choice].get('accuracy_rank')
+                eer = resultados[choice]['eer']
+                print(f"   ⏱️  {config[choice]['name']}: p95 {resultados[choice]['p95_ms']:.0f} ms"
+                      f"{'' if eer is None else f', EER {eer * 100:.1f}%'}")
+            choice, cabe = choose_model(resultados, self.presupuesto_latencia_ms)
+            registro = save_calibration(CALIBRACION_PATH, choice, resultados, ajustes, cabe)
+        
+        self.calibracion = registro
+        choice = registro['choice']
+        p95 = registro['results'][choice]['p95_ms']
+        self.metricas.set('identification_model_p95_ms', p95)
+        if registro['fits_budget']:
+            print(f"📐 Modelo de identificación: {config[choice]['name']} (p95 {p95:.0f} ms)")
+        else:
+            print(f"⚠️ Ningún modelo cabe en {self.presupuesto_latencia_ms:.0f} ms; "
+                  f"se usa el más rápido: {config[choice]['name']} (p95 {p95:.0f} ms)")
+        return choice
+
+    def esperar_precalentamiento(self, timeout=None):
+        """Esperar a que terminen de cargarse los modelos; True si ya terminó"""
+        if not self.precalentamiento_listo.is_set():
+            print("⏳ Esperando a que terminen de cargarse los modelos...")
+        return self.precalentamiento_listo.wait(timeout)
 
     def verificar_dependencias(self):
         """Verificar que las dependencias críticas estén instaladas"""
@@ -88,19 +279,29 @@ class VoiceController:
         ]
         
         for dep in dependencias:
-            try:
-                __import__(dep)
-            except ImportError:
+            if not module_available(dep):
                 print(f"⚠️ Dependencia faltante: {dep}")
                 print(f"   Instalar con: pip install {dep}")
 
-    def identificar_hablante(self, duracion=3, auto_start=False):
+    @timing.timed('identificar_hablante', as_request=True)
+    def identificar_hablante(self, duracion=None, auto_start=False):
         """Identificar al hablante actual usando grabación de voz
         
         Args:
-            duracion (int): Duración de la grabación en segundos
+            duracion (int): Duración de la grabación en segundos (por defecto
+                la duración para la que se calibró el modelo)
             auto_start (bool): Si True, inicia automáticamente sin esperar Enter
         """
+        with self.lock_en_curso:
+            self.identificaciones_en_curso += 1
+        try:
+            return self._identificar_hablante(duracion or self.duracion_identificacion, auto_start)
+        finally:
+            with self.lock_en_curso:
+                self.identificaciones_en_curso -= 1
+
+    def _identificar_hablante(self, duracion, auto_start):
+        """Grabar, comparar con la galería y decidir (ver identificar_hablante)"""
         if not COMPARATOR_AVAILABLE:
             print("❌ Sistema de identificación no disponible")
             return "Desconocido"
@@ -114,63 +315,80 @@ class VoiceController:
         recorded_file = self.audio_comparator.record_audio(duration=duracion, auto_start=auto_start)
         if not recorded_file:
             print("❌ Error en la grabación")
+            self.metricas.inc('errors', source='grabacion')
             return "Desconocido"
+        # Latencia de identificación: desde el fin de la grabación hasta la decisión
+        inicio = time.perf_counter()
         
-        # Referencias conocidas - usar las mismas que el audio_comparator
-        reference_files = {
-            "Daniel": [
-                "data/daniel_2/record_out (11).wav",
-                "data/daniel_2/audio_01.wav",
-                "data/daniel_2/record_out.wav"
-            ],
-            "Hablante_1": [
-                "data/hablante_1/hablante_1_02.wav",
-                "data/hablante_1/hablante_1_01.wav", 
-                "data/hablante_1/hablante_1_03.wav"
-            ]
-        }
+        # Los modelos se cargan al iniciar; si aún no han terminado, esperar aquí
+        # (la grabación ya se ha hecho mientras tanto)
+        with timing.span('esperar_modelos'):
+            self.esperar_precalentamiento()
         
-        # Verificar archivos disponibles
-        available_references = {}
-        for person, files in reference_files.items():
-            available_files = [f for f in files if os.path.exists(f)]
-            if available_files:
-                available_references[person] = available_files
+        # Galería de hablantes de data/ (solo se procesan los archivos nuevos)
+        model_choice = self.modelo_identificacion
+        cascada = self.obtener_cascada()
+        try:
+            with timing.span('galeria'):
+                enrollment = self.audio_comparator.get_enrollment(model_choice)
+        except Exception as e:
+            print(f"❌ Error preparando la galería de hablantes: {e}")
+            enrollment = None
         
-        if not available_references:
+        if enrollment is None or len(enrollment.gallery) == 0:
             print("❌ No se encontraron archivos de referencia")
+            self.metricas.inc('errors', source='galeria')
             try:
                 os.remove(recorded_file)
             except:
                 pass
             return "Desconocido"
         
-        # Comparar con personas conocidas usando el modelo ERes2Net (opción 2)
-        results = {}
-        model_choice = "2"  # Usar ERes2Net por defecto
+        # Threshold para aceptar identificación (el medio del modelo elegido)
+        threshold = self.audio_comparator.models_config[model_choice].get("thresholds", [0.70, 0.60, 0.45, 0.30])[2]
+        # Con scores normalizados se decide con ellos; la adaptación sigue usando el coseno
+        norm = self.audio_comparator.get_score_norm(model_choice) if self.audio_comparator.normalizar_scores else None
+        if norm is not None:
+            threshold = self.audio_comparator.models_config[model_choice].get("norm_thresholds", [4.0, 3.0, 2.0, 1.0])[2]
         
+        # Comparar la grabación con el centroide de cada hablante conocido
+        results = {}
+        ranking = []
+        decision = []
+        embedding = None
+        aceptado = False
         print("🔍 Comparando con hablantes conocidos...")
         
-        for person, reference_files_list in available_references.items():
-            print(f"   👤 Comparando con {person}...")
-            person_scores = []
-            
-            for ref_file in reference_files_list[:2]:  # Solo 2 archivos para ser más rápido
-                try:
-                    # Usar el modelo cargado directamente para mejor control
-                    score = self.audio_comparator.compare_with_model(model_choice, recorded_file, ref_file)
-                    
-                    if score is not None:
-                        person_scores.append(score)
-                        print(f"      🎯 {os.path.basename(ref_file)}: {score:.3f}")
-                except Exception as e:
-                    print(f"      ❌ Error con {ref_file}: {e}")
-                    continue
-            
-            if person_scores:
-                avg_score = sum(person_scores) / len(person_scores)
-                results[person] = avg_score
-                print(f"   📊 Promedio para {person}: {avg_score:.3f}")
+        try:
+            if cascada is not None:
+                # CAM++ primero; el modelo elegido solo si el score cae en la banda dudosa
+                feat = self.audio_comparator.extract_features(recorded_file)
+                with timing.span('cascada'):
+                    resultado = cascada.identify(feat)
+                ranking, embedding = resultado['ranking'], resultado['embedding']
+                etapa = cascada.stages[resultado['stage_index']]
+                enrollment = self.audio_comparator.get_enrollment(etapa['choice'])
+                decision = ranking
+                aceptado = resultado['speaker'] is not None
+                threshold = etapa['band'][1] if aceptado else etapa['band'][0]
+                print(f"🪜 Decidido por {resultado['stage']} "
+                      f"(etapa {resultado['stage_index'] + 1}/{len(cascada.stages)}) en {resultado['latency'] * 1000:.0f} ms")
+            else:
+                model, _ = self.audio_comparator.load_model(model_choice)
+                embedding = self.audio_comparator.extract_embedding(recorded_file, model)
+                with timing.span('scoring'):
+                    ranking = enrollment.gallery.identify(embedding)
+                    decision = norm.identify(embedding) if norm is not None else ranking
+                aceptado = bool(decision) and decision[0][1] > threshold
+                if norm is not None:
+                    print("📐 Scores normalizados (S-norm con la cohorte de la galería)")
+            for speaker, score in decision:
+                person = self.audio_comparator.speaker_name(speaker)
+                results[person] = score
+                print(f"   👤 {person}: {score:.3f}")
+        except Exception as e:
+            print(f"❌ Error comparando con los hablantes: {e}")
+            self.metricas.inc('errors', source='identificacion')
         
         # Limpiar archivo temporal
         try:
@@ -179,24 +397,33 @@ class VoiceController:
             pass
         
         # Determinar el hablante
+        self.metricas.observe('identification_seconds', time.perf_counter() - inicio)
+        # Memoria al final de cada identificación: detecta crecimiento sostenido en la sesión
+        rss = self.audio_comparator.memory.mark('identificacion')
+        if rss is not None:
+            self.metricas.set('rss_bytes', rss)
         if results:
             best_person = max(results.items(), key=lambda x: x[1])
             best_speaker = best_person[0]
             best_score = best_person[1]
             
-            # Threshold para aceptar identificación (usando los del modelo ERes2Net)
-            threshold = 0.45  # Threshold medio del modelo ERes2Net
-            
-            if best_score > threshold:
+            timing.annotate(hablante=best_speaker if aceptado else "Desconocido", score=float(best_score))
+            self.metricas.inc('identifications', result='aceptado' if aceptado else 'desconocido')
+            self.metricas.inc('decisions', speaker=best_speaker if aceptado else "Desconocido")
+            self.metricas.observe('identification_score', float(best_score),
+                                  result='aceptado' if aceptado else 'desconocido')
+            if aceptado:
                 print(f"✅ Hablante identificado: {best_speaker} (confianza: {best_score:.3f})")
                 print(f"📊 Todos los scores: {[(p, f'{s:.3f}') for p, s in sorted(results.items(), key=lambda x: x[1], reverse=True)]}")
+                if self.adaptacion_activa:
+                    self.adaptar_hablante(enrollment, embedding, ranking)
                 # Actualizar el estado del sistema
                 self.current_speaker = best_speaker
                 self.authenticated = True
                 return best_speaker
             else:
                 print(f"❓ Hablante no identificado claramente")
-                print(f"📊 Mejor resultado: {best_speaker} con {best_score:.3f} (threshold: {threshold})")
+                print(f"📊 Mejor resultado: {best_speaker} con {best_score:.3f} (threshold: {threshold:.3f})")
                 print(f"📊 Todos los scores: {[(p, f'{s:.3f}') for p, s in sorted(results.items(), key=lambda x: x[1], reverse=True)]}")
                 # Resetear el estado del sistema
                 self.current_speaker = "Desconocido"
@@ -204,11 +431,102 @@ class VoiceController:
                 return "Desconocido"
         else:
             print("❌ No se pudo realizar la identificación")
+            self.metricas.inc('identifications', result='fallido')
             # Resetear el estado del sistema
             self.current_speaker = "Desconocido"
             self.authenticated = False
             return "Desconocido"
 
+    def informe_memoria(self):
+        """Memoria de la sesión: RSS, crecimiento y bytes por modelo, galería y cascada
+        
+        Returns:
+            dict: informe de AudioComparator.memory_report, o None sin comparador
+        """
+        if not self.audio_comparator:
+            return None
+        return self.audio_comparator.memory_report()
+
+    def obtener_cascada(self):
+        """Identificador en cascada CAM++ -> modelo elegido, o None si no se puede usar
+        
+        Solo se usa si está activado, el modelo elegido no es el propio CAM++, hay
+        pesos locales de ambos y, si se calibró, los casos dudosos (los dos
+        modelos seguidos) también caben en el presupuesto de latencia. Con scores
+        normalizados no se usa: sus bandas están calibradas en coseno sin normalizar.
+        """
+        lento = self.modelo_identificacion
+        if not self.usar_cascada or not self.audio_comparator or lento == "1":
+            return None
+        if self.audio_comparator.normalizar_scores:
+            return None
+        if not all(self.audio_comparator.model_available(m) for m in ("1", lento)):
+            return None
+        if self.calibracion is not None:
+            resultados = self.calibracion['results']
+            if "1" in resultados and lento in resultados and \
+                    resultados["1"]['p95_ms'] + resultados[lento]['p95_ms'] > self.presupuesto_latencia_ms:
+                return None
+        try:
+            return self.audio_comparator.get_cascade("1", lento)
+        except Exception as e:
+            nombre = self.audio_comparator.models_config[lento]['name']
+            print(f"⚠️ Cascada no disponible, se usa solo {nombre}: {e}")
+            return None
+
+    def activar_adaptacion(self, activa=True, **opciones):
+        """Activar o desactivar la adaptación online de los hablantes
+        
+        Con la adaptación activa, cada identificación aceptada con confianza alta
+        actualiza el centroide del hablante en la galería del modelo elegido (y en
+        la de cada etapa de la cascada). Las opciones (peso, historial, score
+        y margen mínimos, límites por sesión) se pasan a EnrollmentManager.enable_adaptation.
+        """
+        self.adaptacion_activa = activa
+        if not self.audio_comparator:
+            return
+        # El modelo de identificación se elige al precalentar: hasta entonces no se sabe qué galería usar
+        self.esperar_precalentamiento()
+        # Con la cascada decide (y se adapta) la galería de la etapa que da el resultado:
+        # la adaptación se activa en la de cada etapa
+        modelos = {self.modelo_identificacion}
+        cascada = self.obtener_cascada()
+        if cascada is not None:
+            modelos.update(etapa['choice'] for etapa in cascada.stages)
+        for modelo in sorted(modelos):
+            enrollment = self.audio_comparator.get_enrollment(modelo)
+            if activa:
+                enrollment.enable_adaptation(**opciones)
+            else:
+                enrollment.disable_adaptation()
+        print(f"🧠 Adaptación online {'activada' if activa else 'desactivada'}")
+
+    def adaptar_hablante(self, enrollment, embedding, ranking):
+        """Actualizar el centroide del mejor hablante con la grabación aceptada"""
+        speaker = ranking[0][0]
+        updated, motivo = enrollment.adapt(speaker, embedding, ranking, session_id=self.sesion_id)
+        if updated:
+            self.ultima_adaptacion = (speaker, enrollment)
+            print(f"🧠 Modelo de {self.audio_comparator.speaker_name(speaker)} adaptado con esta grabación")
+        elif enrollment.adaptation is None:
+            # La adaptación está activa pero no en la galería que decidió: no debería pasar
+            self.metricas.inc('errors', source='adaptacion')
+            print("⚠️ Sin adaptación: la galería que decidió no tiene la adaptación activada")
+        else:
+            print(f"🧠 Sin adaptación: {motivo}")
+
+    def deshacer_adaptacion(self):
+        """Deshacer la última adaptación realizada en esta sesión"""
+        if self.ultima_adaptacion is None:
+            print("⚠️  No hay adaptaciones que deshacer")
+            return False
+        speaker, enrollment = self.ultima_adaptacion
+        self.ultima_adaptacion = None
+        if enrollment.rollback(speaker):
+            print(f"↩️  Última adaptación de {self.audio_comparator.speaker_name(speaker)} deshecha")
+            return True
+        return False
+
     def ejecutar_comando(self, comando):
         """Ejecutar comando si el hablante tiene permisos"""
         comando_original = comando
@@ -336,7 +654,7 @@ class VoiceController:
                     audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=5)
                     
                     print("🔄 Procesando audio...")
-                    comando = self.recognizer.recognize_google(audio, language="es-ES")
+                    comando = self.reconocer_comando(audio)
                     print(f"📣 Comando reconocido: '{comando}'")
                     
                     self.ejecutar_comando(comando)
@@ -471,6 +789,9 @@ class VoiceController:
                     print("2. 🎯 Probar identificación")
                     print("3. 📊 Información del sistema")
                     print("4. 🔧 Diagnóstico de problemas")
+                    estado = "activada" if self.adaptacion_activa else "desactivada"
+                    print(f"5. 🧠 Adaptación online de hablantes ({estado})")
+                    print("6. ↩️  Deshacer la última adaptación")
                     print("0. Volver al menú principal")
                     
                     config_opcion = input("\nSelecciona una opción: ").strip()
@@ -486,6 +807,10 @@ class VoiceController:
                         self.mostrar_info_sistema()
                     elif config_opcion == "4":
                         self.diagnosticar_problemas()
+                    elif config_opcion == "5":
+                        self.activar_adaptacion(not self.adaptacion_activa)
+                    elif config_opcion == "6":
+                        self.deshacer_adaptacion()
                     
                     input("\nPresiona Enter para continuar...")
                 
@@ -541,7 +866,7 @@ class VoiceController:
                 audio = self.recognizer.listen(source, timeout=1, phrase_time_limit=duracion)
                 
                 print("🔄 Procesando comando...")
-                comando = self.recognizer.recognize_google(audio, language="es-ES")
+                comando = self.reconocer_comando(audio)
                 print(f"📣 Comando reconocido: '{comando}'")
                 
                 # Ejecutar comando
@@ -579,7 +904,7 @@ class VoiceController:
                         break
                     
                     print("🔄 Procesando audio...")
-                    comando = self.recognizer.recognize_google(audio, language="es-ES")
+                    comando = self.reconocer_comando(audio)
                     print(f"📣 Comando reconocido: '{comando}'")
                     
                     if "salir" in comando.lower() or "terminar" in comando.lower():
@@ -625,51 +950,85 @@ class VoiceController:
             print("🛑 Señal de parada enviada...")
             self.stop_listening = True
 
+    def reconocer_comando(self, audio):
+        """Pasar a texto el audio de un comando, midiendo la latencia del reconocimiento"""
+        inicio = time.perf_counter()
+        try:
+            comando = self.recognizer.recognize_google(audio, language="es-ES")
+        except sr.UnknownValueError:
+            self.metricas.inc('recognitions', result='no_entendido')
+            raise
+        except sr.RequestError:
+            self.metricas.inc('recognitions', result='error')
+            self.metricas.inc('errors', source='reconocimiento')
+            raise
+        finally:
+            self.metricas.observe('recognition_seconds', time.perf_counter() - inicio)
+        self.metricas.inc('recognitions', result='ok')
+        return comando
+
     def ejecutar_comando_simple(self, comando):
         """Ejecutar comando simple sin autenticación (ya autenticado)"""
+        with self.metricas.timer('command_execution_seconds'):
+            resultado = self._ejecutar_comando_simple(comando)
+        self.metricas.inc('commands', result=resultado)
+        return resultado
+
+    def _ejecutar_comando_simple(self, comando):
+        """Ejecutar el comando; devuelve ejecutado, denegado, error o no_reconocido"""
         comando_original = comando
         comando = comando.lower()
         
         # Verificar permisos
         if not self.verificar_permisos(comando, self.current_speaker):
             print(f"🚫 {self.current_speaker} no tiene permisos para: '{comando_original}'")
-            return
+            return "denegado"
         
         # Ejecutar comandos específicos
         if any(word in comando for word in ["bloc de notas", "notepad", "editor"]):
             try:
                 subprocess.Popen(["notepad.exe"])
                 print(f"✅ {self.current_speaker}: Bloc de notas abierto")
+                return "ejecutado"
             except Exception as e:
                 print(f"❌ Error abriendo bloc de notas: {e}")
+                return "error"
                 
         elif any(word in comando for word in ["navegador", "chrome", "browser"]):
             try:
                 subprocess.Popen(["start", "chrome"], shell=True)
                 print(f"✅ {self.current_speaker}: Navegador abierto")
+                return "ejecutado"
             except Exception as e:
                 print(f"❌ Error abriendo navegador: {e}")
+                return "error"
                 
         elif any(word in comando for word in ["explorador", "archivos", "explorer"]):
             try:
                 subprocess.Popen(["explorer"])
                 print(f"✅ {self.current_speaker}: Explorador abierto")
+                return "ejecutado"
             except Exception as e:
                 print(f"❌ Error abriendo explorador: {e}")
+                return "error"
                 
         elif any(word in comando for word in ["calculadora", "calc"]):
             try:
                 subprocess.Popen(["calc"])
                 print(f"✅ {self.current_speaker}: Calculadora abierta")
+                return "ejecutado"
             except Exception as e:
                 print(f"❌ Error abriendo calculadora: {e}")
+                return "error"
                 
         elif any(word in comando for word in ["buscar", "buscador"]):
             try:
                 subprocess.Popen(["start", "ms-settings:search"], shell=True)
                 print(f"✅ {self.current_speaker}: Buscador abierto")
+                return "ejecutado"
             except Exception as e:
                 print(f"❌ Error abriendo buscador: {e}")
+                return "error"
                 
         else:
             print(f"🤔 Comando '{comando_original}' no reconocido")
@@ -677,6 +1036,7 @@ class VoiceController:
             user_permisos = self.obtener_permisos(self.current_speaker)
             for permiso in user_permisos:
                 print(f"   • {permiso}")
+            return "no_reconocido"
 
     def configurar_microfono(self):
         """Configurar y probar el micrófono"""
@@ -740,28 +1100,38 @@ class VoiceController:
                     available = any(os.path.exists(path) for path in model['model_paths'])
                     status = "✅" if available else "❌"
                     print(f"      {key}. {model['name']} {status}")
+            if self.calibracion is not None:
+                elegido = self.calibracion['choice']
+                print(f"   📐 Modelo de identificación: {self.audio_comparator.models_config[elegido]['name']} "
+                      f"(p95 {self.calibracion['results'][elegido]['p95_ms']:.0f} ms, "
+                      f"presupuesto {self.presupuesto_latencia_ms:.0f} ms)")
         else:
             print("❌ Audio Comparator: No disponible")
         
+        # Telemetría de la identificación en cascada
+        if self.audio_comparator and self.audio_comparator.cascades:
+            print("\n🪜 Identificación en cascada:")
+            for cascada in self.audio_comparator.cascades.values():
+                resumen = cascada.summary()
+                for etapa, (aciertos, impostores) in resumen['calibration_pairs'].items():
+                    print(f"   📐 Banda de {etapa}: {aciertos} aciertos y {impostores} impostores de calibración")
+                if not resumen['requests']:
+                    print("   Sin identificaciones todavía")
+                    continue
+                print(f"   Identificaciones: {resumen['requests']}, latencia media: {resumen['mean_latency'] * 1000:.0f} ms")
+                for etapa, n in resumen['decided_by'].items():
+                    print(f"   • Decididas por {etapa}: {n}")
+                if resumen['saved_latency'] is not None:
+                    print(f"   ⏱️  Ahorro medio frente a usar solo el último modelo: {resumen['saved_latency'] * 1000:.0f} ms")
+        
         # Archivos de referencia
         print("\n📁 Archivos de referencia:")
-        reference_files = {
-            "Daniel": [
-                "data/daniel_2/record_out (11).wav",
-                "data/daniel_2/audio_01.wav",
-                "data/daniel_2/record_out.wav"
-            ],
-            "Hablante_1": [
-                "data/hablante_1/hablante_1_02.wav",
-                "data/hablante_1/hablante_1_01.wav", 
-                "data/hablante_1/hablante_1_03.wav"
-            ]
-        }
-        
-        for person, files in reference_files.items():
-            available_files = [f for f in files if os.path.exists(f)]
-            status = f"{len(available_files)}/{len(files)} disponibles"
-            print(f"   👤 {person}: {status}")
+        if self.audio_comparator:
+            reference_files = self.audio_comparator.get_reference_speakers()
+            for person, files in reference_files.items():
+                print(f"   👤 {person}: {len(files)} disponibles")
+            if not reference_files:
+                print("   ❌ No hay carpetas de hablantes en data/")
         
         # Dependencias
         print("\n📦 Dependencias:")
@@ -800,25 +1170,12 @@ class VoiceController:
         
         # 2. Verificar archivos de referencia
         print("\n2. 📁 Verificando archivos de referencia...")
-        reference_files = {
-            "Daniel": [
-                "data/daniel_2/record_out (11).wav",
-                "data/daniel_2/audio_01.wav",
-                "data/daniel_2/record_out.wav"
-            ],
-            "Hablante_1": [
-                "data/hablante_1/hablante_1_02.wav",
-                "data/hablante_1/hablante_1_01.wav", 
-                "data/hablante_1/hablante_1_03.wav"
-            ]
-        }
+        reference_files = self.audio_comparator.get_reference_speakers() if self.audio_comparator else {}
         
         for person, files in reference_files.items():
-            available_files = [f for f in files if os.path.exists(f)]
-            if available_files:
-                print(f"   ✅ {person}: {len(available_files)} archivos disponibles")
-            else:
-                print(f"   ❌ {person}: No hay archivos disponibles")
+            print(f"   ✅ {person}: {len(files)} archivos disponibles")
+        if not reference_files:
+            print("   ❌ No hay archivos disponibles en data/<hablante>/")
         
         # 3. Verificar modelos
         print("\n3. 🤖 Verificando modelos...")
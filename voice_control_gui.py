@@ -13,7 +13,8 @@ import sys
 from datetime import datetime
 import queue
 
-# Importar el sistema de control por voz
+# Importar el sistema de control por voz (ligero: torch y los modelos se
+# cargan al crear el VoiceController, en segundo plano)
 try:
     from voice_control import VoiceController
     VOICE_CONTROL_AVAILABLE = True
@@ -44,6 +45,14 @@ class VoiceControlGUI:
         self.is_identifying = tk.BooleanVar(value=False)
         self.listening_thread = None
         self.log_queue = queue.Queue()
+        # Identificación pedida antes de que los modelos estuvieran listos
+        self.identification_queued = False
+        # Ventana de estadísticas (se refresca desde process_log_queue)
+        self.start_time = time.time()
+        self.log_errors = 0
+        self.stats_window = None
+        self.stats_text = None
+        self.stats_refreshed = 0
         
         # Inicializar controlador de voz
         self.init_voice_controller()
@@ -54,6 +63,9 @@ class VoiceControlGUI:
         # Iniciar procesamiento de logs
         self.process_log_queue()
         
+        # Indicador de modelos listos
+        self.update_readiness()
+        
         # Configurar cierre de ventana
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
@@ -126,17 +138,92 @@ class VoiceControlGUI:
                            padding=(10, 5))
 
     def init_voice_controller(self):
-        """Inicializar controlador de voz"""
-        if VOICE_CONTROL_AVAILABLE:
+        """Inicializar controlador de voz en segundo plano
+        
+        Cargar torch y el comparador de audio tarda varios segundos: la ventana
+        se muestra enseguida y el controlador se activa cuando termina la carga.
+        """
+        self.voice_controller = None
+        self.controller_loading = VOICE_CONTROL_AVAILABLE
+        if not VOICE_CONTROL_AVAILABLE:
+            self.log_message("❌ Sistema de control por voz no disponible", "ERROR")
+            return
+        
+        self.log_message("⏳ Cargando sistema de control por voz...", "INFO")
+        self.loaded_controller = queue.Queue(maxsize=1)
+        
+        def load_worker():
+            start = time.perf_counter()
             try:
-                self.voice_controller = VoiceController()
-                self.log_message("✅ Sistema de control por voz inicializado correctamente", "SUCCESS")
+                controller = VoiceController()
+                self.log_message(f"✅ Sistema de control por voz inicializado correctamente "
+                                 f"({time.perf_counter() - start:.1f}s)", "SUCCESS")
             except Exception as e:
-                self.voice_controller = None
+                controller = None
                 self.log_message(f"❌ Error inicializando sistema de voz: {e}", "ERROR")
+            self.loaded_controller.put(controller)
+        
+        threading.Thread(target=load_worker, daemon=True).start()
+        self.root.after(100, self.check_voice_controller)
+
+    def check_voice_controller(self):
+        """Activar el controlador cuando termina la carga (en el hilo de Tk)"""
+        try:
+            controller = self.loaded_controller.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self.check_voice_controller)
+            return
+        
+        self.voice_controller = controller
+        self.controller_loading = False
+        if controller:
+            # Trabajo pendiente en la interfaz, para el endpoint de métricas
+            controller.metricas.register_gauge('gui_log_queue_depth', self.log_queue.qsize)
+            controller.metricas.register_gauge('gui_queued_identifications', lambda: int(self.identification_queued))
+        if controller and controller.audio_comparator:
+            self.audio_label.configure(text="Disponible", style='Success.TLabel')
         else:
-            self.voice_controller = None
-            self.log_message("❌ Sistema de control por voz no disponible", "ERROR")
+            self.audio_label.configure(text="No disponible", style='Error.TLabel')
+        self.update_commands_list()
+
+    def models_ready(self):
+        """True cuando el controlador terminó de cargar y de precalentar los modelos"""
+        if self.controller_loading:
+            return False
+        controller = self.voice_controller
+        return controller is None or controller.precalentamiento_listo.is_set()
+
+    def update_readiness(self):
+        """Actualizar el indicador de modelos y lanzar la identificación en cola"""
+        controller = self.voice_controller
+        if self.controller_loading:
+            text, style = "Cargando sistema...", 'Warning.TLabel'
+        elif not controller or not controller.audio_comparator:
+            text, style = "No disponible", 'Error.TLabel'
+        elif controller.estado_precalentamiento == "listo":
+            text, style = f"Listos ({controller.tiempo_precalentamiento:.1f}s)", 'Success.TLabel'
+        elif controller.estado_precalentamiento == "error":
+            text, style = "Error al precalentar", 'Error.TLabel'
+        else:
+            text, style = "Calentando...", 'Warning.TLabel'
+        self.models_label.configure(text=text, style=style)
+        
+        if not self.models_ready():
+            self.root.after(250, self.update_readiness)
+        elif self.identification_queued:
+            self.identification_queued = False
+            self.log_message("▶️ Modelos listos, iniciando la identificación en cola", "INFO")
+            self.identify_speaker()
+
+    def require_voice_controller(self):
+        """True si el controlador está listo; si no, avisa al usuario"""
+        if self.voice_controller:
+            return True
+        if self.controller_loading:
+            messagebox.showinfo("Cargando", "El sistema de voz aún se está cargando, inténtalo en unos segundos")
+        else:
+            messagebox.showerror("Error", "Sistema de voz no disponible")
+        return False
 
     def create_widgets(self):
         """Crear todos los widgets de la interfaz"""
@@ -252,25 +339,37 @@ class VoiceControlGUI:
         ttk.Label(status_frame, text="🔊 Audio:", 
                  style='Status.TLabel').grid(row=2, column=0, sticky=tk.W, pady=(0, 5))
         
-        audio_status = "Disponible" if self.voice_controller and self.voice_controller.audio_comparator else "No disponible"
-        self.audio_label = ttk.Label(status_frame, text=audio_status, 
-                                    style='Success.TLabel' if self.voice_controller else 'Error.TLabel')
+        if self.controller_loading:
+            audio_status, audio_style = "Cargando...", 'Warning.TLabel'
+        elif self.voice_controller and self.voice_controller.audio_comparator:
+            audio_status, audio_style = "Disponible", 'Success.TLabel'
+        else:
+            audio_status, audio_style = "No disponible", 'Error.TLabel'
+        self.audio_label = ttk.Label(status_frame, text=audio_status, style=audio_style)
         self.audio_label.grid(row=2, column=1, sticky=tk.W, padx=(10, 0), pady=(0, 5))
         
+        # Modelos de identificación (se precalientan en segundo plano)
+        ttk.Label(status_frame, text="🔥 Modelos:", 
+                 style='Status.TLabel').grid(row=3, column=0, sticky=tk.W, pady=(0, 5))
+        
+        self.models_label = ttk.Label(status_frame, text="Cargando...", 
+                                     style='Warning.TLabel')
+        self.models_label.grid(row=3, column=1, sticky=tk.W, padx=(10, 0), pady=(0, 5))
+        
         # Separador
-        ttk.Separator(status_frame, orient='horizontal').grid(row=3, column=0, 
+        ttk.Separator(status_frame, orient='horizontal').grid(row=4, column=0, 
                                                             columnspan=2, 
                                                             sticky=(tk.W, tk.E), 
                                                             pady=10)
         
         # Comandos disponibles
         ttk.Label(status_frame, text="🎤 Comandos Disponibles:", 
-                 style='Heading.TLabel').grid(row=4, column=0, columnspan=2, 
+                 style='Heading.TLabel').grid(row=5, column=0, columnspan=2, 
                                             sticky=tk.W, pady=(0, 10))
         
         # Lista de comandos
         self.commands_frame = ttk.Frame(status_frame)
-        self.commands_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.commands_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         self.commands_text = tk.Text(self.commands_frame, height=8, width=40,
                                     font=('Consolas', 9), 
@@ -362,6 +461,8 @@ class VoiceControlGUI:
                 
                 # Insertar mensaje con color según el nivel
                 self.log_text.insert(tk.END, f"{message}\n", level)
+                if level == "ERROR":
+                    self.log_errors += 1
                 
                 # Scroll automático
                 self.log_text.see(tk.END)
@@ -370,6 +471,10 @@ class VoiceControlGUI:
         except queue.Empty:
             pass
         
+        # Estadísticas en vivo, como mucho una vez por segundo
+        if self.stats_text is not None and time.time() - self.stats_refreshed >= 1.0:
+            self.refresh_statistics()
+        
         # Programar siguiente procesamiento
         self.root.after(100, self.process_log_queue)
 
@@ -398,7 +503,10 @@ class VoiceControlGUI:
         self.commands_text.delete(1.0, tk.END)
         
         if not self.voice_controller:
-            self.commands_text.insert(tk.END, "❌ Sistema de voz no disponible\n")
+            if self.controller_loading:
+                self.commands_text.insert(tk.END, "⏳ Cargando sistema de voz...\n")
+            else:
+                self.commands_text.insert(tk.END, "❌ Sistema de voz no disponible\n")
             return
         
         current_speaker = self.current_speaker.get()
@@ -432,8 +540,15 @@ class VoiceControlGUI:
 
     def identify_speaker(self):
         """Identificar al hablante"""
-        if not self.voice_controller:
-            messagebox.showerror("Error", "Sistema de voz no disponible")
+        if not self.models_ready():
+            # Se ejecutará sola cuando terminen de cargarse los modelos
+            if not self.identification_queued:
+                self.identification_queued = True
+                self.log_message("⏳ Identificación en cola: empezará cuando los modelos estén listos", "INFO")
+                self.set_status("Identificación en cola...", "WARNING")
+            return
+        
+        if not self.require_voice_controller():
             return
         
         if self.is_identifying.get():
@@ -504,8 +619,7 @@ class VoiceControlGUI:
 
     def single_voice_command(self):
         """Ejecutar un comando de voz único"""
-        if not self.voice_controller:
-            messagebox.showerror("Error", "Sistema de voz no disponible")
+        if not self.require_voice_controller():
             return
         
         if self.current_speaker.get() == "No identificado":
@@ -558,8 +672,7 @@ class VoiceControlGUI:
 
     def toggle_continuous_listening(self):
         """Alternar escucha continua"""
-        if not self.voice_controller:
-            messagebox.showerror("Error", "Sistema de voz no disponible")
+        if not self.require_voice_controller():
             return
         
         if self.current_speaker.get() == "No identificado":
@@ -616,8 +729,7 @@ class VoiceControlGUI:
 
     def show_permissions(self):
         """Mostrar ventana de permisos"""
-        if not self.voice_controller:
-            messagebox.showerror("Error", "Sistema de voz no disponible")
+        if not self.require_voice_controller():
             return
         
         # Crear ventana de permisos
@@ -682,8 +794,7 @@ class VoiceControlGUI:
 
     def show_config(self):
         """Mostrar ventana de configuración"""
-        if not self.voice_controller:
-            messagebox.showerror("Error", "Sistema de voz no disponible")
+        if not self.require_voice_controller():
             return
         
         # Crear ventana de configuración
@@ -750,24 +861,13 @@ class VoiceControlGUI:
         
         # Archivos de referencia
         info_text.insert(tk.END, "📁 Archivos de referencia:\n", "HEADER")
-        reference_files = {
-            "Daniel": [
-                "data/daniel_2/record_out (11).wav",
-                "data/daniel_2/audio_01.wav",
-                "data/daniel_2/record_out.wav"
-            ],
-            "Hablante_1": [
-                "data/hablante_1/hablante_1_02.wav",
-                "data/hablante_1/hablante_1_01.wav", 
-                "data/hablante_1/hablante_1_03.wav"
-            ]
-        }
+        comparator = getattr(self.voice_controller, 'audio_comparator', None)
+        reference_files = comparator.get_reference_speakers() if comparator else {}
         
         for person, files in reference_files.items():
-            available_files = [f for f in files if os.path.exists(f)]
-            status = f"{len(available_files)}/{len(files)} disponibles"
-            color = "SUCCESS" if len(available_files) > 0 else "ERROR"
-            info_text.insert(tk.END, f"   👤 {person}: {status}\n", color)
+            info_text.insert(tk.END, f"   👤 {person}: {len(files)} disponibles\n", "SUCCESS")
+        if not reference_files:
+            info_text.insert(tk.END, "   ❌ No hay carpetas de hablantes en data/\n", "ERROR")
         
         # Dependencias
         info_text.insert(tk.END, "\n📦 Dependencias:\n", "HEADER")
@@ -912,10 +1012,14 @@ class VoiceControlGUI:
         thread.start()
 
     def show_statistics(self):
-        """Mostrar estadísticas del sistema"""
+        """Mostrar estadísticas del sistema (se actualizan mientras la ventana esté abierta)"""
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        
         stats_window = tk.Toplevel(self.root)
         stats_window.title("📊 Estadísticas del Sistema")
-        stats_window.geometry("500x400")
+        stats_window.geometry("560x600")
         stats_window.configure(bg=self.colors['bg_dark'])
         stats_window.transient(self.root)
         
@@ -931,7 +1035,34 @@ class VoiceControlGUI:
                                               borderwidth=0)
         stats_text.pack(fill=tk.BOTH, expand=True)
         
-        # Mostrar estadísticas
+        self.stats_window = stats_window
+        self.stats_text = stats_text
+        stats_window.protocol("WM_DELETE_WINDOW", self.close_statistics)
+        self.refresh_statistics()
+
+    def close_statistics(self):
+        """Cerrar la ventana de estadísticas y dejar de refrescarla"""
+        self.stats_text = None
+        if self.stats_window is not None:
+            self.stats_window.destroy()
+            self.stats_window = None
+
+    def refresh_statistics(self):
+        """Volver a escribir el texto de la ventana de estadísticas"""
+        self.stats_refreshed = time.time()
+        if not self.stats_window or not self.stats_window.winfo_exists():
+            self.stats_text = None
+            return
+        position = self.stats_text.yview()[0]
+        self.stats_text.config(state=tk.NORMAL)
+        self.stats_text.delete(1.0, tk.END)
+        self.stats_text.insert(tk.END, self.statistics_text())
+        self.stats_text.config(state=tk.DISABLED)
+        self.stats_text.yview_moveto(position)
+
+    def statistics_text(self):
+        """Texto de la ventana de estadísticas a partir de las métricas del controlador"""
+        uptime = int(time.time() - self.start_time)
         stats_content = """
 📊 ESTADÍSTICAS DEL SISTEMA
 =============================
@@ -941,32 +1072,100 @@ class VoiceControlGUI:
 🎤 Sistema de Audio: {audio_status}
 ⏱️ Tiempo Activo: {uptime}
 
-📈 MÉTRICAS:
-• Identificaciones Exitosas: N/A
-• Comandos Ejecutados: N/A
-• Errores Registrados: N/A
-• Precisión Media: N/A
-
 🎯 CONFIGURACIÓN ACTUAL:
 • Threshold: {threshold}
 • Duración ID: {id_duration}s
 • Duración CMD: {cmd_duration}s
-
-💾 ARCHIVOS:
-• Logs Guardados: Consultar carpeta
-• Configuración: Archivo local
-        """.format(
+""".format(
             current_user=self.current_speaker.get(),
             auth_status="Autenticado" if self.current_speaker.get() != "No identificado" else "No autenticado",
             audio_status="Disponible" if self.voice_controller and self.voice_controller.audio_comparator else "No disponible",
-            uptime="Sesión actual",
+            uptime=f"{uptime // 3600}h {uptime % 3600 // 60:02d}m {uptime % 60:02d}s",
             threshold=self.threshold_var.get() if hasattr(self, 'threshold_var') else "0.45",
             id_duration=self.id_duration_var.get() if hasattr(self, 'id_duration_var') else "3",
             cmd_duration=self.cmd_duration_var.get() if hasattr(self, 'cmd_duration_var') else "5"
         )
         
-        stats_text.insert(tk.END, stats_content)
-        stats_text.config(state=tk.DISABLED)
+        if not self.voice_controller:
+            return stats_content + f"""
+📈 MÉTRICAS:
+• Sistema de voz no cargado
+• Errores en el log: {self.log_errors}
+"""
+        
+        metricas = self.voice_controller.metricas
+        
+        def latencia(nombre):
+            resumen = metricas.summary(nombre)
+            if not resumen['count']:
+                return "sin datos"
+            return (f"{resumen['p50'] * 1000:.0f} / {resumen['p95'] * 1000:.0f} / "
+                    f"{resumen['max'] * 1000:.0f} ms (n={resumen['count']})")
+        
+        def porcentaje(parte, total):
+            return f"{100 * parte / total:.1f}%" if total else "N/A"
+        
+        identificaciones = metricas.by_label('identifications', 'result')
+        aceptadas = identificaciones.get('aceptado', 0)
+        rechazadas = identificaciones.get('desconocido', 0)
+        comandos = metricas.by_label('commands', 'result')
+        cache = metricas.by_label('model_cache', 'result')
+        score = metricas.summary('identification_score', result='aceptado')
+        
+        stats_content += f"""
+📈 MÉTRICAS:
+• Identificaciones Exitosas: {aceptadas} de {sum(identificaciones.values())}
+• Rechazadas (hablante desconocido): {rechazadas}
+• Tasa de Aceptación: {porcentaje(aceptadas, aceptadas + rechazadas)}
+• Score Medio Aceptadas: {f"{score['mean']:.3f}" if score['count'] else "N/A"}
+• Comandos Ejecutados: {comandos.get('ejecutado', 0)}
+• Comandos Denegados / No Reconocidos: {comandos.get('denegado', 0)} / {comandos.get('no_reconocido', 0)}
+• Errores Registrados: {metricas.total('errors') + comandos.get('error', 0)} (log: {self.log_errors})
+
+⏱️ LATENCIAS (p50 / p95 / máx):
+• Identificación: {latencia('identification_seconds')}
+• Reconocimiento de Comando: {latencia('recognition_seconds')}
+• Ejecución de Comando: {latencia('command_execution_seconds')}
+• Carga de Modelo: {latencia('model_load_seconds')}
+
+🧠 CACHÉ DE MODELOS:
+• Aciertos / Fallos: {cache.get('hit', 0)} / {cache.get('miss', 0)} ({porcentaje(cache.get('hit', 0), sum(cache.values()))} aciertos)
+"""
+        decisiones = metricas.by_label('decisions', 'speaker')
+        if decisiones:
+            stats_content += "\n👥 DECISIONES POR HABLANTE:\n"
+            for hablante, n in sorted(decisiones.items(), key=lambda x: x[1], reverse=True):
+                stats_content += f"• {hablante}: {n}\n"
+        return stats_content + self.memory_text()
+
+    def memory_text(self):
+        """Sección de memoria: RSS, crecimiento en la sesión y qué retiene cada caché"""
+        mb = lambda n: f"{n / 2**20:.1f} MB" if n is not None else "N/A"
+        # El log de la interfaz también crece durante la sesión
+        log_lines = int(self.log_text.index('end-1c').split('.')[0])
+        log_chars = (self.log_text.count('1.0', tk.END, 'chars') or (0,))[0]
+        text = "\n💾 MEMORIA:\n"
+        informe = self.voice_controller.informe_memoria()
+        if informe is None:
+            return text + f"• Log de la interfaz: {log_lines} líneas, {log_chars} caracteres\n"
+        
+        crecimiento = informe['growth']
+        if crecimiento['flagged']:
+            estado = f"⚠️ CRECIENDO (+{mb(crecimiento['rise'])} en las últimas {crecimiento['marks']} identificaciones)"
+        elif crecimiento['rise'] is not None:
+            estado = f"estable ({'+' if crecimiento['rise'] >= 0 else ''}{mb(crecimiento['rise'])} en {crecimiento['marks']} identificaciones)"
+        else:
+            estado = "sin datos"
+        text += f"• RSS: {mb(informe['rss'])} (inicio {mb(informe['start_rss'])}, pico {mb(informe['peak_rss'])})\n"
+        text += f"• Tendencia: {estado}\n"
+        for nombre, valor in informe['torch'].items():
+            text += f"• torch {nombre}: {mb(valor)}\n"
+        for nombre, valor in sorted(informe['held'].items(), key=lambda x: x[1], reverse=True):
+            text += f"• {nombre}: {mb(valor)}\n"
+        for etapa, info in informe['stages'].items():
+            text += f"• Etapa {etapa}: máx. +{mb(info['max_delta'])} (n={info['count']})\n"
+        text += f"• Log de la interfaz: {log_lines} líneas, {log_chars} caracteres\n"
+        return text
 
     def save_settings(self):
         """Guardar configuración"""